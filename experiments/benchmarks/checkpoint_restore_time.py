@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+'''
+Measures how long a restarted Pluribus takes to put principals' rules
+back on the switch from its checkpoint, next to how long principals
+took to push them in the first place.
+
+Starts Pluribus in its own process, connects a stand-in switch and
+acts as the principal controllers listed in Pluribus's principals
+file.  Each principal pushes its rules, then Pluribus is stopped as
+soon as it has checkpointed them and started again, with a new
+stand-in switch and controllers that push nothing.  Reports how long
+the first push took, how long the restart took to connect to every
+principal, and how many rules the switch had by then.
+
+Run from the directory that holds the pluribus.conf Pluribus should
+use; it must set CHECKPOINT_FILENAME (to the file passed with -c)
+and, to keep the run short, a small CHECKPOINT_PERIOD.  Its
+principals file must be the one passed with -j.  Eg.,
+
+    python checkpoint_restore_time.py -j principals.json -c pluribus.ckpt -n 10000
+'''
+import sys
+import os
+import json
+import subprocess
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+
+from ryu.lib import hub
+
+from stand_in_switch import StandInSwitch
+from flow_mod_load_generator import StandInPrincipalController
+from port_util import num_logical_port_pairs_from_num_principals
+from checkpoint import load_checkpoint
+from switch_reconnect_time import APPS, connect_switch, wait_for_acks
+
+
+# seconds between checks for a new checkpoint
+CHECKPOINT_POLL_PERIOD = .01
+
+
+def start(principal_dicts,app,ofp_port,num_physical_ports,deadline,
+          output):
+    '''
+    @returns {tuple} --- (Pluribus process, switch, controllers).
+    switch is None if it could not connect.
+    '''
+    controllers = []
+    for principal_id, principal_dict in enumerate(principal_dicts):
+        controller = StandInPrincipalController(
+            principal_id,
+            (principal_dict['listening_ip_addr'],
+             int(principal_dict['listening_port_addr'])),
+            principal_dict['physical_ports'])
+        hub.spawn(controller.listen)
+        controllers.append(controller)
+
+    switch = StandInSwitch(
+        num_physical_ports,
+        num_logical_port_pairs_from_num_principals(len(principal_dicts)),
+        record_received=False)
+    process = subprocess.Popen(
+        [sys.executable,'-m','ryu.cmd.manager','--ofp-tcp-listen-port',
+         str(ofp_port),app],
+        stdout=output,stderr=output)
+    if not connect_switch(switch,ofp_port,deadline):
+        switch = None
+    return process, switch, controllers
+
+def stop(process,switch):
+    process.terminate()
+    process.wait()
+    if switch is not None:
+        switch.stop()
+
+def wait_for_handshakes(controllers,deadline):
+    for controller in controllers:
+        if not controller.handshake_event.wait(
+            max(deadline - time.time(),0)):
+            return False
+    return True
+
+def num_checkpointed_rules(checkpoint_filename):
+    checkpoint = load_checkpoint(checkpoint_filename)
+    if checkpoint is None:
+        return 0
+    try:
+        return sum(1 for _ in checkpoint.iter_rules())
+    finally:
+        checkpoint.close()
+
+def run(principals_filename,checkpoint_filename,app,ofp_port,num_flow_mods,
+        num_physical_ports,timeout,verbose):
+    with open(principals_filename,'r') as fd:
+        principal_dicts = json.load(fd)
+    if os.path.exists(checkpoint_filename):
+        os.remove(checkpoint_filename)
+
+    output = None
+    if not verbose:
+        output = open(os.devnull,'w')
+    deadline = time.time() + timeout
+    try:
+        #### first run: principals push their rules
+        process, switch, controllers = start(
+            principal_dicts,app,ofp_port,num_physical_ports,deadline,output)
+        try:
+            if (switch is None) or (
+                not wait_for_handshakes(controllers,deadline)):
+                print 'First run never started'
+                return
+            push_start = time.time()
+            for controller in controllers:
+                controller.send_flow_mods(num_flow_mods,num_flow_mods)
+            if not wait_for_acks(controllers,deadline):
+                print 'Rules never acknowledged'
+                return
+            push_elapsed = time.time() - push_start
+            num_rules = switch.flow_table.num_entries
+
+            # a checkpoint that was being written when the push
+            # finished may only have some of them.
+            num_pushed = len(controllers)*num_flow_mods
+            while num_checkpointed_rules(checkpoint_filename) < num_pushed:
+                if time.time() > deadline:
+                    print 'Never checkpointed'
+                    return
+                hub.sleep(CHECKPOINT_POLL_PERIOD)
+            checkpoint_size = os.stat(checkpoint_filename).st_size
+        finally:
+            stop(process,switch)
+
+        #### restart: principals push nothing
+        restart_start = time.time()
+        process, switch, controllers = start(
+            principal_dicts,app,ofp_port,num_physical_ports,deadline,output)
+        try:
+            if (switch is None) or (
+                not wait_for_handshakes(controllers,deadline)):
+                print 'Restart never connected to principals'
+                return
+            restart_elapsed = time.time() - restart_start
+            num_restored_rules = switch.flow_table.num_entries
+        finally:
+            stop(process,switch)
+    finally:
+        if output is not None:
+            output.close()
+
+    print 'checkpoint:                 %i bytes' % checkpoint_size
+    print 'principals pushed rules in: %.3fs' % push_elapsed
+    print 'restarted and connected in: %.3fs' % restart_elapsed
+    print 'rules on switch:            %i before, %i after restarting' % (
+        num_rules,num_restored_rules)
+
+
+if __name__ == '__main__':
+    description = 'Time for a restarted Pluribus to restore its rules'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-j','--principals_file',required=True,
+        help='Principals JSON file that Pluribus loads')
+    parser.add_argument(
+        '-c','--checkpoint_file',required=True,
+        help='CHECKPOINT_FILENAME of Pluribus\'s pluribus.conf.  Gets ' +
+        'deleted before starting')
+    parser.add_argument(
+        '-a','--app',choices=sorted(APPS.keys()),default='logical',
+        help='Which Pluribus switch to run')
+    parser.add_argument(
+        '-o','--port',help='Port for Pluribus\'s OpenFlow listener',
+        default=16633)
+    parser.add_argument(
+        '-n','--num_flow_mods',help='Rules each principal pushes',
+        default=1000)
+    parser.add_argument(
+        '-p','--num_physical_ports',
+        help='Physical ports on the switch; must include every ' +
+        'principal\'s',default=4)
+    parser.add_argument(
+        '-t','--timeout',help='Seconds to wait for everything',default=60.)
+    parser.add_argument(
+        '-v','--verbose',action='store_true',
+        help='Show Pluribus\'s output')
+    args = parser.parse_args()
+
+    run(
+        args.principals_file,args.checkpoint_file,APPS[args.app],
+        int(args.port),int(args.num_flow_mods),
+        int(args.num_physical_ports),float(args.timeout),args.verbose)
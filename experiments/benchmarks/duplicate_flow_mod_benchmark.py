@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+'''
+Compares ways of duplicating a parsed flow mod, as the chained table
+principal does for every rule that does not match on in_port:
+
+    * pickle: pickle.loads(pickle.dumps(msg)), the original approach.
+      Parsed flow mods reference their datapath (which holds the
+      ofproto modules) and a buffer view of the receive buffer,
+      neither of which pickles, so both are detached for the round
+      trip and reattached afterwards.
+
+    * reparse: parse the flow mod again from its wire bytes.
+
+    * duplicate_flow_mod: copy only the match, instructions and action
+      lists (@see chained_table_principal.duplicate_flow_mod).
+
+Reports microseconds per duplicate for a range of match and
+instruction sizes.
+'''
+import sys
+import os
+import time
+import pickle
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+# ryu.controller.controller can only be imported after app_manager
+import ryu.base.app_manager
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_protocol, ofproto_v1_3
+import extended_v3_parser
+
+from chained_table_principal import duplicate_flow_mod
+
+
+# match fields to use, in order, for matches of increasing size
+MATCH_FIELDS = (
+    ('eth_type',0x0800),
+    ('ip_proto',6),
+    ('ipv4_dst',('10.0.0.0','255.255.255.0')),
+    ('ipv4_src','10.0.1.1'),
+    ('tcp_dst',80),
+    ('tcp_src',5555),
+    ('eth_dst','00:00:00:00:00:01'),
+    ('eth_src','00:00:00:00:00:02'))
+
+
+def produce_flow_mod(datapath,num_match_fields,num_actions):
+    '''
+    @returns {extended_v3_parser.OFPFlowMod} --- Parsed from the wire,
+    as principals' flow mods are.
+    '''
+    parser = datapath.ofproto_parser
+    ofproto = datapath.ofproto
+
+    match = parser.OFPMatch(**dict(MATCH_FIELDS[0:num_match_fields]))
+    actions = [
+        parser.OFPActionOutput(port_num + 1)
+        for port_num in range(0,num_actions)]
+    instructions = [
+        parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,actions),
+        parser.OFPInstructionGotoTable(1)]
+    flow_mod = parser.OFPFlowMod(
+        datapath,0,0,0,ofproto.OFPFC_ADD,0,0,10,ofproto.OFP_NO_BUFFER,
+        ofproto.OFPP_ANY,ofproto.OFPG_ANY,0,match,instructions)
+    flow_mod.xid = 1
+    flow_mod.serialize()
+
+    buf = buffer(str(flow_mod.buf))
+    (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
+    return ofproto_parser.msg(datapath,version,msg_type,msg_len,xid,buf)
+
+
+def pickle_duplicate(msg):
+    datapath = msg.datapath
+    buf = msg.buf
+    msg.datapath = None
+    msg.buf = str(buf)
+    duplicate = pickle.loads(pickle.dumps(msg))
+    msg.datapath = datapath
+    msg.buf = buf
+    duplicate.datapath = datapath
+    return duplicate
+
+
+def reparse_duplicate(msg):
+    return msg.parser(
+        msg.datapath,msg.version,msg.msg_type,msg.msg_len,msg.xid,msg.buf)
+
+
+def time_per_duplicate(duplicate_fn,msg,num_iterations):
+    start = time.time()
+    for i in xrange(0,num_iterations):
+        duplicate_fn(msg)
+    return (time.time() - start)/num_iterations
+
+
+def run(num_iterations):
+    datapath = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+    approaches = (
+        ('pickle',pickle_duplicate),
+        ('reparse',reparse_duplicate),
+        ('duplicate_flow_mod',duplicate_flow_mod))
+
+    print '%8s %8s %8s' % ('fields','actions','bytes') + ''.join(
+        ' %18s' % name for name, duplicate_fn in approaches) + '   (us each)'
+    for num_match_fields in (1,4,8):
+        for num_actions in (1,4,16):
+            msg = produce_flow_mod(datapath,num_match_fields,num_actions)
+            line = '%8i %8i %8i' % (
+                num_match_fields,num_actions,msg.msg_len)
+            for name, duplicate_fn in approaches:
+                line += ' %18.2f' % (
+                    time_per_duplicate(duplicate_fn,msg,num_iterations)*1e6)
+            print line
+
+
+if __name__ == '__main__':
+    description = 'Cost of duplicating parsed flow mods'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--num_iterations',help='Duplicates to time per case',
+        default=5000)
+    args = parser.parse_args()
+    run(int(args.num_iterations))
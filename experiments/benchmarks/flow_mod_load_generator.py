@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+'''
+Loads Pluribus's control path by acting as its principal
+controllers.
+
+Reads the same principals file Pluribus loads (its
+JSON_PRINCIPALS_TO_LOAD_FILENAME) and, for each principal, listens on
+the principal's listening_port_addr and answers Pluribus's handshake.
+Once every principal is connected, each one pushes flow mods at a
+given rate, optionally followed by a barrier every so many flow mods,
+and records how long each barrier takes to be answered: Pluribus only
+answers once the switch has processed everything sent before the
+barrier.
+
+Flow mods match on the principal's first physical port (so that no
+principal's rules overlap another's) and a distinct ipv4_dst, and
+output to its last physical port.  Rates can be swept: each rate in
+the -r list runs for -d seconds on the same connections, which makes
+the maximum sustainable rate show up as the first rate whose flow
+mods are not all acknowledged in time or whose barrier latencies keep
+growing.
+
+Shapes:
+
+    constant --- flow mods evenly paced at the rate.
+
+    burst --- the rate's flow mods are sent -b at a time.
+
+    ramp --- the rate grows linearly from 0 to the given rate over
+    the run.
+
+Run Pluribus and a switch (eg., stand_in_switch.py) first; Pluribus
+connects to principals once the switch is set up.  Eg.,
+
+    python flow_mod_load_generator.py -j principals.json -r 1000,2000,4000
+'''
+import sys
+import os
+import json
+import struct
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_protocol
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from recv_buffer import ReceiveBuffer
+
+
+SHAPES = ('constant','burst','ramp')
+
+# how often senders check whether more flow mods are due
+SEND_TICK = .001
+
+# ipv4_dst of the template flow mod; patched for every flow mod sent
+_TEMPLATE_IPV4_DST = '10.11.12.13'
+_TEMPLATE_IPV4_DST_BYTES = '\x0a\x0b\x0c\x0d'
+_FIRST_IPV4_DST = 0x0a000000
+
+_XID_OFFSET = 4
+_UINT32_PACK_STR = '!I'
+
+
+class StandInPrincipalController(object):
+    '''
+    One principal's controller.  Serves a single connection from
+    Pluribus.
+    '''
+
+    def __init__(self,principal_id,listening_addr,physical_ports):
+        '''
+        @param {tuple} listening_addr --- (ip addr, port) that Pluribus
+        connects to this principal on.
+
+        @param {list} physical_ports --- Port numbers of the
+        principal's physical ports.
+        '''
+        self.principal_id = principal_id
+        self.listening_addr = listening_addr
+        self.physical_ports = sorted(physical_ports)
+
+        self.sock = None
+        self.send_lock = hub.BoundedSemaphore(1)
+        self.handshake_event = hub.Event()
+
+        self.flow_mod_template = produce_flow_mod_template(
+            self.physical_ports[0],self.physical_ports[-1])
+        self.ipv4_dst_offset = self.flow_mod_template.find(
+            _TEMPLATE_IPV4_DST_BYTES)
+        self.next_ipv4_dst = _FIRST_IPV4_DST
+        self.next_xid = 1
+
+        # keys are xids of outstanding barriers; values are the time
+        # each was sent and the number of flow mods sent before it.
+        self.outstanding_barriers = {}
+        self.reset_run_stats()
+
+    def reset_run_stats(self):
+        self.num_flow_mods_sent = 0
+        self.num_flow_mods_acked = 0
+        self.num_errors = 0
+        self.num_packet_ins = 0
+        # each element is a barrier's round trip time, in seconds
+        self.barrier_latencies = []
+
+    def listen(self):
+        '''
+        Runs in its own greenlet until Pluribus disconnects.
+        '''
+        listen_sock = hub.listen(self.listening_addr)
+        (self.sock, _) = listen_sock.accept()
+        listen_sock.close()
+        self.send(
+            _produce_header(ofproto.OFPT_HELLO,self._next_xid()) +
+            _produce_header(ofproto.OFPT_FEATURES_REQUEST,self._next_xid()))
+        self._recv_loop()
+
+    def send(self,buf):
+        with self.send_lock:
+            self.sock.sendall(buf)
+
+    def produce_flow_mods(self,num_flow_mods):
+        '''
+        @returns {str} --- num_flow_mods flow mods, each matching a
+        destination address none of the principal's earlier flow mods
+        matched.
+        '''
+        flow_mod = bytearray(self.flow_mod_template)
+        flow_mods = []
+        for i in range(0,num_flow_mods):
+            struct.pack_into(
+                _UINT32_PACK_STR,flow_mod,_XID_OFFSET,self._next_xid())
+            struct.pack_into(
+                _UINT32_PACK_STR,flow_mod,self.ipv4_dst_offset,
+                self.next_ipv4_dst)
+            self.next_ipv4_dst = (self.next_ipv4_dst + 1) & 0xffffffff
+            flow_mods.append(str(flow_mod))
+        return ''.join(flow_mods)
+
+    def send_flow_mods(self,num_flow_mods,barrier_interval):
+        '''
+        @param {int} barrier_interval --- 0 for no barriers.
+        Otherwise, send a barrier after every barrier_interval-th
+        flow mod (counted over the run).
+        '''
+        while num_flow_mods > 0:
+            num_to_send = num_flow_mods
+            barrier = ''
+            if barrier_interval:
+                num_to_barrier = barrier_interval - (
+                    self.num_flow_mods_sent % barrier_interval)
+                if num_to_barrier <= num_flow_mods:
+                    num_to_send = num_to_barrier
+                    barrier_xid = self._next_xid()
+                    barrier = _produce_header(
+                        ofproto.OFPT_BARRIER_REQUEST,barrier_xid)
+
+            buf = self.produce_flow_mods(num_to_send) + barrier
+            self.num_flow_mods_sent += num_to_send
+            num_flow_mods -= num_to_send
+            if barrier:
+                # recorded before sending: the reply may arrive before
+                # sendall returns.
+                self.outstanding_barriers[barrier_xid] = (
+                    time.time(),self.num_flow_mods_sent)
+            self.send(buf)
+
+    def _next_xid(self):
+        xid = self.next_xid
+        self.next_xid = (self.next_xid + 1) & ofproto.MAX_XID
+        return xid
+
+    def _recv_loop(self):
+        recv_buffer = ReceiveBuffer(0)
+        while recv_buffer.fill(self.sock) != 0:
+            now = time.time()
+            while True:
+                msg = recv_buffer.next_message()
+                if msg is None:
+                    break
+                (version, msg_type, msg_len, xid, buf) = msg
+                if msg_type == ofproto.OFPT_BARRIER_REPLY:
+                    sent_time_and_num_acked = (
+                        self.outstanding_barriers.pop(xid,None))
+                    if sent_time_and_num_acked is not None:
+                        (sent_time, num_acked) = sent_time_and_num_acked
+                        self.barrier_latencies.append(now - sent_time)
+                        self.num_flow_mods_acked = max(
+                            self.num_flow_mods_acked,num_acked)
+                elif msg_type == ofproto.OFPT_ECHO_REQUEST:
+                    reply = bytearray(buf)
+                    reply[1] = ofproto.OFPT_ECHO_REPLY
+                    self.send(reply)
+                elif msg_type == ofproto.OFPT_FEATURES_REPLY:
+                    self.handshake_event.set()
+                elif msg_type == ofproto.OFPT_ERROR:
+                    self.num_errors += 1
+                elif msg_type == ofproto.OFPT_PACKET_IN:
+                    self.num_packet_ins += 1
+
+
+def produce_flow_mod_template(in_port,out_port):
+    '''
+    @returns {str} --- A serialized flow mod, matching in_port and
+    _TEMPLATE_IPV4_DST and outputting to out_port.
+    '''
+    datapath = ofproto_protocol.ProtocolDesc(ofproto.OFP_VERSION)
+    parser = datapath.ofproto_parser
+    match = parser.OFPMatch(
+        in_port=in_port,eth_type=0x0800,ipv4_dst=_TEMPLATE_IPV4_DST)
+    instructions = [
+        parser.OFPInstructionActions(
+            ofproto.OFPIT_APPLY_ACTIONS,[parser.OFPActionOutput(out_port)])]
+    flow_mod = parser.OFPFlowMod(
+        datapath,0,0,0,ofproto.OFPFC_ADD,0,0,10,ofproto.OFP_NO_BUFFER,
+        ofproto.OFPP_ANY,ofproto.OFPG_ANY,0,match,instructions)
+    flow_mod.xid = 0
+    flow_mod.serialize()
+    return str(flow_mod.buf)
+
+def _produce_header(msg_type,xid):
+    return struct.pack(
+        ofproto.OFP_HEADER_PACK_STR,ofproto.OFP_VERSION,msg_type,
+        ofproto.OFP_HEADER_SIZE,xid)
+
+
+def num_flow_mods_due(shape,rate,burst_size,duration,elapsed):
+    '''
+    @returns {int} --- Number of flow mods that should have been sent
+    elapsed seconds into a run.
+    '''
+    elapsed = min(elapsed,duration)
+    if shape == 'constant':
+        return int(rate*elapsed)
+    if shape == 'burst':
+        # first burst goes out at the start of the run
+        num_bursts = int(rate*elapsed/burst_size) + 1
+        return min(num_bursts*burst_size,int(rate*duration))
+    # ramp
+    return int(rate*elapsed*elapsed/(2.*duration))
+
+
+def drive(controller,shape,rate,burst_size,duration,barrier_interval):
+    '''
+    Runs in its own greenlet for the duration of one run.  If Pluribus
+    cannot keep up, sendall blocks and the principal falls behind
+    the schedule; the achieved rate is then lower than rate.
+    '''
+    start = time.time()
+    while True:
+        elapsed = time.time() - start
+        num_due = num_flow_mods_due(
+            shape,rate,burst_size,duration,elapsed)
+        num_to_send = num_due - controller.num_flow_mods_sent
+        if num_to_send > 0:
+            controller.send_flow_mods(num_to_send,barrier_interval)
+        if elapsed >= duration:
+            break
+        hub.sleep(SEND_TICK)
+
+
+def percentile(sorted_values,fraction):
+    if not sorted_values:
+        return None
+    index = min(int(fraction*len(sorted_values)),len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(controllers,rate,elapsed):
+    '''
+    @returns {dict} --- Aggregate results of a run over all
+    controllers.
+    '''
+    latencies = []
+    for controller in controllers:
+        latencies.extend(controller.barrier_latencies)
+    latencies.sort()
+    num_sent = sum(
+        controller.num_flow_mods_sent for controller in controllers)
+    num_acked = sum(
+        controller.num_flow_mods_acked for controller in controllers)
+    return {
+        'rate_per_principal': rate,
+        'num_principals': len(controllers),
+        'num_flow_mods_sent': num_sent,
+        'num_flow_mods_acked': num_acked,
+        'sent_rate': num_sent/elapsed,
+        'num_errors': sum(
+            controller.num_errors for controller in controllers),
+        'num_barriers': len(latencies),
+        'num_barriers_outstanding': sum(
+            len(controller.outstanding_barriers)
+            for controller in controllers),
+        'barrier_latency_p50': percentile(latencies,.5),
+        'barrier_latency_p90': percentile(latencies,.9),
+        'barrier_latency_p99': percentile(latencies,.99),
+        'barrier_latency_max': percentile(latencies,1.),
+        'barrier_latencies': latencies
+        }
+
+
+def print_summary(summary):
+    def ms(seconds):
+        if seconds is None:
+            return '       -'
+        return '%8.2f' % (seconds*1000.)
+    print '%10i %12.0f %10i %10i %6i %s %s %s %s' % (
+        summary['rate_per_principal'],summary['sent_rate'],
+        summary['num_flow_mods_sent'],summary['num_flow_mods_acked'],
+        summary['num_errors'],ms(summary['barrier_latency_p50']),
+        ms(summary['barrier_latency_p90']),
+        ms(summary['barrier_latency_p99']),
+        ms(summary['barrier_latency_max']))
+
+
+def run(principals_filename,rates,shape,burst_size,duration,
+        barrier_interval,drain_timeout,output_filename):
+    with open(principals_filename,'r') as fd:
+        principal_dicts = json.load(fd)
+
+    controllers = []
+    for principal_id, principal_dict in enumerate(principal_dicts):
+        controllers.append(
+            StandInPrincipalController(
+                principal_id,
+                (principal_dict['listening_ip_addr'],
+                 int(principal_dict['listening_port_addr'])),
+                principal_dict['physical_ports']))
+    for controller in controllers:
+        hub.spawn(controller.listen)
+
+    print 'Waiting for Pluribus to connect to %i principals' % len(
+        controllers)
+    for controller in controllers:
+        controller.handshake_event.wait()
+
+    print '%10s %12s %10s %10s %6s %8s %8s %8s %8s' % (
+        'rate','sent/s','sent','acked','errors','p50 ms','p90 ms',
+        'p99 ms','max ms')
+    summaries = []
+    for rate in rates:
+        for controller in controllers:
+            controller.reset_run_stats()
+        start = time.time()
+        hub.joinall([
+            hub.spawn(
+                drive,controller,shape,rate,burst_size,duration,
+                barrier_interval)
+            for controller in controllers])
+        elapsed = time.time() - start
+
+        # give barriers sent at the end of the run a chance to return
+        deadline = time.time() + drain_timeout
+        while (any(controller.outstanding_barriers
+                   for controller in controllers) and
+               time.time() < deadline):
+            hub.sleep(.01)
+
+        summary = summarize(controllers,rate,elapsed)
+        summary['shape'] = shape
+        summary['duration'] = duration
+        summary['barrier_interval'] = barrier_interval
+        summaries.append(summary)
+        print_summary(summary)
+        # barriers that never came back do not count against the next
+        # run
+        for controller in controllers:
+            controller.outstanding_barriers.clear()
+
+    if output_filename is not None:
+        with open(output_filename,'w') as fd:
+            json.dump(summaries,fd,indent=1,sort_keys=True)
+
+
+if __name__ == '__main__':
+    description = 'Flow mod load generator acting as principal controllers'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-j','--principals_file',required=True,
+        help='Principals JSON file that Pluribus loads')
+    parser.add_argument(
+        '-r','--rates',default='1000',
+        help='Comma-separated flow mods/second per principal, one run each')
+    parser.add_argument(
+        '-s','--shape',default='constant',choices=SHAPES,
+        help='How flow mods are spread over a run')
+    parser.add_argument(
+        '-b','--burst_size',default=100,
+        help='Flow mods per burst, for the burst shape')
+    parser.add_argument(
+        '-d','--duration',default=5.,help='Seconds per run')
+    parser.add_argument(
+        '-i','--barrier_interval',default=100,
+        help='Flow mods between barriers.  0 for no barriers')
+    parser.add_argument(
+        '-t','--drain_timeout',default=5.,
+        help='Seconds to wait for outstanding barriers after a run')
+    parser.add_argument(
+        '-o','--output',default=None,
+        help='File to write JSON results, with all latencies, to')
+    args = parser.parse_args()
+
+    run(args.principals_file,
+        [float(rate) for rate in args.rates.split(',')],args.shape,
+        int(args.burst_size),float(args.duration),
+        int(args.barrier_interval),float(args.drain_timeout),args.output)
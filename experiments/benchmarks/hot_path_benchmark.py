@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+'''
+Microbenchmarks for the per-message hot paths: parsing principals'
+flow mods, translating them (each rewrite step on its own, the wire
+fast path, and the chained table principal's early/late split),
+serializing the results, and serializing the replies Pluribus
+produces itself.  Each stage also runs end-to-end, through a
+principal of each design.
+
+Stages run over synthetic corpora of flow mods that vary in match
+width, number of instructions and number of output actions.  Every
+stage that modifies messages is fed freshly parsed copies, prepared
+outside the timed loop.
+
+For each stage and corpus, reports:
+
+    ns_per_op --- best of several timed runs.
+
+    allocs_per_op --- objects allocated per op.  Stock CPython 2.7
+    cannot count allocations, so this is only filled in on
+    interpreters built with COUNT_ALLOCS (through sys.getcounts);
+    null otherwise.
+
+    retained_per_op --- garbage-collected objects still alive per op
+    once the op returns (eg., results the op keeps, or leaks).
+
+Results go to a JSON file (-o).  Two result files can be compared
+with -c to spot regressions between commits.
+'''
+import sys
+import os
+import gc
+import json
+import time
+import platform
+import subprocess
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+# ryu.controller.controller can only be imported after app_manager
+import ryu.base.app_manager
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_protocol, ofproto_v1_3
+import extended_v3_parser
+from extended_v3_parser import OFPDescStatsReply as PluribusDescStatsReply
+from extended_v3_parser import OFPSwitchFeatures as PluribusSwitchFeatures
+
+from logical_port_principal import LogicalPortPrincipal
+from logical_port_principal import flow_mod_rewrite_table_ids
+from logical_port_principal import flow_mod_rewrite_gotos
+from logical_port_principal import flow_mod_rewrite_action_ports
+from chained_table_principal import ChainedTablePrincipal
+from chained_table_principal import produce_early_late_flow_mods
+from translation_cache import TranslationCache
+from match_overlap_index import MatchOverlapIndex
+
+
+NUM_PHYSICAL_PORTS = 16
+
+# match fields to use, in order, for matches of increasing width.
+# None of them is in_port, so chained table principals have to split
+# every rule into an early and a late rule.
+MATCH_FIELDS = (
+    ('eth_type',0x0800),
+    ('ip_proto',6),
+    ('ipv4_dst',('10.0.0.0','255.255.255.0')),
+    ('ipv4_src','10.0.1.1'),
+    ('tcp_dst',80),
+    ('tcp_src',5555),
+    ('eth_dst','00:00:00:00:00:01'),
+    ('eth_src','00:00:00:00:00:02'))
+
+MATCH_WIDTHS = (1,4,8)
+INSTRUCTION_COUNTS = (1,3)
+ACTION_COUNTS = (1,8)
+
+
+class StandInConnection(object):
+    def __init__(self,datapath):
+        self.datapath = datapath
+
+
+class StandInSwitch(object):
+    '''
+    Just enough of a PluribusSwitch for principals to translate.
+    '''
+    def __init__(self):
+        self.shadow_physical_index = {}
+        self.match_overlap_index = MatchOverlapIndex()
+        # disabled: every op should pay for translation
+        self.translation_cache = TranslationCache(0)
+
+
+def produce_corpus(datapath,match_width,num_instructions,num_actions,
+                   corpus_size):
+    '''
+    @returns {list} --- corpus_size serialized flow mods (strs).
+    Instructions are, in order, an apply actions, a goto and a write
+    actions; num_instructions of them are used.
+    '''
+    parser = datapath.ofproto_parser
+    ofproto = datapath.ofproto
+
+    corpus = []
+    for i in range(0,corpus_size):
+        fields = dict(MATCH_FIELDS[0:match_width])
+        # vary the first field so that messages differ
+        if match_width > 0:
+            fields['eth_type'] = 0x0800 + (i % 2)*(0x86dd - 0x0800)
+            if fields['eth_type'] != 0x0800:
+                for field_name in ('ipv4_dst','ipv4_src','ip_proto',
+                                   'tcp_dst','tcp_src'):
+                    fields.pop(field_name,None)
+        match = parser.OFPMatch(**fields)
+
+        actions = [
+            parser.OFPActionOutput((i + j) % NUM_PHYSICAL_PORTS + 1)
+            for j in range(0,num_actions)]
+        instructions = [
+            parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS,actions),
+            parser.OFPInstructionGotoTable(1),
+            parser.OFPInstructionActions(
+                ofproto.OFPIT_WRITE_ACTIONS,actions)][0:num_instructions]
+
+        flow_mod = parser.OFPFlowMod(
+            datapath,i,0,0,ofproto.OFPFC_ADD,0,0,10,
+            ofproto.OFP_NO_BUFFER,0,0,0,match,instructions)
+        flow_mod.xid = i
+        flow_mod.serialize()
+        corpus.append(str(flow_mod.buf))
+    return corpus
+
+
+def parse(datapath,buf):
+    (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
+    return ofproto_parser.msg(datapath,version,msg_type,msg_len,xid,buf)
+
+
+def produce_principals(datapath):
+    '''
+    @returns {2-tuple} --- (LogicalPortPrincipal,
+    ChainedTablePrincipal), both set up with two tables, all physical
+    ports and a logical port.
+    '''
+    physical_port_set = frozenset(range(1,NUM_PHYSICAL_PORTS + 1))
+
+    logical_principal = LogicalPortPrincipal(
+        StandInSwitch(),physical_port_set,'127.0.0.1',0)
+    logical_principal.set_physical_table_list([1,2])
+    logical_principal.egress_logical_port_nums_to_principals[
+        NUM_PHYSICAL_PORTS + 1] = logical_principal
+    logical_principal.invalidate_translations()
+    logical_principal.connection = StandInConnection(datapath)
+
+    chained_principal = ChainedTablePrincipal(
+        StandInSwitch(),physical_port_set,'127.0.0.1',0)
+    chained_principal.add_table_ids([1,2],[3,4])
+    chained_principal.egress_logical_port_num_to_table_id[
+        NUM_PHYSICAL_PORTS + 1] = 5
+    chained_principal.invalidate_translations()
+    chained_principal.connection = StandInConnection(datapath)
+
+    return logical_principal, chained_principal
+
+
+def produce_stages(datapath,logical_principal,chained_principal):
+    '''
+    @returns {list} --- Each element is a (design, stage name, input
+    kind, op) tuple.  Input kind says what op takes: 'wire' for
+    serialized flow mods, 'parsed' for freshly parsed flow mods,
+    'translated' for parsed flow mods that have been translated
+    already, 'none' for ops independent of the corpus.
+    '''
+    logical_table_list = logical_principal.physical_table_list
+    logical_port_set = logical_principal.physical_port_set
+    logical_egress = logical_principal.egress_logical_port_nums_to_principals
+
+    def rewrite_table_ids(msg):
+        flow_mod_rewrite_table_ids(msg,logical_table_list)
+    def rewrite_gotos(msg):
+        flow_mod_rewrite_gotos(msg,logical_table_list)
+    def rewrite_action_ports(msg):
+        flow_mod_rewrite_action_ports(msg,logical_port_set,logical_egress)
+    def serialize(msg):
+        msg.serialize()
+    def logical_parsed_end_to_end(buf):
+        msg = parse(datapath,buf)
+        for translated_msg in logical_principal.translate_flow_mod(msg):
+            translated_msg.serialize()
+    def chained_early_late(msg):
+        produce_early_late_flow_mods(chained_principal,msg)
+    def chained_parsed_end_to_end(buf):
+        msg = parse(datapath,buf)
+        for translated_msg in chained_principal.translate_flow_mod(msg):
+            translated_msg.serialize()
+    def serialize_desc_stats_reply():
+        PluribusDescStatsReply(1,datapath).serialize()
+    def serialize_switch_features():
+        PluribusSwitchFeatures(datapath,1,256,64,0,71).serialize()
+
+    return [
+        ('common','parse','wire',lambda buf: parse(datapath,buf)),
+        ('common','serialize_flow_mod','translated',serialize),
+        ('common','serialize_desc_stats_reply','none',
+         serialize_desc_stats_reply),
+        ('common','serialize_switch_features','none',
+         serialize_switch_features),
+
+        ('logical','rewrite_table_ids','parsed',rewrite_table_ids),
+        ('logical','rewrite_gotos','parsed',rewrite_gotos),
+        ('logical','rewrite_action_ports','parsed',rewrite_action_ports),
+        ('logical','translate_flow_mod','parsed',
+         logical_principal.translate_flow_mod),
+        ('logical','translate_raw_flow_mod','wire',
+         logical_principal.translate_raw_flow_mod),
+        ('logical','end_to_end_parsed','wire',logical_parsed_end_to_end),
+        ('logical','end_to_end','wire',
+         logical_principal.translate_flow_mod_to_bufs),
+
+        ('chained','produce_early_late_flow_mods','parsed',
+         chained_early_late),
+        ('chained','end_to_end_parsed','wire',chained_parsed_end_to_end),
+        ('chained','end_to_end','wire',
+         chained_principal.translate_flow_mod_to_bufs),
+        ]
+
+
+def time_op(op,inputs,num_repeats):
+    '''
+    @param {list} inputs --- Each element is a list of arguments.
+    Each repeat consumes one of them (ops that modify their inputs
+    need a fresh list per repeat).
+
+    @returns {3-tuple} --- (ns per op, allocs per op or None,
+    retained objects per op).
+    '''
+    best = None
+    allocs_per_op = None
+    retained_per_op = None
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for repeat_inputs in inputs[0:num_repeats]:
+            allocs_before = _num_allocs()
+            retained_before = gc.get_count()[0]
+            start = time.time()
+            for args in repeat_inputs:
+                op(*args)
+            elapsed = time.time() - start
+            retained_after = gc.get_count()[0]
+            allocs_after = _num_allocs()
+
+            num_ops = len(repeat_inputs)
+            if (best is None) or (elapsed < best):
+                best = elapsed
+            if allocs_before is not None:
+                allocs_per_op = (allocs_after - allocs_before)/float(num_ops)
+            retained_per_op = (retained_after - retained_before)/float(num_ops)
+            gc.collect()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best*1e9/len(inputs[0]), allocs_per_op, retained_per_op
+
+
+def _num_allocs():
+    '''
+    @returns {int or None} --- Total objects allocated so far.  None
+    unless the interpreter was built with COUNT_ALLOCS.
+    '''
+    getcounts = getattr(sys,'getcounts',None)
+    if getcounts is None:
+        return None
+    return sum(count[1] for count in getcounts())
+
+
+def produce_inputs(datapath,kind,corpus,translate,num_repeats):
+    '''
+    @param {function} translate --- Translates a parsed flow mod in
+    place, for 'translated' inputs.
+
+    @returns {list} --- num_repeats lists of argument lists (@see
+    time_op).
+    '''
+    if kind == 'none':
+        return [[()]*len(corpus)]*num_repeats
+    if kind == 'wire':
+        return [[(buffer(buf),) for buf in corpus]]*num_repeats
+
+    inputs = []
+    for i in range(0,num_repeats):
+        msgs = [parse(datapath,buffer(buf)) for buf in corpus]
+        if kind == 'translated':
+            for msg in msgs:
+                translate(msg)
+        inputs.append([(msg,) for msg in msgs])
+    if kind == 'translated':
+        # serializing is idempotent: no need for fresh copies
+        inputs = inputs[0:1]*num_repeats
+    return inputs
+
+
+def run(corpus_size,num_repeats):
+    datapath = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+    (logical_principal, chained_principal) = produce_principals(datapath)
+    stages = produce_stages(datapath,logical_principal,chained_principal)
+
+    results = []
+    for match_width in MATCH_WIDTHS:
+        for num_instructions in INSTRUCTION_COUNTS:
+            for num_actions in ACTION_COUNTS:
+                corpus = produce_corpus(
+                    datapath,match_width,num_instructions,num_actions,
+                    corpus_size)
+                corpus_desc = {
+                    'match_width': match_width,
+                    'num_instructions': num_instructions,
+                    'num_actions': num_actions,
+                    'mean_bytes': sum(map(len,corpus))/len(corpus)
+                    }
+                for design, stage, kind, op in stages:
+                    if (kind == 'none') and results and (
+                        match_width,num_instructions,num_actions) != (
+                        MATCH_WIDTHS[0],INSTRUCTION_COUNTS[0],
+                        ACTION_COUNTS[0]):
+                        # does not depend on the corpus: run once
+                        continue
+                    inputs = produce_inputs(
+                        datapath,kind,corpus,
+                        logical_principal.translate_flow_mod,num_repeats)
+                    (ns_per_op, allocs_per_op, retained_per_op) = time_op(
+                        op,inputs,num_repeats)
+                    results.append({
+                        'design': design,
+                        'stage': stage,
+                        'corpus': corpus_desc,
+                        'ns_per_op': ns_per_op,
+                        'allocs_per_op': allocs_per_op,
+                        'retained_per_op': retained_per_op
+                        })
+                    print_result(results[-1])
+    return results
+
+
+def print_result(result):
+    corpus = result['corpus']
+    allocs = '-'
+    if result['allocs_per_op'] is not None:
+        allocs = '%.1f' % result['allocs_per_op']
+    print '%-8s %-28s w=%i i=%i a=%-2i %12.0f ns/op %8s allocs %6.1f retained' % (
+        result['design'],result['stage'],corpus['match_width'],
+        corpus['num_instructions'],corpus['num_actions'],
+        result['ns_per_op'],allocs,result['retained_per_op'])
+
+
+def current_commit():
+    '''
+    @returns {str or None} --- Commit of the source tree benchmarked.
+    '''
+    try:
+        return subprocess.check_output(
+            ['git','rev-parse','HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    corpus = result['corpus']
+    return (
+        result['design'],result['stage'],corpus['match_width'],
+        corpus['num_instructions'],corpus['num_actions'])
+
+
+def compare(old_filename,new_filename):
+    '''
+    Prints the ns/op change of every stage and corpus present in
+    both result files.
+    '''
+    with open(old_filename,'r') as fd:
+        old_results = json.load(fd)
+    with open(new_filename,'r') as fd:
+        new_results = json.load(fd)
+
+    old_by_key = dict(
+        (result_key(result),result) for result in old_results['results'])
+    print 'old: %s' % old_results['commit']
+    print 'new: %s' % new_results['commit']
+    for result in new_results['results']:
+        old_result = old_by_key.get(result_key(result),None)
+        if old_result is None:
+            continue
+        change = (result['ns_per_op'] / old_result['ns_per_op'] - 1)*100
+        print '%-8s %-28s w=%i i=%i a=%-2i %12.0f -> %12.0f ns/op %+7.1f%%' % (
+            result_key(result) +
+            (old_result['ns_per_op'],result['ns_per_op'],change))
+
+
+if __name__ == '__main__':
+    description = 'Microbenchmarks for parse, translate and serialize'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--corpus_size',help='Flow mods per corpus',default=500)
+    parser.add_argument(
+        '-r','--num_repeats',help='Timed runs per stage (best is kept)',
+        default=3)
+    parser.add_argument(
+        '-o','--output',help='File to write JSON results to',
+        default='hot_path_results.json')
+    parser.add_argument(
+        '-c','--compare',nargs=2,metavar=('OLD','NEW'),
+        help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.compare[0],args.compare[1])
+    else:
+        results = run(int(args.corpus_size),int(args.num_repeats))
+        with open(args.output,'w') as fd:
+            json.dump(
+                {
+                    'commit': current_commit(),
+                    'python': platform.python_version(),
+                    'corpus_size': int(args.corpus_size),
+                    'results': results
+                    },
+                fd,indent=1,sort_keys=True)
+        print 'Wrote %s' % args.output
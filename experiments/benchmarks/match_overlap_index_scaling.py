@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+'''
+Measures how long MatchOverlapIndex takes to check and insert each
+rule as a physical table shared by several principals fills up.
+
+Principals take turns installing rules into one physical table.
+Each principal matches on its own in_port, so none of the rules
+conflict; a fraction of each principal's rules wildcard everything but
+in_port, to exercise the index's wildcard children.  Latencies are
+reported per block of rules so that any growth with table size
+shows.  For comparison, the same checks are timed against a linear
+scan of every installed rule.
+'''
+import sys
+import os
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+from ryu.ofproto import ofproto_protocol, ofproto_v1_3
+
+from match_overlap_index import MatchOverlapIndex, matches_overlap
+from shadow_flow_table import physical_flow_mod_key, match_values_from_key
+
+
+PHYSICAL_TABLE_ID = 1
+
+
+def produce_rule_keys(num_rules,num_principals,wildcard_every):
+    '''
+    @returns {list} --- Each element is a (principal id, physical key)
+    tuple.
+    '''
+    datapath = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+    parser = datapath.ofproto_parser
+    ofproto = datapath.ofproto
+
+    rule_keys = []
+    for i in range(0,num_rules):
+        principal_id = i % num_principals
+        in_port = principal_id + 1
+        if (wildcard_every > 0) and (i % wildcard_every == 0):
+            # only distinct by priority
+            match = parser.OFPMatch(in_port=in_port)
+            priority = i
+        else:
+            match = parser.OFPMatch(
+                in_port=in_port,eth_type=0x0800,
+                ipv4_dst=(i & 0xffffffff))
+            priority = 10
+        flow_mod = parser.OFPFlowMod(
+            datapath,0,0,PHYSICAL_TABLE_ID,ofproto.OFPFC_ADD,0,0,priority,
+            ofproto.OFP_NO_BUFFER,0,0,0,match,[])
+        flow_mod.xid = 0
+        flow_mod.serialize()
+        rule_keys.append((principal_id,physical_flow_mod_key(flow_mod.buf)))
+    return rule_keys
+
+
+def time_index(rule_keys,block_size):
+    '''
+    @returns {list} --- Each element is (mean, max) seconds to check
+    and insert one rule, over a block of block_size rules.
+    '''
+    index = MatchOverlapIndex()
+    blocks = []
+    latencies = []
+    for principal_id, physical_key in rule_keys:
+        start = time.time()
+        assert index.find_conflict(principal_id,physical_key) is None
+        index.insert(principal_id,physical_key)
+        latencies.append(time.time() - start)
+        if len(latencies) == block_size:
+            blocks.append((sum(latencies)/block_size,max(latencies)))
+            latencies = []
+    return blocks
+
+
+def time_linear_scan(rule_keys,block_size):
+    '''
+    @returns {list} --- Same as time_index, but checking each rule
+    against every rule installed before it.
+    '''
+    installed = []
+    blocks = []
+    latencies = []
+    for principal_id, physical_key in rule_keys:
+        start = time.time()
+        match_values = match_values_from_key(physical_key[2])
+        for other_principal_id, other_match_values in installed:
+            if other_principal_id != principal_id:
+                assert not matches_overlap(match_values,other_match_values)
+        installed.append((principal_id,match_values))
+        latencies.append(time.time() - start)
+        if len(latencies) == block_size:
+            blocks.append((sum(latencies)/block_size,max(latencies)))
+            latencies = []
+    return blocks
+
+
+def print_blocks(name,blocks,block_size):
+    print name
+    print '  %10s %14s %14s' % ('rules','mean us','max us')
+    for i, (mean_latency, max_latency) in enumerate(blocks):
+        print '  %10i %14.2f %14.2f' % (
+            (i + 1)*block_size,mean_latency*1e6,max_latency*1e6)
+
+
+def run(num_rules,num_principals,wildcard_every,block_size,linear_rules):
+    rule_keys = produce_rule_keys(num_rules,num_principals,wildcard_every)
+    print_blocks(
+        'MatchOverlapIndex, %i principals' % num_principals,
+        time_index(rule_keys,block_size),block_size)
+    if linear_rules > 0:
+        print_blocks(
+            'Linear scan, %i principals' % num_principals,
+            time_linear_scan(rule_keys[:linear_rules],block_size),
+            block_size)
+
+
+if __name__ == '__main__':
+    description = 'Per-rule cost of isolation checks as a table fills'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--num_rules',help='Rules to install into the table',
+        default=50000)
+    parser.add_argument(
+        '-p','--num_principals',help='Principals sharing the table',
+        default=4)
+    parser.add_argument(
+        '-w','--wildcard_every',
+        help='Every this many rules only matches in_port (0 for none)',
+        default=100)
+    parser.add_argument(
+        '-b','--block_size',help='Rules per reported block',
+        default=5000)
+    parser.add_argument(
+        '-l','--linear_rules',
+        help='Rules to time the linear scan over (0 to skip)',
+        default=10000)
+    args = parser.parse_args()
+    run(int(args.num_rules),int(args.num_principals),
+        int(args.wildcard_every),int(args.block_size),
+        int(args.linear_rules))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+'''
+Measures how long classifying a switch's ports as physical or logical
+takes as the number of principals, and so of loopback port pairs,
+grows.
+
+For each number of principals, builds the ports a switch would need
+(some physical ports plus a loopback pair per pair of principals) and
+times:
+
+   * set_logical_physical, which builds a PortIndex.
+
+   * the scan set_logical_physical used to do, which searches every
+     port for each loopback pair, for comparison.
+
+   * incremental updates: deleting and re-adding each port in a
+     PortIndex, as OFPT_PORT_STATUS messages would.
+'''
+import sys
+import os
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+
+from port_util import PortNameNumber, PortIndex, set_logical_physical
+from port_util import is_loopback_port
+from port_util import produce_loopback_port_a, produce_loopback_port_b
+from port_util import num_logical_port_pairs_from_num_principals
+
+
+def produce_ports(num_physical_ports,num_principals):
+    '''
+    @returns {list} --- Each element is a (port name, port number)
+    tuple, numbered as the stand-in switch numbers them.
+    '''
+    ports = []
+    for port_num in range(1,num_physical_ports + 1):
+        ports.append(('s1-eth%i' % port_num,port_num))
+    port_num = num_physical_ports + 1
+    num_pairs = num_logical_port_pairs_from_num_principals(num_principals)
+    for port_pair_num in range(0,num_pairs):
+        ports.append((produce_loopback_port_a(port_pair_num),port_num))
+        ports.append((produce_loopback_port_b(port_pair_num),port_num + 1))
+        port_num += 2
+    return ports
+
+
+def scan_set_logical_physical(port_name_number_list):
+    '''
+    What set_logical_physical used to do: for every loopback pair
+    number, search every port for the pair's two ports.
+    '''
+    to_return = []
+    for port_name_number in port_name_number_list:
+        if not is_loopback_port(port_name_number.port_name):
+            port_name_number.set_physical()
+
+    port_pair_num = 0
+    while True:
+        port_a_name = produce_loopback_port_a(port_pair_num)
+        port_b_name = produce_loopback_port_b(port_pair_num)
+        port_pair_num += 1
+
+        port_name_number_a = None
+        port_name_number_b = None
+        for port_name_number in port_name_number_list:
+            if port_name_number.port_name == port_a_name:
+                port_name_number_a = port_name_number
+            elif port_name_number.port_name == port_b_name:
+                port_name_number_b = port_name_number
+
+        if (port_name_number_a is None) and (port_name_number_b is None):
+            return to_return
+        assert (port_name_number_a is not None) and (
+            port_name_number_b is not None)
+        port_name_number_a.set_logical(port_name_number_b)
+        port_name_number_b.set_logical(port_name_number_a)
+        to_return.append(port_name_number_a)
+
+
+def time_classify(classify_fn,ports):
+    port_name_number_list = [
+        PortNameNumber(port_name,port_num) for port_name, port_num in ports]
+    start = time.time()
+    halves = classify_fn(port_name_number_list)
+    return time.time() - start, len(halves)
+
+
+def time_incremental(ports):
+    '''
+    @returns {float} --- Mean seconds per port status event.
+    '''
+    port_index = PortIndex()
+    for port_name, port_num in ports:
+        port_index.add(port_name,port_num)
+
+    start = time.time()
+    for port_name, port_num in ports:
+        port_index.remove(port_num)
+        port_index.add(port_name,port_num)
+    elapsed = time.time() - start
+    assert (len(port_index.logical_port_pair_halves())*2 +
+            sum(1 for port in port_index if port.is_physical) == len(ports))
+    return elapsed/(2*len(ports))
+
+
+def run(num_principals_list,num_physical_ports,max_scan_ports):
+    print '%10s %8s %8s %14s %14s %14s' % (
+        'principals','pairs','ports','indexed ms','scan ms',
+        'per event us')
+    for num_principals in num_principals_list:
+        ports = produce_ports(num_physical_ports,num_principals)
+        indexed_time, num_pairs = time_classify(set_logical_physical,ports)
+        scan = '-'
+        if len(ports) <= max_scan_ports:
+            scan_time, scan_num_pairs = time_classify(
+                scan_set_logical_physical,ports)
+            assert scan_num_pairs == num_pairs
+            scan = '%.2f' % (scan_time*1e3)
+        print '%10i %8i %8i %14.2f %14s %14.2f' % (
+            num_principals,num_pairs,len(ports),indexed_time*1e3,scan,
+            time_incremental(ports)*1e6)
+
+
+if __name__ == '__main__':
+    description = 'Cost of classifying ports as principals grow'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--num_principals',
+        help='Comma-separated numbers of principals, one run each',
+        default='4,16,32,64,128')
+    parser.add_argument(
+        '-p','--num_physical_ports',help='Physical ports on the switch',
+        default=48)
+    parser.add_argument(
+        '-s','--max_scan_ports',
+        help='Only time the scan for switches with at most this many ports',
+        default=5000)
+    args = parser.parse_args()
+    run(
+        [int(num) for num in args.num_principals.split(',')],
+        int(args.num_physical_ports),int(args.max_scan_ports))
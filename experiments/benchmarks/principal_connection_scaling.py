@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+'''
+Connects PrincipalConnectionManager to many stand-in principal
+controllers at once and reports how long it takes for all of them to
+complete the OpenFlow handshake (hello, features request, features
+reply), along with the number of OS threads the process uses.
+
+Each stand-in controller is a greenlet listening on its own loopback
+port.  It answers Pluribus's hello with a hello and a features
+request and records when the features reply arrives.  Some
+controllers can be made slow to accept to check that they do not
+hold up the others.  Principals can also be added whose controllers
+are dead (nothing listening) or mute (accept, but never send a
+features request), which should not hold up the healthy ones either:
+they get retried in the background.
+'''
+import sys
+import os
+import struct
+import time
+import sets
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+# ryu.controller.controller can only be imported after app_manager
+import ryu.base.app_manager
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3, ofproto_common
+
+from principal_connection_manager import PrincipalConnectionManager
+from principal_connection_manager import PrincipalConnectionState
+from logical_port_principal import LogicalPortPrincipal
+from match_overlap_index import MatchOverlapIndex
+
+
+class StandInSwitch(object):
+    '''
+    Just enough of a PluribusSwitch for principals to connect.
+    '''
+    def __init__(self):
+        self.principal_connection_manager = PrincipalConnectionManager()
+        self.shadow_physical_index = {}
+        self.match_overlap_index = MatchOverlapIndex()
+
+
+def recv_msg(sock):
+    '''
+    @returns {tuple or None} --- (msg_type, msg) or None if sock
+    closed.
+    '''
+    header = ''
+    while len(header) < ofproto_common.OFP_HEADER_SIZE:
+        data = sock.recv(ofproto_common.OFP_HEADER_SIZE - len(header))
+        if not data:
+            return None
+        header += data
+    (version, msg_type, msg_len, xid) = struct.unpack(
+        ofproto_common.OFP_HEADER_PACK_STR,header)
+    body = ''
+    while len(header) + len(body) < msg_len:
+        data = sock.recv(msg_len - len(header) - len(body))
+        if not data:
+            return None
+        body += data
+    return msg_type, header + body
+
+
+def produce_header(msg_type,xid):
+    return struct.pack(
+        ofproto_common.OFP_HEADER_PACK_STR,ofproto_v1_3.OFP_VERSION,
+        msg_type,ofproto_common.OFP_HEADER_SIZE,xid)
+
+
+def stand_in_controller(listen_sock,accept_delay,handshake_times,done_event):
+    '''
+    Runs in a greenlet.  Serves a single connection from Pluribus.
+    '''
+    if accept_delay:
+        hub.sleep(accept_delay)
+    sock, addr = listen_sock.accept()
+    recv_msg(sock)
+    sock.sendall(
+        produce_header(ofproto_v1_3.OFPT_HELLO,1) +
+        produce_header(ofproto_v1_3.OFPT_FEATURES_REQUEST,2))
+
+    while True:
+        msg_type_and_msg = recv_msg(sock)
+        if msg_type_and_msg is None:
+            break
+        if msg_type_and_msg[0] == ofproto_v1_3.OFPT_FEATURES_REPLY:
+            handshake_times.append(time.time())
+            break
+
+    # hold connection open until the run is over
+    done_event.wait()
+    sock.close()
+
+
+def mute_controller(listen_sock,done_event):
+    '''
+    Runs in a greenlet.  Accepts Pluribus's connections but never
+    answers them.
+    '''
+    socks = []
+    while not done_event.is_set():
+        sock, addr = listen_sock.accept()
+        socks.append(sock)
+
+
+def produce_principal(switch,port):
+    principal = LogicalPortPrincipal(
+        switch,sets.ImmutableSet([1,2]),'127.0.0.1',port)
+    principal.set_physical_table_list([1,2])
+    principal.set_num_buffers(0)
+    return principal
+
+
+def run(num_principals,num_slow,slow_accept_delay,num_dead,num_mute):
+    switch = StandInSwitch()
+    handshake_times = []
+    done_event = hub.Event()
+
+    principals = []
+    controller_threads = []
+    for i in range(0,num_principals):
+        listen_sock = hub.listen(('127.0.0.1',0))
+        port = listen_sock.getsockname()[1]
+        accept_delay = 0
+        if i < num_slow:
+            accept_delay = slow_accept_delay
+        controller_threads.append(
+            hub.spawn(
+                stand_in_controller,listen_sock,accept_delay,
+                handshake_times,done_event))
+        principals.append(produce_principal(switch,port))
+
+    for i in range(0,num_dead):
+        # port nothing listens on
+        listen_sock = hub.listen(('127.0.0.1',0))
+        port = listen_sock.getsockname()[1]
+        listen_sock.close()
+        principals.append(produce_principal(switch,port))
+
+    for i in range(0,num_mute):
+        listen_sock = hub.listen(('127.0.0.1',0))
+        port = listen_sock.getsockname()[1]
+        hub.spawn(mute_controller,listen_sock,done_event)
+        principals.append(produce_principal(switch,port))
+
+    start = time.time()
+    switch.principal_connection_manager.connect_all(principals)
+    connect_all_time = time.time() - start
+
+    num_fast = num_principals - num_slow
+    while len(handshake_times) < num_principals:
+        hub.sleep(.001)
+    end = time.time()
+
+    handshake_times.sort()
+    print '%i principals (%i slow to accept by %.2fs), %i dead, %i mute' % (
+        num_principals,num_slow,slow_accept_delay,num_dead,num_mute)
+    print '  connect_all returned after:      %8.2f ms' % (
+        connect_all_time*1000.)
+    if num_fast > 0:
+        print '  all fast principals handshaked:  %8.2f ms' % (
+            (handshake_times[num_fast - 1] - start)*1000.)
+    print '  all principals handshaked:       %8.2f ms' % (
+        (end - start)*1000.)
+    print '  connections being served:        %8i' % (
+        switch.principal_connection_manager.num_connected())
+    print '  OS threads in process:           %8i' % num_os_threads()
+    manager = switch.principal_connection_manager
+    print '  principals by state:             %s' % ', '.join(
+        '%s %i' % (name,manager.num_in_state(state))
+        for state, name in sorted(PrincipalConnectionState.NAMES.items()))
+
+    done_event.set()
+    hub.joinall(controller_threads)
+
+
+def num_os_threads():
+    '''
+    @returns {int} --- -1 if /proc is unavailable.
+    '''
+    try:
+        return len(os.listdir('/proc/self/task'))
+    except OSError:
+        return -1
+
+
+if __name__ == '__main__':
+    description = 'Connect to many principals at once'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--num_principals',help='Number of stand-in controllers',
+        default=128)
+    parser.add_argument(
+        '-s','--num_slow',help='Number of controllers slow to accept',
+        default=8)
+    parser.add_argument(
+        '-d','--slow_accept_delay',
+        help='Seconds slow controllers wait before accepting',
+        default=.5)
+    parser.add_argument(
+        '-x','--num_dead',
+        help='Additional principals whose controllers are not listening',
+        default=0)
+    parser.add_argument(
+        '-m','--num_mute',
+        help='Additional principals whose controllers never handshake',
+        default=0)
+    args = parser.parse_args()
+    run(int(args.num_principals),int(args.num_slow),
+        float(args.slow_accept_delay),int(args.num_dead),int(args.num_mute))
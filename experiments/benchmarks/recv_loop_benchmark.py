@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+'''
+Compares messages/sec of the original principal receive loop (recv
+exactly the bytes needed, append to a bytearray, re-slice the
+bytearray after every message) against ReceiveBuffer (large
+recv_into reads into a reusable buffer, messages parsed in place).
+
+Each run streams the same corpus of serialized flow mods over a
+local socketpair.  Rates are reported twice: once for framing alone
+and once with every message also parsed by ryu.
+'''
+import sys
+import os
+import socket
+import threading
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+from ryu.ofproto import ofproto_common, ofproto_parser
+from ryu.ofproto import ofproto_protocol, ofproto_v1_3
+import extended_v3_parser
+
+from recv_buffer import ReceiveBuffer
+
+
+def produce_flow_mod_corpus(num_msgs,num_actions):
+    '''
+    @returns {str} --- num_msgs serialized flow mods, back to back.
+    '''
+    datapath = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+    parser = datapath.ofproto_parser
+    ofproto = datapath.ofproto
+
+    serialized = []
+    for i in range(0,num_msgs):
+        match = parser.OFPMatch(
+            in_port=1,eth_type=0x0800,ipv4_dst=(i & 0xffffffff))
+        actions = [
+            parser.OFPActionOutput(port_num + 1)
+            for port_num in range(0,num_actions)]
+        instructions = [
+            parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS,actions),
+            parser.OFPInstructionGotoTable(1)]
+        flow_mod = parser.OFPFlowMod(
+            datapath,0,0,0,ofproto.OFPFC_ADD,0,0,10,
+            ofproto.OFP_NO_BUFFER,0,0,0,match,instructions)
+        flow_mod.xid = i
+        flow_mod.serialize()
+        serialized.append(str(flow_mod.buf))
+    return ''.join(serialized)
+
+
+def legacy_recv_loop(sock,datapath,on_msg,parse):
+    '''
+    The receive loop that PrincipalDatapath used before ReceiveBuffer.
+    '''
+    buf = bytearray()
+    required_len = ofproto_common.OFP_HEADER_SIZE
+    while True:
+        ret = sock.recv(required_len)
+        if len(ret) == 0:
+            break
+        buf += ret
+        while len(buf) >= required_len:
+            (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
+            required_len = msg_len
+            if len(buf) < required_len:
+                break
+            msg = None
+            if parse:
+                msg = ofproto_parser.msg(datapath,
+                                         version, msg_type, msg_len, xid, buf)
+            on_msg(msg)
+            buf = buf[required_len:]
+            required_len = ofproto_common.OFP_HEADER_SIZE
+
+
+def recv_buffer_loop(sock,datapath,on_msg,parse,buffer_size):
+    '''
+    The receive loop that PrincipalDatapath uses now.
+    '''
+    recv_buffer = ReceiveBuffer(buffer_size)
+    while recv_buffer.fill(sock) != 0:
+        while True:
+            header_and_buf = recv_buffer.next_message()
+            if header_and_buf is None:
+                break
+            (version, msg_type, msg_len, xid, buf) = header_and_buf
+            msg = None
+            if parse:
+                msg = ofproto_parser.msg(datapath,
+                                         version, msg_type, msg_len, xid, buf)
+            on_msg(msg)
+
+
+def time_loop(loop_func,corpus,num_msgs,parse,*args):
+    '''
+    @returns {float} --- messages per second that loop_func parsed.
+    '''
+    datapath = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+    reader, writer = socket.socketpair()
+
+    def write_corpus():
+        writer.sendall(corpus)
+        writer.close()
+    writer_thread = threading.Thread(target=write_corpus)
+
+    received = [0]
+    def on_msg(msg):
+        received[0] += 1
+
+    start = time.time()
+    writer_thread.start()
+    loop_func(reader,datapath,on_msg,parse,*args)
+    elapsed = time.time() - start
+    writer_thread.join()
+    reader.close()
+
+    assert received[0] == num_msgs
+    return num_msgs / elapsed
+
+
+def run(num_msgs,num_actions,buffer_size,num_trials):
+    corpus = produce_flow_mod_corpus(num_msgs,num_actions)
+    print ('%i flow mods, %i bytes each on average' %
+           (num_msgs,len(corpus) / num_msgs))
+
+    for parse in (False,True):
+        legacy_rates = []
+        recv_buffer_rates = []
+        for i in range(0,num_trials):
+            legacy_rates.append(
+                time_loop(legacy_recv_loop,corpus,num_msgs,parse))
+            recv_buffer_rates.append(
+                time_loop(recv_buffer_loop,corpus,num_msgs,parse,
+                          buffer_size))
+
+        if parse:
+            print '\nFraming and parsing'
+        else:
+            print '\nFraming only'
+        print '  legacy recv loop:    %10.0f msgs/sec' % max(legacy_rates)
+        print '  ReceiveBuffer loop:  %10.0f msgs/sec' % max(recv_buffer_rates)
+
+
+if __name__ == '__main__':
+    description = 'Benchmark principal receive loops'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-n','--num_msgs',help='Number of flow mods to stream',
+        default=50000)
+    parser.add_argument(
+        '-a','--num_actions',help='Output actions per flow mod',
+        default=2)
+    parser.add_argument(
+        '-b','--buffer_size',help='ReceiveBuffer size in bytes',
+        default=256*1024)
+    parser.add_argument(
+        '-t','--num_trials',help='Report best of this many runs',
+        default=3)
+    args = parser.parse_args()
+    run(int(args.num_msgs),int(args.num_actions),int(args.buffer_size),
+        int(args.num_trials))
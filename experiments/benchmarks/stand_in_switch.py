@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+'''
+A pure-Python stand-in for an OpenFlow 1.3 switch, so that Pluribus
+can be run and measured end-to-end without mininet, OVS or root.
+
+Like a real switch, the stand-in connects to Pluribus's OpenFlow
+listener (over loopback by default).  It answers hellos, features
+requests, port desc requests, barriers and echos, and keeps the flow
+mods it receives in an in-memory flow table that also answers flow
+stats requests.  Ports are named like the ones bin/start_v3_switch.py
+creates: physical ports and lback_port_<n>_a/_b pairs for logical
+ports.  Bundles are rejected the way switches that do not support
+them reject them, so Pluribus falls back to batches and barriers.
+
+Every received message is timestamped (@see
+StandInSwitch.received), so that experiments can measure flow mod
+throughput and latency through LogicalPortPluribusSwitch and
+ChainedTablePluribusSwitch.  Run Pluribus first, eg.,
+
+    ryu-manager src/logical_port_pluribus_switch.py
+
+and then
+
+    python stand_in_switch.py -p 2
+'''
+import sys
+import os
+import socket
+import struct
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','parser'))
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from recv_buffer import ReceiveBuffer, MAX_OFP_MESSAGE_SIZE
+from shadow_flow_table import ShadowFlowTable, stats_request_type
+from shadow_flow_table import produce_flow_stats_replies
+from shadow_flow_table import produce_aggregate_stats_reply
+from match_overlap_index import MatchOverlapIndex
+from wire_flow_mod import produce_error
+from port_util import produce_loopback_port_a, produce_loopback_port_b
+from port_util import num_logical_port_pairs_from_num_principals
+
+
+DEFAULT_CONTROLLER_ADDRESS = ('127.0.0.1',6633)
+
+# advertised in features replies
+DEFAULT_NUM_TABLES = 254
+DEFAULT_NUM_BUFFERS = 256
+CAPABILITIES = ofproto.OFPC_FLOW_STATS | ofproto.OFPC_TABLE_STATS
+
+PORT_SPEED_KBPS = 10000000
+
+_UINT16_PACK_STR = '!H'
+
+
+class StandInSwitch(object):
+
+    def __init__(self,num_physical_ports,num_logical_port_pairs,
+                 num_tables=DEFAULT_NUM_TABLES,
+                 num_buffers=DEFAULT_NUM_BUFFERS,datapath_id=1,
+                 record_received=True):
+        '''
+        @param {int} num_physical_ports --- Physical ports get numbers
+        1..num_physical_ports.
+
+        @param {int} num_logical_port_pairs --- Number of
+        lback_port_<n>_a/_b pairs.  Their ports are numbered after
+        the physical ports.
+
+        @param {bool} record_received --- Whether to append every
+        received message's timestamp to received.
+        '''
+        self.datapath_id = datapath_id
+        self.num_tables = num_tables
+        self.num_buffers = num_buffers
+        self.record_received = record_received
+
+        # each element is a (port number, port name) tuple
+        self.ports = []
+        for port_num in range(1,num_physical_ports + 1):
+            self.ports.append((port_num,'s1-eth%i' % port_num))
+        port_num = num_physical_ports + 1
+        for port_pair_num in range(0,num_logical_port_pairs):
+            self.ports.append(
+                (port_num,produce_loopback_port_a(port_pair_num)))
+            self.ports.append(
+                (port_num + 1,produce_loopback_port_b(port_pair_num)))
+            port_num += 2
+        self.ports.append((ofproto.OFPP_LOCAL,'s1'))
+
+        # rules installed so far.  A shadow flow table applies flow
+        # mods with the same add, modify and delete semantics as a
+        # switch, and can answer flow stats requests.
+        self.flow_table = ShadowFlowTable({},MatchOverlapIndex(),0)
+
+        # each element is a (receive time, msg_type, xid) tuple, in
+        # the order messages arrived.
+        self.received = []
+        # keys are OFPT_* message types; values are number received
+        self.num_received = {}
+        self.num_flow_mods = 0
+        self.first_flow_mod_time = None
+        self.last_flow_mod_time = None
+
+        self.sock = None
+        self.send_lock = hub.BoundedSemaphore(1)
+        self.connected_event = hub.Event()
+        self.closed_event = hub.Event()
+
+        self.handlers = {
+            ofproto.OFPT_HELLO: self._recv_hello,
+            ofproto.OFPT_ECHO_REQUEST: self._recv_echo_request,
+            ofproto.OFPT_FEATURES_REQUEST: self._recv_features_request,
+            ofproto.OFPT_BARRIER_REQUEST: self._recv_barrier_request,
+            ofproto.OFPT_MULTIPART_REQUEST: self._recv_multipart_request,
+            ofproto.OFPT_FLOW_MOD: self._recv_flow_mod,
+            ofproto.OFPT_EXPERIMENTER: self._recv_experimenter,
+            }
+
+    def start(self,address=DEFAULT_CONTROLLER_ADDRESS):
+        '''
+        Connects to Pluribus and serves the connection in its own
+        greenlet.
+
+        @param {tuple} address --- (host, port) of Pluribus's
+        OpenFlow listener.
+
+        @returns {greenlet}
+        '''
+        self.sock = hub.connect(address)
+        self.send(
+            _produce_header(
+                ofproto.OFPT_HELLO,ofproto.OFP_HEADER_SIZE,0))
+        self.connected_event.set()
+        return hub.spawn(self._recv_loop)
+
+    def stop(self):
+        '''
+        Disconnects from Pluribus, as a switch that went away would.
+        '''
+        if self.sock is not None:
+            try:
+                # wakes the receive loop up to exit cleanly
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # already disconnected
+                pass
+            self.sock.close()
+
+    def send(self,buf):
+        '''
+        @param {str or bytearray} buf --- One or more complete
+        messages.
+        '''
+        with self.send_lock:
+            self.sock.sendall(buf)
+
+    def send_packet_in(self,table_id,in_port,data,
+                       buffer_id=ofproto.OFP_NO_BUFFER,
+                       reason=ofproto.OFPR_ACTION,cookie=0):
+        '''
+        Sends Pluribus a packet in, as if a rule in table_id had sent
+        the packet to the controller.
+
+        @param {str} data --- Packet bytes.
+        '''
+        match = struct.pack(
+            '!HHII',ofproto.OFPMT_OXM,4 + 8,ofproto.OXM_OF_IN_PORT,in_port)
+        match += '\x00'*(-len(match) % 8)
+        packet_in = bytearray(
+            _produce_header(ofproto.OFPT_PACKET_IN,0,0) +
+            struct.pack(
+                ofproto.OFP_PACKET_IN_PACK_STR,buffer_id,len(data),reason,
+                table_id,cookie) +
+            match + '\x00\x00' + data)
+        _set_msg_len(packet_in)
+        self.send(packet_in)
+
+    def add_port(self,port_num,port_name):
+        '''
+        Adds a port, and tells Pluribus with an OFPPR_ADD port status.
+        '''
+        self.ports.append((port_num,port_name))
+        self._send_port_status(ofproto.OFPPR_ADD,port_num,port_name)
+
+    def delete_port(self,port_num):
+        '''
+        Deletes a port, and tells Pluribus with an OFPPR_DELETE port
+        status.
+        '''
+        for index, (existing_port_num, port_name) in enumerate(self.ports):
+            if existing_port_num == port_num:
+                del self.ports[index]
+                self._send_port_status(
+                    ofproto.OFPPR_DELETE,port_num,port_name)
+                return
+
+    def _send_port_status(self,reason,port_num,port_name):
+        port_status = bytearray(
+            _produce_header(ofproto.OFPT_PORT_STATUS,0,0) +
+            struct.pack('!B7x',reason) + _pack_port(port_num,port_name))
+        _set_msg_len(port_status)
+        self.send(port_status)
+
+    def wait_for_flow_mods(self,num_flow_mods,timeout=None,poll_period=.001):
+        '''
+        @returns {bool} --- True once at least num_flow_mods flow mods
+        have been received; False if timeout (seconds) passed first
+        or the connection closed.
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while self.num_flow_mods < num_flow_mods:
+            if self.closed_event.is_set():
+                return False
+            if (deadline is not None) and (time.time() > deadline):
+                return False
+            hub.sleep(poll_period)
+        return True
+
+    def flow_mod_rate(self):
+        '''
+        @returns {float or None} --- Flow mods per second, between the
+        first and last received.  None until there are two.
+        '''
+        if (self.num_flow_mods < 2 or
+            self.last_flow_mod_time == self.first_flow_mod_time):
+            return None
+        return (
+            (self.num_flow_mods - 1) /
+            (self.last_flow_mod_time - self.first_flow_mod_time))
+
+    def _recv_loop(self):
+        recv_buffer = ReceiveBuffer(4*MAX_OFP_MESSAGE_SIZE)
+        try:
+            while True:
+                if recv_buffer.fill(self.sock) == 0:
+                    break
+                now = time.time()
+                while True:
+                    msg = recv_buffer.next_message()
+                    if msg is None:
+                        break
+                    (version, msg_type, msg_len, xid, buf) = msg
+                    if self.record_received:
+                        self.received.append((now,msg_type,xid))
+                    self.num_received[msg_type] = (
+                        self.num_received.get(msg_type,0) + 1)
+                    handler = self.handlers.get(msg_type,None)
+                    if handler is not None:
+                        handler(now,xid,buf)
+        finally:
+            self.closed_event.set()
+
+    #### message handlers ####
+
+    def _recv_hello(self,now,xid,buf):
+        pass
+
+    def _recv_echo_request(self,now,xid,buf):
+        reply = bytearray(buf)
+        reply[1] = ofproto.OFPT_ECHO_REPLY
+        self.send(reply)
+
+    def _recv_features_request(self,now,xid,buf):
+        self.send(
+            _produce_header(
+                ofproto.OFPT_FEATURES_REPLY,ofproto.OFP_SWITCH_FEATURES_SIZE,
+                xid) +
+            struct.pack(
+                ofproto.OFP_SWITCH_FEATURES_PACK_STR,self.datapath_id,
+                self.num_buffers,self.num_tables,0,CAPABILITIES,0))
+
+    def _recv_barrier_request(self,now,xid,buf):
+        self.send(
+            _produce_header(
+                ofproto.OFPT_BARRIER_REPLY,ofproto.OFP_HEADER_SIZE,xid))
+
+    def _recv_flow_mod(self,now,xid,buf):
+        self.flow_table.apply_flow_mod(buf,())
+        self.num_flow_mods += 1
+        if self.first_flow_mod_time is None:
+            self.first_flow_mod_time = now
+        self.last_flow_mod_time = now
+
+    def _recv_experimenter(self,now,xid,buf):
+        self.send(
+            produce_error(
+                xid,ofproto.OFPET_BAD_REQUEST,
+                ofproto.OFPBRC_BAD_EXPERIMENTER,buf))
+
+    def _recv_multipart_request(self,now,xid,buf):
+        multipart_type = stats_request_type(buf)
+        if multipart_type == ofproto.OFPMP_PORT_DESC:
+            self.send(self._produce_port_desc_reply(xid))
+        elif multipart_type == ofproto.OFPMP_FLOW:
+            entries = self.flow_table.select_for_stats_request(buf)
+            for reply in produce_flow_stats_replies(xid,entries,now):
+                self.send(reply)
+        elif multipart_type == ofproto.OFPMP_AGGREGATE:
+            entries = self.flow_table.select_for_stats_request(buf)
+            self.send(produce_aggregate_stats_reply(xid,entries))
+        else:
+            self.send(
+                produce_error(
+                    xid,ofproto.OFPET_BAD_REQUEST,
+                    ofproto.OFPBRC_BAD_MULTIPART,buf))
+
+    def _produce_port_desc_reply(self,xid):
+        reply = bytearray(
+            _produce_header(ofproto.OFPT_MULTIPART_REPLY,0,xid) +
+            struct.pack(
+                ofproto.OFP_MULTIPART_REPLY_PACK_STR,
+                ofproto.OFPMP_PORT_DESC,0))
+        for port_num, port_name in self.ports:
+            reply += _pack_port(port_num,port_name)
+        _set_msg_len(reply)
+        return reply
+
+
+def _produce_header(msg_type,msg_len,xid):
+    return struct.pack(
+        ofproto.OFP_HEADER_PACK_STR,ofproto.OFP_VERSION,msg_type,msg_len,
+        xid)
+
+def _pack_port(port_num,port_name):
+    '''
+    @returns {str} --- ofp_port for port_num.
+    '''
+    hw_addr = struct.pack('!HI',0x0200,port_num & 0xffffffff)
+    return struct.pack(
+        ofproto.OFP_PORT_PACK_STR,port_num,hw_addr,port_name,0,
+        ofproto.OFPPS_LIVE,ofproto.OFPPF_10GB_FD,0,0,0,
+        PORT_SPEED_KBPS,PORT_SPEED_KBPS)
+
+def _set_msg_len(buf):
+    struct.pack_into(_UINT16_PACK_STR,buf,2,len(buf))
+
+
+def report(switch,report_period):
+    '''
+    Runs in its own greenlet.  Periodically prints flow mod counts.
+    '''
+    last_num_flow_mods = 0
+    while not switch.closed_event.is_set():
+        hub.sleep(report_period)
+        print '%i flow mods (%i in the last %.1fs), %i rules installed' % (
+            switch.num_flow_mods,switch.num_flow_mods - last_num_flow_mods,
+            report_period,switch.flow_table.num_entries)
+        last_num_flow_mods = switch.num_flow_mods
+
+
+if __name__ == '__main__':
+    description = 'Stand-in OpenFlow 1.3 switch for Pluribus'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-p','--num_principals',
+        help='Number of principals sharing the switch',default=2)
+    parser.add_argument(
+        '-n','--num_physical_ports',help='Number of physical ports',
+        default=4)
+    parser.add_argument(
+        '-a','--address',help='Host of Pluribus\'s OpenFlow listener',
+        default=DEFAULT_CONTROLLER_ADDRESS[0])
+    parser.add_argument(
+        '-o','--port',help='Port of Pluribus\'s OpenFlow listener',
+        default=DEFAULT_CONTROLLER_ADDRESS[1])
+    parser.add_argument(
+        '-r','--report_period',help='Seconds between status reports',
+        default=1.)
+    args = parser.parse_args()
+
+    switch = StandInSwitch(
+        int(args.num_physical_ports),
+        num_logical_port_pairs_from_num_principals(int(args.num_principals)),
+        # a long-running switch would accumulate timestamps forever
+        record_received=False)
+    recv_thread = switch.start((args.address,int(args.port)))
+    hub.spawn(report,switch,float(args.report_period))
+    recv_thread.wait()
+    print 'Pluribus closed the connection'
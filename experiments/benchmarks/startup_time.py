@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''
+Measures how long Pluribus takes to go from starting to running,
+ie., until it has connected to every principal's controller.
+
+Each run starts Pluribus in its own process, then connects a
+stand-in switch as soon as Pluribus listens, and acts as the
+principal controllers listed in Pluribus's principals file.  Reports,
+per run, the time from starting until the switch connected and until
+every principal was connected to.
+
+With -l, the switch only adds its loopback ports that many seconds
+after connecting (announcing them with port status messages), as
+openvswitch does when it adds ports after the switch is up: Pluribus
+should be running shortly after the ports are.
+
+Run from the directory that holds the pluribus.conf Pluribus should
+use.  Its principals file must be the one passed with -j.  Eg.,
+
+    python startup_time.py -j principals.json -r 5 -l .5
+'''
+import sys
+import os
+import json
+import socket
+import subprocess
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+
+from ryu.lib import hub
+
+from stand_in_switch import StandInSwitch
+from flow_mod_load_generator import StandInPrincipalController
+from port_util import produce_loopback_port_a, produce_loopback_port_b
+from port_util import num_logical_port_pairs_from_num_principals
+
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),'..','..','src')
+APPS = {
+    'logical': os.path.join(SRC_DIR,'logical_port_pluribus_switch.py'),
+    'chained': os.path.join(SRC_DIR,'chained_table_pluribus_switch.py'),
+    }
+
+# seconds between attempts to connect the switch to Pluribus
+CONNECT_RETRY_PERIOD = .01
+
+
+def run_once(app,ofp_port,principal_dicts,num_physical_ports,
+             late_ports_delay,timeout,verbose):
+    '''
+    @param {float or None} late_ports_delay --- If not None, the switch
+    adds its loopback ports this many seconds after connecting.
+
+    @returns {2-tuple} (a,b): seconds from starting Pluribus until
+    a) the switch connected; b) every principal was connected to.
+    Either is None on timing out.
+    '''
+    controllers = []
+    for principal_id, principal_dict in enumerate(principal_dicts):
+        controller = StandInPrincipalController(
+            principal_id,
+            (principal_dict['listening_ip_addr'],
+             int(principal_dict['listening_port_addr'])),
+            principal_dict['physical_ports'])
+        hub.spawn(controller.listen)
+        controllers.append(controller)
+
+    num_pairs = num_logical_port_pairs_from_num_principals(
+        len(principal_dicts))
+    switch = StandInSwitch(
+        num_physical_ports,0 if late_ports_delay is not None else num_pairs,
+        record_received=False)
+
+    output = None
+    if not verbose:
+        output = open(os.devnull,'w')
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable,'-m','ryu.cmd.manager','--ofp-tcp-listen-port',
+         str(ofp_port),app],
+        stdout=output,stderr=output)
+    try:
+        while True:
+            try:
+                switch.start(('127.0.0.1',ofp_port))
+                break
+            except socket.error:
+                if time.time() - start > timeout:
+                    return None, None
+                hub.sleep(CONNECT_RETRY_PERIOD)
+        connect_elapsed = time.time() - start
+
+        if late_ports_delay is not None:
+            hub.sleep(late_ports_delay)
+            port_num = num_physical_ports + 1
+            for port_pair_num in range(0,num_pairs):
+                switch.add_port(
+                    port_num,produce_loopback_port_a(port_pair_num))
+                switch.add_port(
+                    port_num + 1,produce_loopback_port_b(port_pair_num))
+                port_num += 2
+
+        for controller in controllers:
+            remaining = max(timeout - (time.time() - start),0)
+            if not controller.handshake_event.wait(remaining):
+                return connect_elapsed, None
+        return connect_elapsed, time.time() - start
+    finally:
+        process.terminate()
+        process.wait()
+        switch.stop()
+        if output is not None:
+            output.close()
+
+
+def run(principals_filename,app,ofp_port,num_runs,num_physical_ports,
+        late_ports_delay,timeout,verbose):
+    with open(principals_filename,'r') as fd:
+        principal_dicts = json.load(fd)
+
+    print '%6s %12s %12s' % ('run','connect s','running s')
+    running_times = []
+    for i in range(0,num_runs):
+        connect_elapsed, running_elapsed = run_once(
+            app,ofp_port,principal_dicts,num_physical_ports,
+            late_ports_delay,timeout,verbose)
+        print '%6i %12s %12s' % (
+            i,_format_seconds(connect_elapsed),
+            _format_seconds(running_elapsed))
+        if running_elapsed is not None:
+            running_times.append(running_elapsed)
+    if running_times:
+        running_times.sort()
+        print 'running: min %.3fs, median %.3fs, max %.3fs' % (
+            running_times[0],running_times[len(running_times)/2],
+            running_times[-1])
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return 'timed out'
+    return '%.3f' % seconds
+
+
+if __name__ == '__main__':
+    description = 'Time from starting Pluribus until it is running'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-j','--principals_file',required=True,
+        help='Principals JSON file that Pluribus loads')
+    parser.add_argument(
+        '-a','--app',choices=sorted(APPS.keys()),default='logical',
+        help='Which Pluribus switch to run')
+    parser.add_argument(
+        '-o','--port',help='Port for Pluribus\'s OpenFlow listener',
+        default=16633)
+    parser.add_argument(
+        '-r','--num_runs',help='Number of restarts to time',default=3)
+    parser.add_argument(
+        '-n','--num_physical_ports',
+        help='Physical ports on the switch; must include every ' +
+        'principal\'s',default=4)
+    parser.add_argument(
+        '-l','--late_ports_delay',
+        help='Seconds after connecting before the switch adds its ' +
+        'loopback ports',default=None)
+    parser.add_argument(
+        '-t','--timeout',help='Seconds to wait for each run',default=30.)
+    parser.add_argument(
+        '-v','--verbose',action='store_true',
+        help='Show Pluribus\'s output')
+    args = parser.parse_args()
+
+    late_ports_delay = None
+    if args.late_ports_delay is not None:
+        late_ports_delay = float(args.late_ports_delay)
+    run(
+        args.principals_file,APPS[args.app],int(args.port),
+        int(args.num_runs),int(args.num_physical_ports),late_ports_delay,
+        float(args.timeout),args.verbose)
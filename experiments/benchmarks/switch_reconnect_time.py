@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+'''
+Measures how long Pluribus takes to get a switch back in sync after
+the switch's connection drops, and checks that principals do not
+notice.
+
+Starts Pluribus in its own process, connects a stand-in switch and
+acts as the principal controllers listed in Pluribus's principals
+file.  Each principal installs some rules, then the switch
+disconnects.  While it is away, each principal installs more rules
+and sends a barrier.  A new stand-in switch (with the same ports, but
+no rules) then connects.  Reports the time from the switch
+reconnecting until every principal's barrier was answered, and
+whether the new switch ended up with every rule.
+
+Run from the directory that holds the pluribus.conf Pluribus should
+use.  Its principals file must be the one passed with -j.  Eg.,
+
+    python switch_reconnect_time.py -j principals.json -n 5000 -d 1
+'''
+import sys
+import os
+import json
+import socket
+import subprocess
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..','src'))
+
+from ryu.lib import hub
+
+from stand_in_switch import StandInSwitch
+from flow_mod_load_generator import StandInPrincipalController
+from port_util import num_logical_port_pairs_from_num_principals
+
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),'..','..','src')
+APPS = {
+    'logical': os.path.join(SRC_DIR,'logical_port_pluribus_switch.py'),
+    'chained': os.path.join(SRC_DIR,'chained_table_pluribus_switch.py'),
+    }
+
+# seconds between attempts to connect the switch to Pluribus
+CONNECT_RETRY_PERIOD = .01
+# seconds between checks for acknowledged flow mods
+ACK_POLL_PERIOD = .001
+
+
+def connect_switch(switch,ofp_port,deadline):
+    while True:
+        try:
+            switch.start(('127.0.0.1',ofp_port))
+            return True
+        except socket.error:
+            if time.time() > deadline:
+                return False
+            hub.sleep(CONNECT_RETRY_PERIOD)
+
+def wait_for_acks(controllers,deadline):
+    '''
+    @returns {bool} --- True if every flow mod every controller sent
+    was acknowledged by a barrier reply before deadline.
+    '''
+    for controller in controllers:
+        while controller.num_flow_mods_acked < controller.num_flow_mods_sent:
+            if time.time() > deadline:
+                return False
+            hub.sleep(ACK_POLL_PERIOD)
+    return True
+
+def run(principals_filename,app,ofp_port,num_flow_mods,num_outage_flow_mods,
+        outage,num_physical_ports,timeout,verbose):
+    with open(principals_filename,'r') as fd:
+        principal_dicts = json.load(fd)
+
+    controllers = []
+    for principal_id, principal_dict in enumerate(principal_dicts):
+        controller = StandInPrincipalController(
+            principal_id,
+            (principal_dict['listening_ip_addr'],
+             int(principal_dict['listening_port_addr'])),
+            principal_dict['physical_ports'])
+        hub.spawn(controller.listen)
+        controllers.append(controller)
+
+    num_pairs = num_logical_port_pairs_from_num_principals(
+        len(principal_dicts))
+    switch = StandInSwitch(num_physical_ports,num_pairs,record_received=False)
+    new_switch = StandInSwitch(
+        num_physical_ports,num_pairs,record_received=False)
+
+    output = None
+    if not verbose:
+        output = open(os.devnull,'w')
+    deadline = time.time() + timeout
+    process = subprocess.Popen(
+        [sys.executable,'-m','ryu.cmd.manager','--ofp-tcp-listen-port',
+         str(ofp_port),app],
+        stdout=output,stderr=output)
+    try:
+        if not connect_switch(switch,ofp_port,deadline):
+            print 'Switch could not connect'
+            return
+        for controller in controllers:
+            remaining = max(deadline - time.time(),0)
+            if not controller.handshake_event.wait(remaining):
+                print 'Principals never connected'
+                return
+
+        for controller in controllers:
+            controller.send_flow_mods(num_flow_mods,num_flow_mods)
+        if not wait_for_acks(controllers,deadline):
+            print 'Rules never acknowledged before disconnecting'
+            return
+        num_rules = switch.flow_table.num_entries
+
+        switch.stop()
+        hub.sleep(outage/2.)
+        for controller in controllers:
+            controller.send_flow_mods(
+                num_outage_flow_mods,num_outage_flow_mods)
+        hub.sleep(outage/2.)
+
+        reconnect_start = time.time()
+        if not connect_switch(new_switch,ofp_port,deadline):
+            print 'Switch could not reconnect'
+            return
+        resynced = wait_for_acks(controllers,deadline)
+        resync_elapsed = time.time() - reconnect_start
+        # rules sent after the barrier (none here) would be counted
+        # too: the barrier's reply means these have all arrived.
+        expected_num_rules = (
+            num_rules + len(controllers)*num_outage_flow_mods)
+
+        print 'rules before disconnecting: %i' % num_rules
+        print 'rules after reconnecting:   %i (expected %i)' % (
+            new_switch.flow_table.num_entries,expected_num_rules)
+        print 'principal errors:           %i' % sum(
+            controller.num_errors for controller in controllers)
+        if resynced:
+            print 'resynced in:                %.3fs' % resync_elapsed
+        else:
+            print 'resynced in:                timed out'
+    finally:
+        process.terminate()
+        process.wait()
+        switch.stop()
+        new_switch.stop()
+        if output is not None:
+            output.close()
+
+
+if __name__ == '__main__':
+    description = 'Time for Pluribus to resync a reconnecting switch'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-j','--principals_file',required=True,
+        help='Principals JSON file that Pluribus loads')
+    parser.add_argument(
+        '-a','--app',choices=sorted(APPS.keys()),default='logical',
+        help='Which Pluribus switch to run')
+    parser.add_argument(
+        '-o','--port',help='Port for Pluribus\'s OpenFlow listener',
+        default=16633)
+    parser.add_argument(
+        '-n','--num_flow_mods',
+        help='Rules each principal installs before the switch disconnects',
+        default=1000)
+    parser.add_argument(
+        '-m','--num_outage_flow_mods',
+        help='Rules each principal installs while the switch is away',
+        default=100)
+    parser.add_argument(
+        '-d','--outage',help='Seconds the switch is away for',default=1.)
+    parser.add_argument(
+        '-p','--num_physical_ports',
+        help='Physical ports on the switch; must include every ' +
+        'principal\'s',default=4)
+    parser.add_argument(
+        '-t','--timeout',help='Seconds to wait for everything',default=60.)
+    parser.add_argument(
+        '-v','--verbose',action='store_true',
+        help='Show Pluribus\'s output')
+    args = parser.parse_args()
+
+    run(
+        args.principals_file,APPS[args.app],int(args.port),
+        int(args.num_flow_mods),int(args.num_outage_flow_mods),
+        float(args.outage),int(args.num_physical_ports),
+        float(args.timeout),args.verbose)
@@ -201,6 +201,7 @@ class OFPFlowMod(FlowModClass):
             instructions.append(inst)
             instructions_offset += inst.len
             inst_length -= inst.len
+        msg.instructions = instructions
 
         return msg
 
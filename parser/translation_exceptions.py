@@ -16,8 +16,19 @@ class InvalidOutputAction (Exception):
     Flowmod instruction tries to write out of an incorrect port.
     '''
 
+class MalformedFlowModException (Exception):
+    '''
+    Flowmod's instructions or actions have lengths that do not add up.
+    '''
+
 #### Exceptions unique to chained table approach
 class InvalidPacketInPortMatch(Exception):
     '''
     Flowmod instruction tries to match to an invalid port.
     '''
+
+class IsolationViolationException(Exception):
+    '''
+    Flowmod would install a rule that overlaps another principal's
+    rule in the same physical table.
+    '''
@@ -0,0 +1,101 @@
+import collections
+import time
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+
+class BufferIdPool(object):
+    '''
+    One principal's share of the switch's packet buffers.
+
+    When the switch buffers a packet it sends to the controller, the
+    packet in carries the switch's (physical) buffer id.  The
+    principal gets a virtual buffer id in its place, from a range of
+    its own, and flow mods and packet outs that use a virtual buffer
+    id get the physical one back.  A buffer can only be used once, so
+    using a virtual id also frees it.
+
+    The switch discards buffered packets after a few seconds, and
+    controllers often never use a buffer at all, so mappings expire
+    after a timeout.  If every virtual id is taken, the oldest mapping
+    gets evicted.  Freed ids go to the back of a FIFO free list, so
+    that a freed id is reused as late as possible: a principal that
+    uses a stale id is then more likely to get an unknown buffer error
+    than someone else's packet.
+    '''
+
+    def __init__(self,num_buffers,timeout):
+        '''
+        @param {int} num_buffers --- Number of virtual buffer ids:
+        0..num_buffers-1.  0 means the principal gets no buffers and
+        packet ins it receives are unbuffered.
+
+        @param {float} timeout --- Seconds after which a mapping
+        expires.
+        '''
+        self.num_buffers = num_buffers
+        self.timeout = timeout
+        self.free_ids = collections.deque(range(0,num_buffers))
+        # keys are virtual buffer ids; values are (physical buffer
+        # id, time allocated) tuples.  Ordered oldest first.
+        self.allocated = collections.OrderedDict()
+
+        #### counters
+        self.num_expired = 0
+        self.num_evicted = 0
+
+    def allocate(self,physical_buffer_id,now=None):
+        '''
+        @param {int} physical_buffer_id --- Buffer id from a packet in.
+
+        @returns {int} --- Virtual buffer id to give the principal in
+        its place.  OFP_NO_BUFFER if the principal has no buffers.
+        '''
+        if self.num_buffers == 0:
+            return ofproto.OFP_NO_BUFFER
+        if now is None:
+            now = time.time()
+        self.expire(now)
+
+        if not self.free_ids:
+            (virtual_buffer_id, _) = self.allocated.popitem(last=False)
+            self.free_ids.append(virtual_buffer_id)
+            self.num_evicted += 1
+
+        virtual_buffer_id = self.free_ids.popleft()
+        self.allocated[virtual_buffer_id] = (physical_buffer_id,now)
+        return virtual_buffer_id
+
+    def release(self,virtual_buffer_id,now=None):
+        '''
+        Look up a virtual buffer id the principal used and free it.
+
+        @returns {int or None} --- The physical buffer id it mapped
+        to.  None if the virtual id is unknown or expired.
+        '''
+        if now is None:
+            now = time.time()
+        self.expire(now)
+
+        physical_buffer_id_and_time = self.allocated.pop(
+            virtual_buffer_id,None)
+        if physical_buffer_id_and_time is None:
+            return None
+        self.free_ids.append(virtual_buffer_id)
+        return physical_buffer_id_and_time[0]
+
+    def expire(self,now):
+        '''
+        Free every mapping older than the timeout.
+        '''
+        allocated = self.allocated
+        while allocated:
+            virtual_buffer_id = next(iter(allocated))
+            if now - allocated[virtual_buffer_id][1] < self.timeout:
+                break
+            del allocated[virtual_buffer_id]
+            self.free_ids.append(virtual_buffer_id)
+            self.num_expired += 1
+
+    def num_allocated(self):
+        return len(self.allocated)
@@ -0,0 +1,210 @@
+'''
+Wire format of the ONF bundle extension for OpenFlow 1.3 (ONF
+EXT-230).  Bundle messages are experimenter messages:
+
+    ofp_experimenter_header   (experimenter=ONF_EXPERIMENTER_ID)
+    bundle_id                 uint32
+    ...
+
+Bundle control messages (exp_type=ONF_ET_BUNDLE_CONTROL) follow
+bundle_id with a uint16 control type and a uint16 flags field.
+Bundle add messages (exp_type=ONF_ET_BUNDLE_ADD_MESSAGE) follow it
+with 2 bytes of padding, a uint16 flags field and a complete OpenFlow
+message, whose xid must match the bundle add message's xid.
+'''
+import struct
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+
+ONF_EXPERIMENTER_ID = 0x4f4e4600
+
+ONF_ET_BUNDLE_CONTROL = 2300
+ONF_ET_BUNDLE_ADD_MESSAGE = 2301
+
+# bundle control types
+ONF_BCT_OPEN_REQUEST = 0
+ONF_BCT_OPEN_REPLY = 1
+ONF_BCT_CLOSE_REQUEST = 2
+ONF_BCT_CLOSE_REPLY = 3
+ONF_BCT_COMMIT_REQUEST = 4
+ONF_BCT_COMMIT_REPLY = 5
+ONF_BCT_DISCARD_REQUEST = 6
+ONF_BCT_DISCARD_REPLY = 7
+
+# bundle flags
+ONF_BF_ATOMIC = 1 << 0
+ONF_BF_ORDERED = 1 << 1
+
+# bundle error codes, sent as experimenter errors
+ONFERR_ET_UNKNOWN = 2300
+ONFERR_ET_BAD_ID = 2302
+ONFERR_ET_BUNDLE_EXIST = 2303
+ONFERR_ET_BUNDLE_CLOSED = 2304
+ONFERR_ET_MSG_UNSUP = 2310
+ONFERR_ET_FAILED = 2313
+
+ONF_BUNDLE_CTRL_PACK_STR = '!IHH'
+ONF_BUNDLE_CTRL_SIZE = ofproto.OFP_EXPERIMENTER_HEADER_SIZE + 8
+ONF_BUNDLE_ADD_PACK_STR = '!I2xH'
+ONF_BUNDLE_ADD_SIZE = ofproto.OFP_EXPERIMENTER_HEADER_SIZE + 8
+
+_EXPERIMENTER_ERROR_PACK_STR = '!HHI'
+_XID_OFFSET = 4
+_XID_PACK_STR = '!I'
+
+
+class OpenBundle(object):
+    '''
+    A bundle that a principal has opened, but not yet committed or
+    discarded.
+    '''
+    def __init__(self,flags):
+        self.flags = flags
+        self.closed = False
+        # set if any message added to bundle could not be translated.
+        self.failed = False
+        # each element is a (flow mod, translated bufs) tuple: a copy
+        # of a flow mod added to the bundle and the messages it was
+        # translated to, before mapping its buffer id.
+        self.flow_mods = []
+
+
+class SwitchBundle(object):
+    '''
+    A principal's committed bundle that has been sent to the switch,
+    but that the switch has not yet acknowledged.
+    '''
+    def __init__(self,principal,commit_xid,bundle_id,flags,
+                 translated_bufs):
+        '''
+        @param {Principal} principal --- Principal that committed the
+        bundle.
+
+        @param {int} commit_xid --- xid of the principal's commit
+        request.
+
+        @param {int} bundle_id --- Principal's id for the bundle.
+        '''
+        self.principal = principal
+        self.commit_xid = commit_xid
+        self.bundle_id = bundle_id
+        self.flags = flags
+        self.translated_bufs = translated_bufs
+        # xids of all messages sent to the switch for this bundle
+        self.switch_xids = []
+        # set once the bundle's outcome has been reported to the
+        # principal.
+        self.done = False
+
+
+def get_xid(buf):
+    '''
+    @param {buffer or bytearray} buf --- Serialized OpenFlow message.
+    '''
+    (xid,) = struct.unpack_from(_XID_PACK_STR,buf,_XID_OFFSET)
+    return xid
+
+def onf_bundle_exp_type(buf):
+    '''
+    @param {buffer} buf --- An OFPT_EXPERIMENTER message.
+
+    @returns {int or None} --- ONF_ET_BUNDLE_CONTROL or
+    ONF_ET_BUNDLE_ADD_MESSAGE if buf is a bundle message; None
+    otherwise.
+    '''
+    if len(buf) < ofproto.OFP_EXPERIMENTER_HEADER_SIZE:
+        return None
+    (experimenter, exp_type) = struct.unpack_from(
+        ofproto.OFP_EXPERIMENTER_HEADER_PACK_STR,buf,ofproto.OFP_HEADER_SIZE)
+    if experimenter != ONF_EXPERIMENTER_ID:
+        return None
+    if ((exp_type == ONF_ET_BUNDLE_CONTROL) or
+        (exp_type == ONF_ET_BUNDLE_ADD_MESSAGE)):
+        return exp_type
+    return None
+
+def parse_bundle_ctrl(buf):
+    '''
+    @returns {3-tuple} --- (bundle_id, ctrl_type, flags)
+    '''
+    return struct.unpack_from(
+        ONF_BUNDLE_CTRL_PACK_STR,buf,ofproto.OFP_EXPERIMENTER_HEADER_SIZE)
+
+def parse_bundle_add(buf):
+    '''
+    @returns {3-tuple} --- (bundle_id, flags, inner_msg), where
+    inner_msg is a buffer over the bundled message (a view into buf:
+    copy it before keeping it).
+    '''
+    (bundle_id, flags) = struct.unpack_from(
+        ONF_BUNDLE_ADD_PACK_STR,buf,ofproto.OFP_EXPERIMENTER_HEADER_SIZE)
+    (_, _, inner_len, _) = struct.unpack_from(
+        ofproto.OFP_HEADER_PACK_STR,buf,ONF_BUNDLE_ADD_SIZE)
+    inner_msg = buffer(buf,ONF_BUNDLE_ADD_SIZE,inner_len)
+    return bundle_id, flags, inner_msg
+
+def produce_bundle_ctrl(xid,bundle_id,ctrl_type,flags):
+    '''
+    @returns {bytearray} --- A serialized bundle control message.
+    '''
+    buf = bytearray(ONF_BUNDLE_CTRL_SIZE)
+    _pack_experimenter_header(
+        buf,ONF_BUNDLE_CTRL_SIZE,xid,ONF_ET_BUNDLE_CONTROL)
+    struct.pack_into(
+        ONF_BUNDLE_CTRL_PACK_STR,buf,ofproto.OFP_EXPERIMENTER_HEADER_SIZE,
+        bundle_id,ctrl_type,flags)
+    return buf
+
+def produce_bundle_add(bundle_id,flags,inner_msg):
+    '''
+    @param {bytearray} inner_msg --- Serialized message to add to the
+    bundle.  The bundle add message reuses its xid.
+
+    @returns {bytearray} --- A serialized bundle add message.
+    '''
+    xid = get_xid(inner_msg)
+    msg_len = ONF_BUNDLE_ADD_SIZE + len(inner_msg)
+    buf = bytearray(ONF_BUNDLE_ADD_SIZE)
+    _pack_experimenter_header(buf,msg_len,xid,ONF_ET_BUNDLE_ADD_MESSAGE)
+    struct.pack_into(
+        ONF_BUNDLE_ADD_PACK_STR,buf,ofproto.OFP_EXPERIMENTER_HEADER_SIZE,
+        bundle_id,flags)
+    buf += inner_msg
+    return buf
+
+def produce_bundle_error(xid,error_code,offending_msg):
+    '''
+    @param {int} error_code --- One of the ONFERR_ET_* codes.
+
+    @param {buffer} offending_msg --- Request that caused the error.
+    At most its first 64 bytes are echoed back.
+
+    @returns {bytearray} --- A serialized experimenter error message.
+    '''
+    data = offending_msg[0:64]
+    msg_len = ofproto.OFP_HEADER_SIZE + 8 + len(data)
+    buf = bytearray(ofproto.OFP_HEADER_SIZE + 8)
+    struct.pack_into(
+        ofproto.OFP_HEADER_PACK_STR,buf,0,
+        ofproto.OFP_VERSION,ofproto.OFPT_ERROR,msg_len,xid)
+    struct.pack_into(
+        _EXPERIMENTER_ERROR_PACK_STR,buf,ofproto.OFP_HEADER_SIZE,
+        ofproto.OFPET_EXPERIMENTER,error_code,ONF_EXPERIMENTER_ID)
+    buf += data
+    return buf
+
+def set_xid(buf,xid):
+    '''
+    @param {bytearray} buf --- Serialized OpenFlow message to rewrite
+    the xid of in place.
+    '''
+    struct.pack_into(_XID_PACK_STR,buf,_XID_OFFSET,xid)
+
+def _pack_experimenter_header(buf,msg_len,xid,exp_type):
+    struct.pack_into(
+        ofproto.OFP_HEADER_PACK_STR,buf,0,
+        ofproto.OFP_VERSION,ofproto.OFPT_EXPERIMENTER,msg_len,xid)
+    struct.pack_into(
+        ofproto.OFP_EXPERIMENTER_HEADER_PACK_STR,buf,ofproto.OFP_HEADER_SIZE,
+        ONF_EXPERIMENTER_ID,exp_type)
@@ -16,13 +16,15 @@ class ChainedTablePluribusSwitch(PluribusSwitch):
     def __init__(self, *args, **kwargs):
         super(ChainedTablePluribusSwitch, self).__init__(
             ChainedTablePrincipal,*args, **kwargs)
+        # principals' virtual ports get numbered from here, above all
+        # of the switch's ports.
+        self.first_virtual_port_number = None
 
-    def _init_recv_port_stats_response_config(self,ev):
+    def _init_switch_ports(self):
         '''
         As part of initialization, determine which ports are logical
         and which ports are physical.
         '''
-        self._populate_ports_from_port_stats_response(ev)
         if self.state == SwitchState.UNINITIALIZED:
             self._transition_from_uninitialized()
         #### DEBUG
@@ -85,32 +87,29 @@ class ChainedTablePluribusSwitch(PluribusSwitch):
                 late_table_index + late_tables_per_principal)
             
             # update next index to assign frmo
-            assigning_early_table_index += num_early_tables
+            assigning_early_table_index += early_tables_per_principal
 
             # update tables for principals
             principal.add_table_ids(early_tables, late_tables)
 
-            # FIXME: set real number of buffers on principal
-            pluribus_logger.error(
-                'FIXME: Assigning hardcoded number of ' +
-                'buffers between switches')
-            principal.set_num_buffers(5)
+            principal.set_num_buffers(self.num_buffers_per_principal())
 
             
         #### PART 2
 
         # find highest physical port number and add one to get first
         # virtual port number
-        highest_port_number = -1
-        for port_name_number in self.port_name_number_list:
-            if port_name_number.port_number > highest_port_number:
-                highest_port_number = port_name_number.port_number
-        first_available_virtual_port_number = highest_port_number + 1
+        self.first_virtual_port_number = (
+            self.port_index.highest_port_number() + 1)
         
         # add all egress logical port numbers for each principal
         for principal in self.principals:
             principal.add_egress_logical_port_num_to_table_id(
-                self.principals,first_available_virtual_port_number)
+                self.principals,self.first_virtual_port_number)
+
+        # puts back principals' rules from before restarting, if
+        # they were assigned the same tables and ports then.
+        self._restore_checkpoint()
 
         #### PART 3: Set head table for each principal
         for principal in self.principals:
@@ -143,3 +142,17 @@ class ChainedTablePluribusSwitch(PluribusSwitch):
 
         # note: do not send barrier here.  rely on caller to send
         # barrier.
+
+    def _ports_changed(self):
+        '''
+        @see _ports_changed of PluribusSwitch
+
+        Only checks for collisions with principals' virtual ports.
+        Principals get their tables and virtual ports when Pluribus
+        initializes, so another principal means restarting Pluribus.
+        '''
+        highest_port_number = self.port_index.highest_port_number()
+        if highest_port_number >= self.first_virtual_port_number:
+            pluribus_logger.error(
+                ('Switch port number %i collides with principals\' ' %
+                 highest_port_number) + 'virtual port numbers.')
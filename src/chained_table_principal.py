@@ -1,16 +1,28 @@
-import pickle
+import copy
 
 from principals_util import Principal
 from conf import pluribus_logger
+from trace_log import trace
+from trace_log import EVENT_FLOW_MOD_TRANSLATED, EVENT_EARLY_LATE_SPLIT
+from trace_log import EVENT_LOGICAL_OUTPUT_UNHANDLED
 from extended_v3_parser import OFPSwitchFeatures as PluribusSwitchFeatures
 
 from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto.ofproto_v1_3_parser import OFPInstructionGotoTable
+from ryu.ofproto.ofproto_v1_3_parser import OFPInstructionActions
+from ryu.ofproto.ofproto_v1_3_parser import OFPActionOutput
 from translation_exceptions import InvalidTableWriteException
 from translation_exceptions import InvalidGotoTableException
 from translation_exceptions import InvalidOutputAction
 from translation_exceptions import InvalidPacketInPortMatch
 
+from logical_port_principal import flow_mod_rewrite_table_ids
+from logical_port_principal import flow_mod_rewrite_gotos
+from wire_flow_mod import flow_mod_table_id, flow_mod_match_in_port
+from translation_plan import TranslationPlan
+from packet_in_demux import PacketInRoute
+from wire_flow_mod import fan_out_flow_mod_wire
+
 class ChainedTablePrincipal(Principal):
 
     def __init__(self,pluribus_switch,physical_port_set,listening_ip_addr,
@@ -35,11 +47,47 @@ class ChainedTablePrincipal(Principal):
         self.late_table_ids = None
 
         self.egress_logical_port_num_to_table_id = {}
+        # keys are physical ports of other principals; values are the
+        # logical port numbers this principal uses for the principal
+        # that owns them.  Packets in late tables entered the switch
+        # through another principal's physical port.
+        self.peer_physical_port_to_logical_port_num = {}
+        self.compile_translation_plan()
         
 
     def add_table_ids(self,early_table_ids, late_table_ids):
         self.early_table_ids = early_table_ids
         self.late_table_ids = late_table_ids
+        self.invalidate_translations()
+
+    def compile_translation_plan(self):
+        '''
+        @see compile_translation_plan of Principal
+
+        The plan translates into the early tables: only flow mods
+        that go to the early tables unchanged take the fast path.
+        '''
+        self.translation_plan = TranslationPlan(
+            self.early_table_ids,self.physical_port_set,
+            self.egress_logical_port_num_to_table_id.keys())
+        # logical ports are gotos into other principals' tables,
+        # which packet outs cannot do.
+        self.packet_out_ports = frozenset(self.physical_port_set)
+
+    def checkpoint_assignment(self):
+        '''
+        @see checkpoint_assignment of Principal
+        '''
+        assignment = super(
+            ChainedTablePrincipal,self).checkpoint_assignment()
+        assignment.append(self.early_table_ids)
+        assignment.append(self.late_table_ids)
+        port_num_table_ids = []
+        for port_num, table_id in sorted(
+            self.egress_logical_port_num_to_table_id.items()):
+            port_num_table_ids.extend([port_num,table_id])
+        assignment.append(port_num_table_ids)
+        return assignment
 
     def add_egress_logical_port_num_to_table_id(
         self,principals_list,virtual_port_start_id):
@@ -59,8 +107,35 @@ class ChainedTablePrincipal(Principal):
                 principal.get_first_late_table_physical_id())
             self.egress_logical_port_num_to_table_id[
                 virtual_port_start_id] = first_late_tbl_phys_id
+            for port_num in principal.physical_port_set:
+                self.peer_physical_port_to_logical_port_num[port_num] = (
+                    virtual_port_start_id)
             virtual_port_start_id += 1
+        self.invalidate_translations()
             
+    def packet_in_routes(self):
+        '''
+        @see packet_in_routes of Principal
+
+        Packet ins from late tables report the logical port the
+        packet crossed over from, rather than the other principal's
+        physical port it entered the switch on.
+        '''
+        if self.early_table_ids is None:
+            return []
+        routes = [
+            (physical_table_id,PacketInRoute(self,virtual_table_id))
+            for virtual_table_id, physical_table_id in enumerate(
+                self.early_table_ids)]
+        routes.extend(
+            (physical_table_id,
+             PacketInRoute(
+                 self,virtual_table_id,
+                 self.peer_physical_port_to_logical_port_num))
+            for virtual_table_id, physical_table_id in enumerate(
+                self.late_table_ids))
+        return routes
+
     def get_first_late_table_physical_id(self):
         return self.late_table_ids[0]
     
@@ -92,26 +167,77 @@ class ChainedTablePrincipal(Principal):
             switch_features_msg)
 
         
-    def handle_flow_mod(self,msg):
+    def translate_flow_mod(self,msg):
         '''
         @param {extended_v3_parser.OFPFlowMod} msg
 
+        @returns {list} --- @see translate_flow_mod of Principal
         '''
-        # FIXME: must handle flow mod request for chained tables
-        pluribus_logger.error(
-            'FIXME: still handling flow mod request for chained tables')
-
         # FIXME: catch potential exceptions from generating packets
         # and return appropriate error codes.
         early_table_flow_mod_msg,late_table_flow_mod_msg = (
             produce_early_late_flow_mods(self,msg))
 
+        translated_msgs = []
         if early_table_flow_mod_msg is not None:
-            self.pluribus_switch.send_msg(early_table_flow_mod_msg)
+            translated_msgs.append(early_table_flow_mod_msg)
         if late_table_flow_mod_msg is not None:
-            self.pluribus_switch.send_msg(late_table_flow_mod_msg)
-        
-        
+            translated_msgs.append(late_table_flow_mod_msg)
+        trace(
+            self.id,EVENT_FLOW_MOD_TRANSLATED,msg.xid or 0,
+            len(translated_msgs))
+        return translated_msgs
+
+    def translate_raw_flow_mod(self,buf):
+        '''
+        @see translate_raw_flow_mod of Principal
+
+        Only flow mods that match on one of this principal's physical
+        ports and only output to physical ports can be patched in
+        place: they go to the early tables unchanged.  Everything else
+        needs produce_early_late_flow_mods.
+        '''
+        if flow_mod_table_id(buf) == ofproto_v1_3.OFPTT_ALL:
+            return self._fan_out_all_tables_flow_mod(buf)
+
+        # Wildcard in_port rules get duplicated into early and late
+        # tables and rules on logical ports get their matches
+        # rewritten.
+        if not self.translation_plan.is_physical_port(
+            flow_mod_match_in_port(buf)):
+            return None
+
+        flow_mod_buf = bytearray(buf)
+        outputs_to_logical_port = (
+            self.translation_plan.translate_flow_mod_wire(flow_mod_buf))
+        if outputs_to_logical_port:
+            # logical outputs get replaced by gotos
+            return None
+
+        return [flow_mod_buf]
+
+    def _fan_out_all_tables_flow_mod(self,buf):
+        '''
+        @param {buffer} buf --- A delete targetting OFPTT_ALL.
+
+        @returns {list} --- Deletes for each of the early and/or late
+        tables that the rules buf matches could have been installed
+        in (@see produce_early_late_flow_mods).
+        '''
+        match_in_port = flow_mod_match_in_port(buf)
+        if ((match_in_port is None) or
+            (match_in_port == ofproto_v1_3.OFPP_ANY)):
+            return fan_out_flow_mod_wire(
+                buf,self.early_table_ids + self.late_table_ids)
+        elif self.translation_plan.is_physical_port(match_in_port):
+            return fan_out_flow_mod_wire(buf,self.early_table_ids)
+        elif self.translation_plan.is_logical_port(match_in_port):
+            # late table rules for logical ports were installed with
+            # their in_port rewritten to OFPP_ANY.
+            return fan_out_flow_mod_wire(
+                buf,self.late_table_ids,ofproto_v1_3.OFPP_ANY)
+        raise InvalidPacketInPortMatch()
+
 
 def produce_early_late_flow_mods(chained_principal,msg):
     '''
@@ -134,23 +260,21 @@ def produce_early_late_flow_mods(chained_principal,msg):
             * Match does not include a logical port
             
     PART 1:
+        Do translation for table ids and goto actions.
+
+    PART 2:
         For output actions, check that output to a valid port.  For
         physical outputs, leave action the same.  For virtual outputs,
         jump to appropriate table or cause packet in at controller.
-
-    PART 2:
-        Do translation for goto actions.
         
     '''
 
     # FIXME: must add and zero metadata for explicit matches on
     # virtual ports... should probably use unique virtual port ids
-    # amongst principals.
-    pluribus_logger.error(
-        '\nFIXME: for rules that only target a virtual port, ' +
-        'must add metadata during goto and replace match ' +
-        'with match on metadata.  Then, in rule, zero metadata.\n')
-    
+    # amongst principals.  For rules that only target a virtual port,
+    # must add metadata during goto and replace match with match on
+    # metadata.  Then, in rule, zero metadata.
+
     early_table_flow_mod_msg = None
     late_table_flow_mod_msg = None
 
@@ -187,6 +311,22 @@ def produce_early_late_flow_mods(chained_principal,msg):
 
 
     #### PART 1:
+    if early_table_flow_mod_msg is not None:
+        flow_mod_rewrite_table_ids(
+            early_table_flow_mod_msg,chained_principal.early_table_ids,
+            chained_principal.id)
+        flow_mod_rewrite_gotos(
+            early_table_flow_mod_msg,chained_principal.early_table_ids,
+            chained_principal.id)
+    if late_table_flow_mod_msg is not None:
+        flow_mod_rewrite_table_ids(
+            late_table_flow_mod_msg,chained_principal.late_table_ids,
+            chained_principal.id)
+        flow_mod_rewrite_gotos(
+            late_table_flow_mod_msg,chained_principal.late_table_ids,
+            chained_principal.id)
+
+    #### PART 2:
     if early_table_flow_mod_msg is not None:
         rewrite_port_output_actions(
             chained_principal,early_table_flow_mod_msg,True)
@@ -194,7 +334,10 @@ def produce_early_late_flow_mods(chained_principal,msg):
         rewrite_port_output_actions(
             chained_principal,late_table_flow_mod_msg,False)
 
-    pluribus_logger.error('Must finish producing early and late flow tables')
+    trace(
+        chained_principal.id,EVENT_EARLY_LATE_SPLIT,
+        early_table_flow_mod_msg is not None,
+        late_table_flow_mod_msg is not None)
     return early_table_flow_mod_msg, late_table_flow_mod_msg
         
 
@@ -213,6 +356,10 @@ def rewrite_port_output_actions(
     jump to appropriate table or cause packet in msg.
     '''
     
+    physical_port_set = chained_principal.physical_port_set
+    egress_logical_port_num_to_table_id = (
+        chained_principal.egress_logical_port_num_to_table_id)
+
     goto_instr_to_add = None
     for instruction in flow_mod_msg.instructions:
         if isinstance(instruction, OFPInstructionActions):
@@ -226,7 +373,7 @@ def rewrite_port_output_actions(
                     output_port = action.port
 
                     if output_port not in physical_port_set:
-                        if output_port not in egress_logical_port_nums_to_principals:
+                        if output_port not in egress_logical_port_num_to_table_id:
                             raise InvalidOutputAction()
                         else:
                             # forwarding to a logical port
@@ -235,27 +382,25 @@ def rewrite_port_output_actions(
                                 # different table.
                                 action_indices_to_remove.append(action_index)
                                 
-                                receiver_principal = (
-                                    egress_logical_port_nums_to_principals[output_port])
-                                
                                 goto_table_id = (
-                                    receiver_principal.get_first_late_table_physical_id())
+                                    egress_logical_port_num_to_table_id[output_port])
                                 goto_instr_to_add = OFPInstructionGotoTable(goto_table_id)
                             else:
                                 # FIXME: still need to handle case
                                 # where virtual port is supposed to
-                                # forward out of virtual port
-                                pluribus_logger.error(
-                                    '\nFIXME: still must handle case of ' +
-                                    'virtual port\'s forwarding out of ' +
-                                    'virtual port...ends up requiring ' +
-                                    'going back to controller.\n')
+                                # forward out of virtual port.  Ends
+                                # up requiring going back to
+                                # controller.
+                                trace(
+                                    chained_principal.id,
+                                    EVENT_LOGICAL_OUTPUT_UNHANDLED,
+                                    output_port)
 
 
             # now remove all actions that had been forwarding to
             # logical ports.  Note: remove in backwards order to
             # maintain indices when deleting.
-            for action_index in reverse(action_indices_to_remove):
+            for action_index in reversed(action_indices_to_remove):
                 del instruction_actions.actions[action_index]
                 
     # append goto action if necessary
@@ -263,4 +408,47 @@ def rewrite_port_output_actions(
         flow_mod_msg.instructions.append(goto_instr_to_add)
 
 def duplicate_flow_mod(flow_mod_msg):
-    return pickle.loads(pickle.dumps(flow_mod_msg))
+    '''
+    @param {extended_v3_parser.OFPFlowMod} flow_mod_msg
+
+    @returns {extended_v3_parser.OFPFlowMod} --- A copy of
+    flow_mod_msg that can be translated without affecting the
+    original.
+
+    Only what translation modifies gets copied: the match, the
+    instruction objects and their action lists.  Scalar fields, the
+    actions themselves (translation removes actions from lists but
+    never modifies them) and the datapath are shared.
+    '''
+    duplicate = copy.copy(flow_mod_msg)
+    duplicate.match = duplicate_match(flow_mod_msg.match)
+    duplicate.instructions = [
+        duplicate_instruction(instruction)
+        for instruction in flow_mod_msg.instructions]
+    return duplicate
+
+def duplicate_match(match):
+    '''
+    @param {OFPMatch} match
+
+    @returns {OFPMatch}
+    '''
+    if match._composed_with_old_api():
+        # built field by field rather than parsed: rare enough not to
+        # bother sharing anything.
+        return copy.deepcopy(match)
+    duplicate = copy.copy(match)
+    # elements are (field name, value) tuples of immutable values
+    duplicate._fields2 = list(match._fields2)
+    return duplicate
+
+def duplicate_instruction(instruction):
+    '''
+    @param {OFPInstruction} instruction
+
+    @returns {OFPInstruction}
+    '''
+    duplicate = copy.copy(instruction)
+    if isinstance(instruction,OFPInstructionActions):
+        duplicate.actions = list(instruction.actions)
+    return duplicate
@@ -0,0 +1,364 @@
+'''
+Compact on-disk checkpoints of a running Pluribus's switch state, so
+that a restarted Pluribus can put principals' rules back on the
+switch without waiting for every principal's controller to re-push
+them (@see PluribusSwitch._restore_checkpoint).
+
+A checkpoint file is FILE_MAGIC followed by snapshots, each appended
+with a single write:
+
+    snapshot header (SNAPSHOT_HEADER_PACK_STR): magic, body length,
+        crc32 of body, time taken
+    body: records, each a RECORD_HEADER_PACK_STR header (record type,
+        principal id, payload length) followed by its payload
+
+A snapshot holds one RECORD_SWITCH (the switch's datapath id, number
+of tables and ports), one RECORD_ASSIGNMENT per principal (the tables
+and ports it was assigned) and one RECORD_RULE per rule in
+principals' shadow flow tables, with what the rule was translated
+to.  Everything is big-endian and fixed-layout, so readers mmap the
+file and unpack records in place, only copying out the rules they
+restore.
+
+Only the last snapshot whose length and crc32 check out gets read:
+one torn by a crash while being appended leaves the ones before it
+intact.  Once a file holds max_snapshots snapshots (and on the first
+snapshot a process writes, in case the file ends with a torn one),
+the next snapshot goes into a new file that replaces it.
+'''
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+
+FILE_MAGIC = 'PLBCKPT\x01'
+
+SNAPSHOT_MAGIC = 'SNAP'
+# magic, body length, crc32 of body, time taken
+SNAPSHOT_HEADER_PACK_STR = '!4sIId'
+SNAPSHOT_HEADER_SIZE = struct.calcsize(SNAPSHOT_HEADER_PACK_STR)
+
+# record type, principal id, payload length
+RECORD_HEADER_PACK_STR = '!BxHI'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_PACK_STR)
+
+#### record types
+# payload: SWITCH_PACK_STR, then a PORT_PACK_STR per port.
+RECORD_SWITCH = 1
+# payload: number of lists, then each list of uint32s, prefixed by
+# its length (@see Principal.checkpoint_assignment).
+RECORD_ASSIGNMENT = 2
+# payload: RULE_PACK_STR, the rule's match and instructions as the
+# principal sent them, then each flow mod it was translated to,
+# prefixed by its length.
+RECORD_RULE = 3
+
+# principal id of records that are not tied to any principal
+NO_PRINCIPAL_ID = 0xffff
+
+# datapath id, number of tables, number of ports
+SWITCH_PACK_STR = '!QII'
+# port number, port name
+PORT_PACK_STR = '!I%is' % ofproto.OFP_MAX_PORT_NAME_LEN
+# install time, packet count, byte count, cookie, table id, number of
+# translated flow mods, priority, idle timeout, hard timeout, flags,
+# match length, instructions length
+RULE_PACK_STR = '!dQQQBBHHHHHH'
+
+_UINT16_PACK_STR = '!H'
+_UINT32_PACK_STR = '!I'
+
+
+class CheckpointRule(object):
+    '''
+    A rule read back from a checkpoint.
+    '''
+    def __init__(self,install_time,packet_count,byte_count,cookie,
+                 table_id,priority,idle_timeout,hard_timeout,flags,
+                 match_buf,instructions_buf,translated_bufs):
+        '''
+        @param {list} translated_bufs --- Each element is a bytearray
+        holding a flow mod the rule was translated to.
+        '''
+        self.install_time = install_time
+        self.packet_count = packet_count
+        self.byte_count = byte_count
+        self.cookie = cookie
+        self.table_id = table_id
+        self.priority = priority
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.flags = flags
+        self.match_buf = match_buf
+        self.instructions_buf = instructions_buf
+        self.translated_bufs = translated_bufs
+
+
+class SnapshotBuilder(object):
+    '''
+    Serializes one snapshot's records.
+    '''
+    def __init__(self):
+        self.body = bytearray()
+        # of body, kept up as records get added
+        self.crc = 0
+        self.num_rules = 0
+
+    def add_switch(self,datapath_id,num_tables,ports):
+        '''
+        @param {list} ports --- Each element is a (port number, port
+        name) tuple.
+        '''
+        payload = bytearray(
+            struct.pack(SWITCH_PACK_STR,datapath_id,num_tables,len(ports)))
+        for port_number, port_name in ports:
+            payload += struct.pack(PORT_PACK_STR,port_number,port_name)
+        self._add_record(RECORD_SWITCH,NO_PRINCIPAL_ID,payload)
+
+    def add_assignment(self,principal_id,assignment):
+        '''
+        @param {list} assignment --- Each element is a list of ints.
+        '''
+        payload = bytearray(struct.pack(_UINT16_PACK_STR,len(assignment)))
+        for int_list in assignment:
+            payload += struct.pack(
+                '!H%iI' % len(int_list),len(int_list),*int_list)
+        self._add_record(RECORD_ASSIGNMENT,principal_id,payload)
+
+    def add_rule(self,principal_id,entry,translated_bufs):
+        '''
+        @param {ShadowFlowEntry} entry
+
+        @param {list} translated_bufs --- What entry gets translated
+        to.
+        '''
+        payload = bytearray(
+            struct.pack(
+                RULE_PACK_STR,entry.install_time,entry.packet_count,
+                entry.byte_count,entry.cookie,entry.table_id,
+                len(translated_bufs),entry.priority,entry.idle_timeout,
+                entry.hard_timeout,entry.flags,len(entry.match_buf),
+                len(entry.instructions_buf)))
+        payload += entry.match_buf
+        payload += entry.instructions_buf
+        for translated_buf in translated_bufs:
+            payload += struct.pack(_UINT16_PACK_STR,len(translated_buf))
+            payload += translated_buf
+        self._add_record(RECORD_RULE,principal_id,payload)
+        self.num_rules += 1
+
+    def _add_record(self,record_type,principal_id,payload):
+        record_header = struct.pack(
+            RECORD_HEADER_PACK_STR,record_type,principal_id,len(payload))
+        self.crc = zlib.crc32(
+            buffer(payload),zlib.crc32(record_header,self.crc))
+        self.body += record_header
+        self.body += payload
+
+
+class CheckpointWriter(object):
+
+    def __init__(self,filename,max_snapshots):
+        '''
+        @param {str} filename --- Checkpoint file.  Replaced by the
+        first snapshot written.
+
+        @param {int} max_snapshots --- Snapshots to append to a file
+        before replacing it.
+        '''
+        self.filename = filename
+        self.max_snapshots = max_snapshots
+        # snapshots in filename.  None until this writer has written
+        # one.
+        self.num_snapshots = None
+
+    def write(self,builder,snapshot_time=None):
+        '''
+        @param {SnapshotBuilder} builder
+
+        Only does file I/O, so it can be run from an OS thread.  Not
+        safe to call again before it returns.
+
+        @returns {int} --- Bytes written.
+        '''
+        if snapshot_time is None:
+            snapshot_time = time.time()
+        body = builder.body
+        snapshot_header = struct.pack(
+            SNAPSHOT_HEADER_PACK_STR,SNAPSHOT_MAGIC,len(body),
+            builder.crc & 0xffffffff,snapshot_time)
+        snapshot_len = len(snapshot_header) + len(body)
+
+        if ((self.num_snapshots is None) or
+            (self.num_snapshots >= self.max_snapshots)):
+            # written whole, then renamed over the old file, so that
+            # there is always a readable checkpoint.
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename,'wb') as fd:
+                fd.write(FILE_MAGIC + snapshot_header)
+                fd.write(body)
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.rename(tmp_filename,self.filename)
+            self.num_snapshots = 1
+            return len(FILE_MAGIC) + snapshot_len
+
+        # header and body in one write, so a crash cannot leave a
+        # header whose body is another snapshot's.
+        with open(self.filename,'ab') as fd:
+            fd.write(snapshot_header + str(body))
+            fd.flush()
+            os.fsync(fd.fileno())
+        self.num_snapshots += 1
+        return snapshot_len
+
+
+class Checkpoint(object):
+    '''
+    The last complete snapshot of a checkpoint file, read in place
+    from an mmap of the file.
+    '''
+    def __init__(self,buf,body_offset,body_len,snapshot_time,
+                 num_snapshots):
+        '''
+        @param {mmap} buf --- The whole checkpoint file.
+        '''
+        self.buf = buf
+        self.body_offset = body_offset
+        self.body_len = body_len
+        self.snapshot_time = snapshot_time
+        self.num_snapshots = num_snapshots
+
+        self.datapath_id = None
+        self.num_tables = None
+        # keys are port numbers; values are port names
+        self.ports = {}
+        # keys are principal ids; values are lists of lists of ints
+        self.assignments = {}
+        for record_type, principal_id, offset, payload_len in (
+            self._iter_records()):
+            if record_type == RECORD_SWITCH:
+                self._read_switch(offset)
+            elif record_type == RECORD_ASSIGNMENT:
+                self.assignments[principal_id] = self._read_assignment(
+                    offset)
+
+    def close(self):
+        self.buf.close()
+
+    def iter_rules(self):
+        '''
+        @returns {generator} --- Of (principal id, CheckpointRule)
+        tuples, in the order they were written.
+        '''
+        buf = self.buf
+        rule_size = struct.calcsize(RULE_PACK_STR)
+        for record_type, principal_id, offset, payload_len in (
+            self._iter_records()):
+            if record_type != RECORD_RULE:
+                continue
+            (install_time, packet_count, byte_count, cookie, table_id,
+             num_translated, priority, idle_timeout, hard_timeout, flags,
+             match_len, instructions_len) = struct.unpack_from(
+                RULE_PACK_STR,buf,offset)
+            offset += rule_size
+            match_buf = buf[offset:offset + match_len]
+            offset += match_len
+            instructions_buf = buf[offset:offset + instructions_len]
+            offset += instructions_len
+            translated_bufs = []
+            for i in range(0,num_translated):
+                (translated_len,) = struct.unpack_from(
+                    _UINT16_PACK_STR,buf,offset)
+                offset += 2
+                translated_bufs.append(
+                    bytearray(buf[offset:offset + translated_len]))
+                offset += translated_len
+            yield principal_id, CheckpointRule(
+                install_time,packet_count,byte_count,cookie,table_id,
+                priority,idle_timeout,hard_timeout,flags,match_buf,
+                instructions_buf,translated_bufs)
+
+    def _iter_records(self):
+        '''
+        @returns {generator} --- Of (record type, principal id,
+        payload offset, payload length) tuples.
+        '''
+        offset = self.body_offset
+        body_end = self.body_offset + self.body_len
+        while offset + RECORD_HEADER_SIZE <= body_end:
+            (record_type, principal_id, payload_len) = struct.unpack_from(
+                RECORD_HEADER_PACK_STR,self.buf,offset)
+            offset += RECORD_HEADER_SIZE
+            yield record_type, principal_id, offset, payload_len
+            offset += payload_len
+
+    def _read_switch(self,offset):
+        (self.datapath_id, self.num_tables, num_ports) = struct.unpack_from(
+            SWITCH_PACK_STR,self.buf,offset)
+        offset += struct.calcsize(SWITCH_PACK_STR)
+        port_size = struct.calcsize(PORT_PACK_STR)
+        for i in range(0,num_ports):
+            (port_number, port_name) = struct.unpack_from(
+                PORT_PACK_STR,self.buf,offset)
+            self.ports[port_number] = port_name.rstrip('\x00')
+            offset += port_size
+
+    def _read_assignment(self,offset):
+        (num_lists,) = struct.unpack_from(_UINT16_PACK_STR,self.buf,offset)
+        offset += 2
+        assignment = []
+        for i in range(0,num_lists):
+            (list_len,) = struct.unpack_from(
+                _UINT16_PACK_STR,self.buf,offset)
+            offset += 2
+            assignment.append(
+                list(struct.unpack_from('!%iI' % list_len,self.buf,offset)))
+            offset += 4*list_len
+        return assignment
+
+
+def load_checkpoint(filename):
+    '''
+    @returns {Checkpoint or None} --- The last complete snapshot in
+    filename.  None if filename does not exist or holds none.
+    '''
+    try:
+        fd = open(filename,'rb')
+    except IOError:
+        return None
+    with fd:
+        file_len = os.fstat(fd.fileno()).st_size
+        if file_len < len(FILE_MAGIC) + SNAPSHOT_HEADER_SIZE:
+            return None
+        buf = mmap.mmap(fd.fileno(),0,access=mmap.ACCESS_READ)
+    if buf[:len(FILE_MAGIC)] != FILE_MAGIC:
+        buf.close()
+        return None
+
+    last = None
+    num_snapshots = 0
+    offset = len(FILE_MAGIC)
+    while offset + SNAPSHOT_HEADER_SIZE <= file_len:
+        (magic, body_len, crc, snapshot_time) = struct.unpack_from(
+            SNAPSHOT_HEADER_PACK_STR,buf,offset)
+        body_offset = offset + SNAPSHOT_HEADER_SIZE
+        if ((magic != SNAPSHOT_MAGIC) or
+            (body_offset + body_len > file_len) or
+            ((zlib.crc32(buf[body_offset:body_offset + body_len]) &
+              0xffffffff) != crc)):
+            # torn by a crash while being appended
+            break
+        num_snapshots += 1
+        last = (body_offset,body_len,snapshot_time)
+        offset = body_offset + body_len
+
+    if last is None:
+        buf.close()
+        return None
+    (body_offset, body_len, snapshot_time) = last
+    return Checkpoint(buf,body_offset,body_len,snapshot_time,num_snapshots)
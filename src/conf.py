@@ -22,17 +22,138 @@ pluribus_logger.addHandler(handler)
 pluribus_logger.propagate = False
 
 
-# wait this many seconds after receiving a switch before sending a
-# request about port statistics.  Allows openvswitch time to add
-# logical ports.
+# wait at most this many seconds after receiving a switch for all of
+# the ports principals need (eg., logical ports that openvswitch adds
+# after connecting) to show up.  Pluribus initializes as soon as they
+# do; after this long, it initializes with whatever ports there are.
 PORT_STATS_DELAY_TIME = 10
 CONF_PORT_STATS_DELAY_TIME = 'PORT_STATS_DELAY_TIME'
 
+# while waiting for ports, ask the switch for its ports after this
+# many seconds, then back off, doubling the wait up to
+# PORT_DESC_MAX_POLL_PERIOD.  Port status messages from the switch
+# get acted on as they arrive.
+PORT_DESC_POLL_PERIOD = .05
+CONF_PORT_DESC_POLL_PERIOD = 'PORT_DESC_POLL_PERIOD'
+PORT_DESC_MAX_POLL_PERIOD = 1
+CONF_PORT_DESC_MAX_POLL_PERIOD = 'PORT_DESC_MAX_POLL_PERIOD'
+
 # None means that we should just use default principals
 JSON_PRINCIPALS_TO_LOAD_FILENAME = None
 CONF_JSON_PRINCIPALS_TO_LOAD_FILENAME = 'JSON_PRINCIPALS_TO_LOAD_FILENAME'
 
 
+# Number of bytes each principal connection reads into at a time.
+# Messages are parsed in place out of this buffer, so larger buffers
+# mean fewer recv calls under bursts of flow mods.
+PRINCIPAL_RECV_BUFFER_SIZE = 256*1024
+CONF_PRINCIPAL_RECV_BUFFER_SIZE = 'PRINCIPAL_RECV_BUFFER_SIZE'
+
+# Messages from principals to the switch get batched and written
+# together.  A batch waits at most SWITCH_FLUSH_WINDOW seconds for
+# the switch connection to become writable, and is written right
+# away once it holds SWITCH_MAX_BATCH_BYTES.
+SWITCH_FLUSH_WINDOW = .001
+CONF_SWITCH_FLUSH_WINDOW = 'SWITCH_FLUSH_WINDOW'
+SWITCH_MAX_BATCH_BYTES = 64*1024
+CONF_SWITCH_MAX_BATCH_BYTES = 'SWITCH_MAX_BATCH_BYTES'
+
+# Whether to try to apply principals' bundles as bundles on the
+# switch.  If False, or if the switch rejects bundle messages, bundles
+# get sent as a batch of messages followed by a barrier instead.
+SWITCH_BUNDLES = True
+CONF_SWITCH_BUNDLES = 'SWITCH_BUNDLES'
+
+# Every this many seconds, poll the switch for the counters of all its
+# rules.  Principals' flow stats requests are answered from shadow
+# flow tables using the counters of the latest poll.  0 disables
+# polling.
+SHADOW_STATS_POLL_PERIOD = 10
+CONF_SHADOW_STATS_POLL_PERIOD = 'SHADOW_STATS_POLL_PERIOD'
+
+# Maximum number of translated flow mods to remember, so that repeats
+# of a flow mod skip translation.  0 disables the cache.
+TRANSLATION_CACHE_SIZE = 8192
+CONF_TRANSLATION_CACHE_SIZE = 'TRANSLATION_CACHE_SIZE'
+
+# Number of messages that can be waiting to be written to each
+# principal.  Packet ins that arrive while a principal's queue is full
+# get dropped rather than holding up packet ins for other principals.
+PRINCIPAL_SEND_QUEUE_SIZE = 1024
+CONF_PRINCIPAL_SEND_QUEUE_SIZE = 'PRINCIPAL_SEND_QUEUE_SIZE'
+
+# Seconds to wait for a principal's controller to accept a connection,
+# and then to finish the OpenFlow handshake (send its features
+# request), before giving up on the attempt.
+PRINCIPAL_CONNECT_TIMEOUT = 5
+CONF_PRINCIPAL_CONNECT_TIMEOUT = 'PRINCIPAL_CONNECT_TIMEOUT'
+PRINCIPAL_HANDSHAKE_TIMEOUT = 5
+CONF_PRINCIPAL_HANDSHAKE_TIMEOUT = 'PRINCIPAL_HANDSHAKE_TIMEOUT'
+
+# After a failed attempt or a disconnect, wait this many seconds
+# before connecting to the principal again, doubling the wait (up to
+# PRINCIPAL_MAX_RECONNECT_BACKOFF) after each failed attempt.  Waits
+# are jittered so that principals do not retry in lockstep.
+PRINCIPAL_RECONNECT_BACKOFF = .1
+CONF_PRINCIPAL_RECONNECT_BACKOFF = 'PRINCIPAL_RECONNECT_BACKOFF'
+PRINCIPAL_MAX_RECONNECT_BACKOFF = 10
+CONF_PRINCIPAL_MAX_RECONNECT_BACKOFF = 'PRINCIPAL_MAX_RECONNECT_BACKOFF'
+
+# Seconds before a principal's virtual buffer id expires, if the
+# principal never uses it.  Switches discard buffered packets after a
+# few seconds anyway.
+BUFFER_ID_TIMEOUT = 5
+CONF_BUFFER_ID_TIMEOUT = 'BUFFER_ID_TIMEOUT'
+
+# Port on 127.0.0.1 to serve per-principal metrics on, over HTTP, in
+# the Prometheus text exposition format.  None disables serving them
+# (they are still collected).
+METRICS_PORT = None
+CONF_METRICS_PORT = 'METRICS_PORT'
+
+# Number of most recent trace records to keep in memory (@see
+# trace_log).  Each takes a few tens of bytes.  0 disables tracing.
+TRACE_LOG_SIZE = 65536
+CONF_TRACE_LOG_SIZE = 'TRACE_LOG_SIZE'
+
+# Name of the signal (eg., 'SIGUSR2') that starts a profile of the
+# running switch, or stops the running one early (@see profiling).
+# None disables profiling by signal.
+PROFILE_SIGNAL = 'SIGUSR2'
+CONF_PROFILE_SIGNAL = 'PROFILE_SIGNAL'
+
+# If True, starts a profile as soon as Pluribus starts.
+PROFILE_ON_START = False
+CONF_PROFILE_ON_START = 'PROFILE_ON_START'
+
+# Seconds a profile runs for.
+PROFILE_WINDOW = 30
+CONF_PROFILE_WINDOW = 'PROFILE_WINDOW'
+
+# Seconds of CPU time between profile samples.
+PROFILE_INTERVAL = .005
+CONF_PROFILE_INTERVAL = 'PROFILE_INTERVAL'
+
+# Directory profiles get written to, as collapsed stacks.
+PROFILE_OUTPUT_DIR = '.'
+CONF_PROFILE_OUTPUT_DIR = 'PROFILE_OUTPUT_DIR'
+
+# File to checkpoint principals' assignments and translated rules
+# to, and to restore them from on starting (@see checkpoint).  None
+# disables checkpointing.
+CHECKPOINT_FILENAME = None
+CONF_CHECKPOINT_FILENAME = 'CHECKPOINT_FILENAME'
+
+# Seconds between checkpoints.  A checkpoint only gets written if
+# principals' rules changed since the last one.
+CHECKPOINT_PERIOD = 10
+CONF_CHECKPOINT_PERIOD = 'CHECKPOINT_PERIOD'
+
+# Checkpoints get appended to the checkpoint file until it holds this
+# many.  The next one replaces the file.
+CHECKPOINT_MAX_SNAPSHOTS = 16
+CONF_CHECKPOINT_MAX_SNAPSHOTS = 'CHECKPOINT_MAX_SNAPSHOTS'
+
 LOGGING_LEVEL = 'warn'
 CONF_LOGGING_LEVEL = 'LOGGING_LEVEL'
 
@@ -48,14 +169,125 @@ def load_conf():
 
     if CONF_PORT_STATS_DELAY_TIME in conf_param_dict:
         global PORT_STATS_DELAY_TIME
-        PORT_STATS_DELAY_TIME = int(
+        PORT_STATS_DELAY_TIME = float(
             conf_param_dict[CONF_PORT_STATS_DELAY_TIME])
 
+    if CONF_PORT_DESC_POLL_PERIOD in conf_param_dict:
+        global PORT_DESC_POLL_PERIOD
+        PORT_DESC_POLL_PERIOD = float(
+            conf_param_dict[CONF_PORT_DESC_POLL_PERIOD])
+
+    if CONF_PORT_DESC_MAX_POLL_PERIOD in conf_param_dict:
+        global PORT_DESC_MAX_POLL_PERIOD
+        PORT_DESC_MAX_POLL_PERIOD = float(
+            conf_param_dict[CONF_PORT_DESC_MAX_POLL_PERIOD])
+
     if CONF_JSON_PRINCIPALS_TO_LOAD_FILENAME in conf_param_dict:
         global JSON_PRINCIPALS_TO_LOAD_FILENAME
         JSON_PRINCIPALS_TO_LOAD_FILENAME = (
             conf_param_dict[CONF_JSON_PRINCIPALS_TO_LOAD_FILENAME])
 
+    if CONF_PRINCIPAL_RECV_BUFFER_SIZE in conf_param_dict:
+        global PRINCIPAL_RECV_BUFFER_SIZE
+        PRINCIPAL_RECV_BUFFER_SIZE = int(
+            conf_param_dict[CONF_PRINCIPAL_RECV_BUFFER_SIZE])
+
+    if CONF_SWITCH_FLUSH_WINDOW in conf_param_dict:
+        global SWITCH_FLUSH_WINDOW
+        SWITCH_FLUSH_WINDOW = float(
+            conf_param_dict[CONF_SWITCH_FLUSH_WINDOW])
+
+    if CONF_SWITCH_MAX_BATCH_BYTES in conf_param_dict:
+        global SWITCH_MAX_BATCH_BYTES
+        SWITCH_MAX_BATCH_BYTES = int(
+            conf_param_dict[CONF_SWITCH_MAX_BATCH_BYTES])
+
+    if CONF_SWITCH_BUNDLES in conf_param_dict:
+        global SWITCH_BUNDLES
+        SWITCH_BUNDLES = bool(conf_param_dict[CONF_SWITCH_BUNDLES])
+
+    if CONF_SHADOW_STATS_POLL_PERIOD in conf_param_dict:
+        global SHADOW_STATS_POLL_PERIOD
+        SHADOW_STATS_POLL_PERIOD = float(
+            conf_param_dict[CONF_SHADOW_STATS_POLL_PERIOD])
+
+    if CONF_TRANSLATION_CACHE_SIZE in conf_param_dict:
+        global TRANSLATION_CACHE_SIZE
+        TRANSLATION_CACHE_SIZE = int(
+            conf_param_dict[CONF_TRANSLATION_CACHE_SIZE])
+
+    if CONF_PRINCIPAL_SEND_QUEUE_SIZE in conf_param_dict:
+        global PRINCIPAL_SEND_QUEUE_SIZE
+        PRINCIPAL_SEND_QUEUE_SIZE = int(
+            conf_param_dict[CONF_PRINCIPAL_SEND_QUEUE_SIZE])
+
+    if CONF_PRINCIPAL_CONNECT_TIMEOUT in conf_param_dict:
+        global PRINCIPAL_CONNECT_TIMEOUT
+        PRINCIPAL_CONNECT_TIMEOUT = float(
+            conf_param_dict[CONF_PRINCIPAL_CONNECT_TIMEOUT])
+
+    if CONF_PRINCIPAL_HANDSHAKE_TIMEOUT in conf_param_dict:
+        global PRINCIPAL_HANDSHAKE_TIMEOUT
+        PRINCIPAL_HANDSHAKE_TIMEOUT = float(
+            conf_param_dict[CONF_PRINCIPAL_HANDSHAKE_TIMEOUT])
+
+    if CONF_PRINCIPAL_RECONNECT_BACKOFF in conf_param_dict:
+        global PRINCIPAL_RECONNECT_BACKOFF
+        PRINCIPAL_RECONNECT_BACKOFF = float(
+            conf_param_dict[CONF_PRINCIPAL_RECONNECT_BACKOFF])
+
+    if CONF_PRINCIPAL_MAX_RECONNECT_BACKOFF in conf_param_dict:
+        global PRINCIPAL_MAX_RECONNECT_BACKOFF
+        PRINCIPAL_MAX_RECONNECT_BACKOFF = float(
+            conf_param_dict[CONF_PRINCIPAL_MAX_RECONNECT_BACKOFF])
+
+    if CONF_BUFFER_ID_TIMEOUT in conf_param_dict:
+        global BUFFER_ID_TIMEOUT
+        BUFFER_ID_TIMEOUT = float(conf_param_dict[CONF_BUFFER_ID_TIMEOUT])
+
+    if CONF_METRICS_PORT in conf_param_dict:
+        global METRICS_PORT
+        METRICS_PORT = conf_param_dict[CONF_METRICS_PORT]
+        if METRICS_PORT is not None:
+            METRICS_PORT = int(METRICS_PORT)
+
+    if CONF_TRACE_LOG_SIZE in conf_param_dict:
+        global TRACE_LOG_SIZE
+        TRACE_LOG_SIZE = int(conf_param_dict[CONF_TRACE_LOG_SIZE])
+
+    if CONF_PROFILE_SIGNAL in conf_param_dict:
+        global PROFILE_SIGNAL
+        PROFILE_SIGNAL = conf_param_dict[CONF_PROFILE_SIGNAL]
+
+    if CONF_PROFILE_ON_START in conf_param_dict:
+        global PROFILE_ON_START
+        PROFILE_ON_START = bool(conf_param_dict[CONF_PROFILE_ON_START])
+
+    if CONF_PROFILE_WINDOW in conf_param_dict:
+        global PROFILE_WINDOW
+        PROFILE_WINDOW = float(conf_param_dict[CONF_PROFILE_WINDOW])
+
+    if CONF_PROFILE_INTERVAL in conf_param_dict:
+        global PROFILE_INTERVAL
+        PROFILE_INTERVAL = float(conf_param_dict[CONF_PROFILE_INTERVAL])
+
+    if CONF_PROFILE_OUTPUT_DIR in conf_param_dict:
+        global PROFILE_OUTPUT_DIR
+        PROFILE_OUTPUT_DIR = conf_param_dict[CONF_PROFILE_OUTPUT_DIR]
+
+    if CONF_CHECKPOINT_FILENAME in conf_param_dict:
+        global CHECKPOINT_FILENAME
+        CHECKPOINT_FILENAME = conf_param_dict[CONF_CHECKPOINT_FILENAME]
+
+    if CONF_CHECKPOINT_PERIOD in conf_param_dict:
+        global CHECKPOINT_PERIOD
+        CHECKPOINT_PERIOD = float(conf_param_dict[CONF_CHECKPOINT_PERIOD])
+
+    if CONF_CHECKPOINT_MAX_SNAPSHOTS in conf_param_dict:
+        global CHECKPOINT_MAX_SNAPSHOTS
+        CHECKPOINT_MAX_SNAPSHOTS = int(
+            conf_param_dict[CONF_CHECKPOINT_MAX_SNAPSHOTS])
+
     global LOGGING_LEVEL        
     if CONF_LOGGING_LEVEL in conf_param_dict:
         LOGGING_LEVEL = conf_param_dict[CONF_LOGGING_LEVEL]
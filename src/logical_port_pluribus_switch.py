@@ -4,8 +4,8 @@ import itertools
 from ryu.ofproto.ofproto_v1_3_parser import OFPInstructionGotoTable
 
 from logical_port_principal import LogicalPortPrincipal
-from port_util import set_logical_physical
 from port_util import num_principals_from_num_logical_port_pairs
+from port_util import num_logical_port_pairs_from_num_principals
 from pluribus_switch import PluribusSwitch, SwitchState
 from conf import pluribus_logger,HEAD_TABLE_ID
 
@@ -18,18 +18,31 @@ class LogicalPortPluribusSwitch(PluribusSwitch):
         self.logical_port_pair_halves = None
         self.num_principals_can_support = None
     
-    def _init_recv_port_stats_response_config(self,ev):
+    def _switch_ports_ready(self):
+        '''
+        @see _switch_ports_ready of PluribusSwitch
+
+        Also needs a logical port pair for every pair of principals.
+        '''
+        if not super(LogicalPortPluribusSwitch,self)._switch_ports_ready():
+            return False
+        return (
+            len(self.port_index.logical_port_pair_halves()) >=
+            num_logical_port_pairs_from_num_principals(len(self.principals)))
+
+    def _init_switch_ports(self):
         '''
         As part of initialization, determine which ports are logical
         and which ports are physical.
         '''
-        pluribus_logger.info('Setting port stats response')
-        
-        # call parent class to create port name number list
-        self._populate_ports_from_port_stats_response(ev)
-        
+        unmatched_loopback_ports = self.port_index.unmatched_loopback_ports()
+        if unmatched_loopback_ports:
+            # eg., switch still adding a spare pair.  Goes unused.
+            pluribus_logger.warning(
+                'Ignoring %i unmatched logical ports' %
+                len(unmatched_loopback_ports))
         self.logical_port_pair_halves = (
-            set_logical_physical(self.port_name_number_list))
+            self.port_index.logical_port_pair_halves())
 
         num_logical_port_pairs = len(self.logical_port_pair_halves)
         self.num_principals_can_support = (
@@ -102,11 +115,7 @@ class LogicalPortPluribusSwitch(PluribusSwitch):
             principal.set_physical_table_list(
                 range(beginning_table_id,ending_table_id))
             
-            # FIXME: set real number of buffers on principal
-            pluribus_logger.error(
-                'FIXME: Assigning hardcoded number of ' +
-                'buffers between switches')
-            principal.set_num_buffers(5)
+            principal.set_num_buffers(self.num_buffers_per_principal())
 
             
         #### PART 2: Assign logical ports
@@ -125,6 +134,10 @@ class LogicalPortPluribusSwitch(PluribusSwitch):
                 principal_b.add_logical_mapping(logical_port_b,principal_a)
 
 
+        # puts back principals' rules from before restarting, if
+        # they were assigned the same tables and ports then.
+        self._restore_checkpoint()
+
         #### PART 3: Set head table for each principal
         for principal in self.principals:
             self._send_head_table_flow_mod(principal)
@@ -161,6 +174,46 @@ class LogicalPortPluribusSwitch(PluribusSwitch):
         # barrier.
 
             
+    def _assigned_port_numbers(self):
+        '''
+        @see _assigned_port_numbers of PluribusSwitch
+
+        Also the logical ports connecting principals.
+        '''
+        port_numbers = super(
+            LogicalPortPluribusSwitch,self)._assigned_port_numbers()
+        for principal in self.principals:
+            port_numbers.update(principal.get_ingress_logical_port_num_list())
+            port_numbers.update(
+                principal.egress_logical_port_nums_to_principals.keys())
+        return port_numbers
+
+    def _ports_changed(self):
+        '''
+        @see _ports_changed of PluribusSwitch
+
+        Only keeps track of the logical port pairs.  Pairs added at
+        runtime go unused: principals get their tables and logical
+        ports when Pluribus initializes, so another principal means
+        restarting Pluribus.  Losing a pair that is in use cuts off
+        the principals it connects until it comes back.
+        '''
+        self.logical_port_pair_halves = (
+            self.port_index.logical_port_pair_halves())
+        self.num_principals_can_support = (
+            num_principals_from_num_logical_port_pairs(
+                len(self.logical_port_pair_halves)))
+        for principal in self.principals:
+            for port_num, partnered_principal in sorted(
+                principal.egress_logical_port_nums_to_principals.items()):
+                if self.port_index.get(port_num) is None:
+                    pluribus_logger.error(
+                        ('Logical port %i missing: principal %i ' %
+                         (port_num,principal.id)) +
+                        ('cannot reach principal %i' %
+                         partnered_principal.id))
+        self._debug_print_ports()
+
     #### UTILITY CODE
     
     def _debug_print_ports(self):
@@ -169,7 +222,7 @@ class LogicalPortPluribusSwitch(PluribusSwitch):
         '''
         port_log_msg = (
             ('Total num ports: %i.  ' %
-             len(self.port_name_number_list)) +
+             len(self.port_index)) +
             ('Num logical port pairs: %i.  ' %
              len(self.logical_port_pair_halves)) +
             ('Num principals can support: %i.' %
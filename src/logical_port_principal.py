@@ -1,8 +1,12 @@
 from principals_util import Principal
 from conf import pluribus_logger
+from trace_log import trace, NO_PRINCIPAL_ID
+from trace_log import EVENT_FLOW_MOD_TRANSLATED
+from trace_log import EVENT_TABLE_ID_REWRITTEN, EVENT_GOTO_REWRITTEN
 
 from ryu.ofproto import ofproto_v1_3 as ofproto
 from ryu.ofproto.ofproto_v1_3_parser import OFPInstructionActions
+from ryu.ofproto.ofproto_v1_3_parser import OFPInstructionGotoTable
 from ryu.ofproto.ofproto_v1_3_parser import OFPActionOutput
 
 from extended_v3_parser import OFPSwitchFeatures as PluribusSwitchFeatures
@@ -11,6 +15,11 @@ from translation_exceptions import InvalidTableWriteException
 from translation_exceptions import InvalidGotoTableException
 from translation_exceptions import InvalidOutputAction
 
+from wire_flow_mod import flow_mod_table_id
+from translation_plan import TranslationPlan
+from packet_in_demux import PacketInRoute
+from wire_flow_mod import fan_out_flow_mod_wire
+
 
 class LogicalPortPrincipal(Principal):
 
@@ -35,6 +44,7 @@ class LogicalPortPrincipal(Principal):
         # switch.
         self.ingress_logical_port_nums_to_principals = {}
         self.egress_logical_port_nums_to_principals = {}
+        self.compile_translation_plan()
         
         
     def add_logical_mapping(self,logical_port,partnered_principal):
@@ -51,7 +61,52 @@ class LogicalPortPrincipal(Principal):
             partnered_principal)
         self.egress_logical_port_nums_to_principals[partner_port.port_number] = (
             partnered_principal)
+        self.invalidate_translations()
         
+    def compile_translation_plan(self):
+        '''
+        @see compile_translation_plan of Principal
+        '''
+        self.translation_plan = TranslationPlan(
+            self.physical_table_list,self.physical_port_set,
+            self.egress_logical_port_nums_to_principals.keys())
+        # logical ports are real switch ports: packets can be sent
+        # out of them directly.
+        self.packet_out_ports = frozenset(
+            list(self.physical_port_set) +
+            self.egress_logical_port_nums_to_principals.keys())
+
+    def packet_in_routes(self):
+        '''
+        @see packet_in_routes of Principal
+
+        Logical ports are real switch ports, which principals already
+        match on by their switch port numbers: in_ports pass through
+        unchanged.
+        '''
+        if self.physical_table_list is None:
+            return []
+        return [
+            (physical_table_id,PacketInRoute(self,virtual_table_id))
+            for virtual_table_id, physical_table_id in enumerate(
+                self.physical_table_list)]
+
+    def checkpoint_assignment(self):
+        '''
+        @see checkpoint_assignment of Principal
+        '''
+        assignment = super(LogicalPortPrincipal,self).checkpoint_assignment()
+        assignment.append(self.physical_table_list)
+        for logical_port_nums_to_principals in (
+            self.ingress_logical_port_nums_to_principals,
+            self.egress_logical_port_nums_to_principals):
+            port_num_principal_ids = []
+            for port_num, principal in sorted(
+                logical_port_nums_to_principals.items()):
+                port_num_principal_ids.extend([port_num,principal.id])
+            assignment.append(port_num_principal_ids)
+        return assignment
+
     def get_ingress_logical_port_num_list(self):
         return list(
             self.ingress_logical_port_nums_to_principals.keys())
@@ -62,6 +117,7 @@ class LogicalPortPrincipal(Principal):
         integer physical table id.
         '''
         self.physical_table_list = physical_table_list
+        self.invalidate_translations()
         
     def get_first_physical_table(self):
         '''
@@ -95,64 +151,84 @@ class LogicalPortPrincipal(Principal):
         self.connection.datapath.send_msg(
             switch_features_msg)
 
-    def handle_flow_mod(self,msg):
+    def translate_flow_mod(self,msg):
         '''
         @param {extended_v3_parser.OFPFlowMod} msg
 
         Rewrites the flow mod to only apply to target tables.
         Rewrites rules not to goto incorrect tables.
         Rewrites rules to use different ports.
+
+        @returns {list} --- @see translate_flow_mod of Principal
         '''
         # FIXME: still need to catch exceptions and write back errors.
-        flow_mod_rewrite_table_ids(msg,self.physical_table_list)
-        flow_mod_rewrite_gotos(msg,self.physical_table_list)
+        flow_mod_rewrite_table_ids(msg,self.physical_table_list,self.id)
+        flow_mod_rewrite_gotos(msg,self.physical_table_list,self.id)
         flow_mod_rewrite_action_ports(
             msg,self.physical_port_set,
             self.egress_logical_port_nums_to_principals)
 
-        pluribus_logger.info('Forwarding translated flow mod to switch')
-        self.pluribus_switch.send_msg(msg)
+        trace(self.id,EVENT_FLOW_MOD_TRANSLATED,msg.xid or 0,1)
+        return [msg]
+
+    def translate_raw_flow_mod(self,buf):
+        '''
+        @see translate_raw_flow_mod of Principal
+
+        Logical port translation never changes a flow mod's structure,
+        so every flow mod gets patched in place and forwarded.  Deletes
+        targetting all tables get fanned out to one delete per table
+        this principal owns, so that they cannot touch other
+        principals' tables.
+        '''
+        if flow_mod_table_id(buf) == ofproto.OFPTT_ALL:
+            return fan_out_flow_mod_wire(buf,self.physical_table_list)
+
+        # buf is only valid until we return; the copy is what gets
+        # queued to the switch.
+        flow_mod_buf = bytearray(buf)
+        self.translation_plan.translate_flow_mod_wire(flow_mod_buf)
+        return [flow_mod_buf]
 
 
 
 
-def flow_mod_rewrite_table_ids(flow_mod,table_id_list):
+def flow_mod_rewrite_table_ids(
+    flow_mod,table_id_list,principal_id=NO_PRINCIPAL_ID):
     '''
     @param {list} table_id_list --- Each element is an integer.
     Index of table_id_list is the virtual table id; value is
     physical table id.
 
-    A couple of notes.  For ofp delete alls, need to translate
-    into many messages sending to each individual table.
+    @param {int} principal_id --- Principal to attribute the rewrite
+    to in the trace log.
+
+    Note: flow mods targetting OFPTT_ALL never get here.  They are
+    fanned out into one flow mod per table in translate_raw_flow_mod.
 
     @throws {InvalidTableWriteException} --- If trying to write to
     a table that isn't a valid virtual id, then need to send an
     error back.
     '''
-    if flow_mod.table_id == ofproto.OFPTT_ALL:
-        # FIXME: delete messages can apply to all tables, need to
-        # translate into multiple deletes.
-        pluribus_logger.error(
-            'Still need to re-write messages targetting all tables')
-        return
-
     if flow_mod.table_id >= len(table_id_list):
         raise InvalidTableWriteException()
 
     old_table_id = flow_mod.table_id
     new_table_id = table_id_list[old_table_id]
-    pluribus_logger.info(
-        'For flowmod, rewriting old table %i to new table %i.' %
-        (old_table_id,new_table_id))
+    trace(principal_id,EVENT_TABLE_ID_REWRITTEN,old_table_id,new_table_id)
 
     flow_mod.table_id = new_table_id
 
-def flow_mod_rewrite_gotos(flow_mod,table_id_list):
+def flow_mod_rewrite_gotos(
+    flow_mod,table_id_list,principal_id=NO_PRINCIPAL_ID):
     '''
     @param {list} table_id_list --- Each element is an integer.
     Index of table_id_list is the virtual table id; value is
     physical table id.
 
+    @param {int} principal_id --- Principal to attribute rewrites to
+    in the trace log.
+
     Look through listed actions and translate gotos
 
     @throws {InvalidGotoTableException} --- If trying to goto a
@@ -167,14 +243,12 @@ def flow_mod_rewrite_gotos(flow_mod,table_id_list):
 
             old_table_id = instruction.table_id
             new_table_id = table_id_list[old_table_id]
-
-            pluribus_logger.info(
-                'For instruction, rewrite old table %i to new table %i.' %
-                (old_table_id,new_table_id))
+            trace(
+                principal_id,EVENT_GOTO_REWRITTEN,old_table_id,new_table_id)
             instruction.table_id = new_table_id
 
 def flow_mod_rewrite_action_ports(
-    flow_mod,physical_port_set,egress_logical_port_nums_to_princiapls):
+    flow_mod,physical_port_set,egress_logical_port_nums_to_principals):
     '''
     @param {ImmuatableSet} physical_port_set --- The physical
     ports that this message can address.
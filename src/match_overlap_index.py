@@ -0,0 +1,271 @@
+'''
+Index of the rules principals have installed on the switch, by
+physical table, used to keep principals from installing rules that
+break isolation.
+
+Two principals' rules conflict if they are in the same physical table
+and some packet could match both: whichever has the higher priority
+would see (or hide) traffic meant for the other.  Table assignments
+normally keep principals apart, but the chained table design installs
+wildcard in_port rules into both early and late tables, and nothing
+else checks that translated rules stay in their lane.
+
+Each physical table is a decision tree over a fixed list of OXM
+fields (DECISION_FIELDS).  At each level, rules that match the
+level's field exactly go into a child per value; rules that wildcard
+or mask it go into a single wildcard child.  Checking a new rule only
+descends into the children its own match could overlap, and every
+node counts its rules per principal, so subtrees that hold only the
+checking principal's rules are skipped without being walked.  Rules
+that reach a leaf get compared field by field.
+'''
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from translation_exceptions import IsolationViolationException
+from wire_flow_mod import flow_mod_fields
+from shadow_flow_table import match_values_from_key, physical_flow_mod_key
+
+
+def _field_id(oxm_field):
+    '''
+    @returns {int} --- OXM field id of an OpenFlow basic field, in
+    the form used by match_values_from_key.
+    '''
+    return (ofproto.OFPXMC_OPENFLOW_BASIC << 7) | oxm_field
+
+# (field id, width in bytes) of the fields the decision trees branch
+# on, from the root down.  Most discriminating first: in_port is how
+# the head table separates principals' traffic.
+DECISION_FIELDS = (
+    (_field_id(ofproto.OFPXMT_OFB_IN_PORT),4),
+    (_field_id(ofproto.OFPXMT_OFB_ETH_TYPE),2),
+    (_field_id(ofproto.OFPXMT_OFB_VLAN_VID),2),
+    (_field_id(ofproto.OFPXMT_OFB_IP_PROTO),1),
+    (_field_id(ofproto.OFPXMT_OFB_ETH_DST),6),
+    (_field_id(ofproto.OFPXMT_OFB_IPV4_DST),4))
+
+
+class MatchOverlapIndex(object):
+
+    def __init__(self):
+        # keys are physical table ids; values are root _DecisionNodes.
+        self.tables = {}
+        # keys are physical keys (@see physical_flow_mod_key) of
+        # indexed rules; values are (principal id, match values)
+        # tuples.
+        self.rules = {}
+
+    def check_flow_mods(self,principal_id,translated_bufs):
+        '''
+        @param {int} principal_id --- Principal about to send
+        translated_bufs to the switch.
+
+        @param {list} translated_bufs --- Translated messages.  Only
+        adds are checked: other commands never make a rule match more
+        packets.
+
+        @throws {IsolationViolationException} --- If any add would
+        overlap a rule of another principal.
+        '''
+        for translated_buf in translated_bufs:
+            command = flow_mod_fields(translated_buf)[3]
+            if command != ofproto.OFPFC_ADD:
+                continue
+            physical_key = physical_flow_mod_key(translated_buf)
+            other_principal_id = self.find_conflict(principal_id,physical_key)
+            if other_principal_id is not None:
+                raise IsolationViolationException(
+                    'Rule of principal %i in table %i overlaps rule of '
+                    'principal %i' %
+                    (principal_id,physical_key[0],other_principal_id))
+
+    def find_conflict(self,principal_id,physical_key):
+        '''
+        @param {tuple} physical_key --- (physical table id, priority,
+        canonical match) of a rule principal_id wants to install.
+
+        @returns {int or None} --- Id of a principal with an
+        overlapping rule in the same table.  None if there is none.
+        '''
+        root = self.tables.get(physical_key[0],None)
+        if root is None:
+            return None
+        match_values = match_values_from_key(physical_key[2])
+
+        to_visit = [root]
+        while to_visit:
+            node = to_visit.pop()
+            if not node.has_other_owner(principal_id):
+                continue
+
+            if node.depth == len(DECISION_FIELDS):
+                for other_principal_id, other_match_values in (
+                    node.rules.itervalues()):
+                    if ((other_principal_id != principal_id) and
+                        matches_overlap(match_values,other_match_values)):
+                        return other_principal_id
+                continue
+
+            if node.wildcard_child is not None:
+                to_visit.append(node.wildcard_child)
+            value = _exact_value(match_values,node.depth)
+            if value is None:
+                to_visit.extend(node.children.itervalues())
+            else:
+                child = node.children.get(value,None)
+                if child is not None:
+                    to_visit.append(child)
+        return None
+
+    def insert(self,principal_id,physical_key):
+        '''
+        Record that principal_id has installed the rule with
+        physical_key.  Replaces any previous owner of the same rule.
+        '''
+        if physical_key in self.rules:
+            self.remove(physical_key)
+        match_values = match_values_from_key(physical_key[2])
+        self.rules[physical_key] = (principal_id,match_values)
+
+        node = self.tables.get(physical_key[0],None)
+        if node is None:
+            node = _DecisionNode(0)
+            self.tables[physical_key[0]] = node
+        while True:
+            node.owner_counts[principal_id] = (
+                node.owner_counts.get(principal_id,0) + 1)
+            if node.depth == len(DECISION_FIELDS):
+                node.rules[physical_key] = (principal_id,match_values)
+                return
+            node = node.child_for(_exact_value(match_values,node.depth))
+
+    def remove(self,physical_key):
+        '''
+        Forget the rule with physical_key.  Does nothing if it was
+        never inserted.
+        '''
+        principal_id_and_match_values = self.rules.pop(physical_key,None)
+        if principal_id_and_match_values is None:
+            return
+        (principal_id, match_values) = principal_id_and_match_values
+
+        table_id = physical_key[0]
+        node = self.tables[table_id]
+        parent = None
+        value = None
+        while node is not None:
+            count = node.owner_counts[principal_id] - 1
+            if count == 0:
+                del node.owner_counts[principal_id]
+            else:
+                node.owner_counts[principal_id] = count
+
+            if not node.owner_counts:
+                # nothing left below: unlink whole subtree
+                if parent is None:
+                    del self.tables[table_id]
+                else:
+                    parent.unlink_child(value)
+                return
+
+            if node.depth == len(DECISION_FIELDS):
+                del node.rules[physical_key]
+                return
+            parent = node
+            value = _exact_value(match_values,node.depth)
+            node = node.get_child(value)
+
+    def num_rules(self):
+        return len(self.rules)
+
+
+class _DecisionNode(object):
+    def __init__(self,depth):
+        '''
+        @param {int} depth --- Index into DECISION_FIELDS of the field
+        this node branches on.  Nodes at depth len(DECISION_FIELDS)
+        are leaves.
+        '''
+        self.depth = depth
+        # keys are principal ids; values are the number of rules
+        # under this node that the principal owns.
+        self.owner_counts = {}
+
+        # keys are exact values of the node's field; values are
+        # _DecisionNodes.
+        self.children = {}
+        # rules that wildcard or mask the node's field
+        self.wildcard_child = None
+
+        # leaves only.  Keys are physical keys; values are
+        # (principal id, match values) tuples.
+        self.rules = {}
+
+    def has_other_owner(self,principal_id):
+        '''
+        @returns {bool} --- True if any rule under this node belongs to
+        a principal other than principal_id.
+        '''
+        num_owners = len(self.owner_counts)
+        if num_owners == 0:
+            return False
+        return (num_owners > 1) or (principal_id not in self.owner_counts)
+
+    def get_child(self,value):
+        '''
+        @param {int or None} value --- None for the wildcard child.
+        '''
+        if value is None:
+            return self.wildcard_child
+        return self.children.get(value,None)
+
+    def child_for(self,value):
+        '''
+        Like get_child, but creates the child if it does not exist.
+        '''
+        child = self.get_child(value)
+        if child is None:
+            child = _DecisionNode(self.depth + 1)
+            if value is None:
+                self.wildcard_child = child
+            else:
+                self.children[value] = child
+        return child
+
+    def unlink_child(self,value):
+        if value is None:
+            self.wildcard_child = None
+        else:
+            del self.children[value]
+
+
+def _exact_value(match_values,depth):
+    '''
+    @returns {int or None} --- Value match_values has for the field
+    at depth of the decision trees.  None if the field is wildcarded
+    or only partially masked.
+    '''
+    (field_id, width) = DECISION_FIELDS[depth]
+    value_and_mask = match_values.get(field_id,None)
+    if value_and_mask is None:
+        return None
+    (value, mask) = value_and_mask
+    if mask != (1 << (8*width)) - 1:
+        return None
+    return value
+
+def matches_overlap(match_values,other_match_values):
+    '''
+    @param {dict} match_values --- @see match_values_from_key.
+
+    @returns {bool} --- True if some packet matches both.  Fields
+    that only one of them constrains never rule out an overlap.
+    '''
+    for field_id, (value, mask) in match_values.iteritems():
+        other_value_and_mask = other_match_values.get(field_id,None)
+        if other_value_and_mask is None:
+            continue
+        (other_value, other_mask) = other_value_and_mask
+        if (value ^ other_value) & mask & other_mask:
+            return False
+    return True
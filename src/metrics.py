@@ -0,0 +1,317 @@
+'''
+Hot-path metrics, kept per principal so that it is possible to tell
+which principal is loading Pluribus.
+
+Counters are plain ints and preallocated lists of ints (eg., indexed
+by OpenFlow message type) that the hot paths increment directly.
+Latencies go into histograms with fixed buckets.  Nothing is
+formatted or aggregated until a snapshot is taken, which renders
+every metric in the Prometheus text exposition format (@see
+MetricsRegistry.render_text).  Gauges, such as queue depths, are
+sampled only when a snapshot is taken.
+'''
+import bisect
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+
+from conf import pluribus_logger
+import trace_log
+
+
+# upper bounds (inclusive), in seconds, of latency histogram buckets.
+# Last bucket catches everything larger.
+LATENCY_BUCKETS = (
+    .00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005,
+    .01, .025, .05, .1)
+
+# OpenFlow message types fit in a byte
+NUM_MSG_TYPES = 256
+
+# keys are OFPT_* values; values are their names, without OFPT_.
+MSG_TYPE_NAMES = dict(
+    (getattr(ofproto_v1_3,name),name[len('OFPT_'):])
+    for name in dir(ofproto_v1_3) if name.startswith('OFPT_'))
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram(object):
+    def __init__(self,bucket_bounds):
+        '''
+        @param {tuple} bucket_bounds --- Increasing upper bounds
+        (inclusive) of buckets.
+        '''
+        self.bucket_bounds = bucket_bounds
+        # one more than bounds: the last bucket has no upper bound
+        self.counts = [0]*(len(bucket_bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self,value):
+        self.counts[bisect.bisect_left(self.bucket_bounds,value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class PrincipalMetrics(object):
+    '''
+    Counters and histograms for a single principal.  Updated
+    directly by the principal, its connection and its datapath.
+    '''
+
+    def __init__(self,principal_id,reject_classes):
+        '''
+        @param {tuple} reject_classes --- Exception classes that
+        translating a principal's message can raise.  Rejects get
+        counted per class.
+        '''
+        self.principal_id = principal_id
+
+        #### from principal
+        # indexed by OFPT_* message type
+        self.msgs_received = [0]*NUM_MSG_TYPES
+        self.bytes_received = 0
+        # messages that could not be handled in their wire format
+        self.msgs_parsed = 0
+        # indexed by OFPT_* message type.  Elements are Histograms of
+        # seconds spent in handle_* methods, or None until a message
+        # of the type is handled.
+        self.handle_latencies = [None]*NUM_MSG_TYPES
+        self.translation_latency = Histogram(LATENCY_BUCKETS)
+
+        self.reject_classes = reject_classes
+        self.reject_indices = dict(
+            (reject_class,index)
+            for index, reject_class in enumerate(reject_classes))
+        # indexed like reject_classes
+        self.rejects = [0]*len(reject_classes)
+
+        #### to principal
+        self.msgs_sent = 0
+        self.bytes_sent = 0
+
+        #### to switch, on principal's behalf
+        self.msgs_to_switch = 0
+        self.bytes_to_switch = 0
+
+    def observe_handle(self,msg_type,seconds):
+        histogram = self.handle_latencies[msg_type]
+        if histogram is None:
+            histogram = Histogram(LATENCY_BUCKETS)
+            self.handle_latencies[msg_type] = histogram
+        histogram.observe(seconds)
+
+    def count_reject(self,ex):
+        '''
+        @param {Exception} ex --- Instance of one of reject_classes.
+        '''
+        index = self.reject_indices.get(type(ex),None)
+        if index is not None:
+            self.rejects[index] += 1
+
+
+class MetricsRegistry(object):
+    '''
+    Snapshots all of a switch's metrics.
+
+    Besides every principal's PrincipalMetrics, other components
+    register sample functions for their own counters and gauges
+    (@see register).
+    '''
+
+    def __init__(self,principals_fn):
+        '''
+        @param {function} principals_fn --- Returns the list of
+        Principals whose metrics to include.
+        '''
+        self.principals_fn = principals_fn
+
+        #### to switch, from all principals and Pluribus itself
+        # indexed by OFPT_* message type.  Only counts messages sent
+        # as ryu objects: raw messages are only counted in bytes.
+        self.msgs_to_switch = [0]*NUM_MSG_TYPES
+        self.raw_msgs_to_switch = 0
+        self.bytes_to_switch = 0
+
+        # each element is a (name, metric type, help, sample function)
+        # tuple.  Sample functions take no arguments and return lists
+        # of (labels dict, value) tuples.
+        self.registered = []
+
+    def register(self,name,metric_type,help_text,sample_fn):
+        '''
+        @param {str} metric_type --- 'counter' or 'gauge'.
+        '''
+        self.registered.append((name,metric_type,help_text,sample_fn))
+
+    def render_text(self):
+        '''
+        @returns {str} --- Snapshot of every metric, in the Prometheus
+        text exposition format.
+        '''
+        lines = []
+        _render_family(
+            lines,'pluribus_switch_messages_sent_total','counter',
+            'Messages sent to the switch as ryu objects, by type.',
+            _msg_type_samples({},self.msgs_to_switch))
+        _render_family(
+            lines,'pluribus_switch_raw_messages_sent_total','counter',
+            'Already-serialized messages sent to the switch.',
+            [({},self.raw_msgs_to_switch)])
+        _render_family(
+            lines,'pluribus_switch_bytes_sent_total','counter',
+            'Bytes sent to the switch.',[({},self.bytes_to_switch)])
+
+        principal_metrics = [
+            principal.metrics for principal in self.principals_fn()]
+        self._render_principals(lines,principal_metrics)
+
+        for name, metric_type, help_text, sample_fn in self.registered:
+            _render_family(lines,name,metric_type,help_text,sample_fn())
+        lines.append('')
+        return '\n'.join(lines)
+
+    def _render_principals(self,lines,principal_metrics):
+        def samples(attribute):
+            return [
+                ({'principal': metrics.principal_id},
+                 getattr(metrics,attribute))
+                for metrics in principal_metrics]
+
+        received = []
+        rejects = []
+        handle_latencies = []
+        for metrics in principal_metrics:
+            labels = {'principal': metrics.principal_id}
+            received.extend(_msg_type_samples(labels,metrics.msgs_received))
+            for reject_class, num_rejects in zip(
+                metrics.reject_classes,metrics.rejects):
+                rejects.append(
+                    ({'principal': metrics.principal_id,
+                      'exception': reject_class.__name__},
+                     num_rejects))
+            for msg_type, histogram in enumerate(metrics.handle_latencies):
+                if histogram is not None:
+                    handle_latencies.append(
+                        ({'principal': metrics.principal_id,
+                          'type': _msg_type_name(msg_type)},
+                         histogram))
+
+        _render_family(
+            lines,'pluribus_principal_messages_received_total','counter',
+            'Messages received from each principal, by type.',received)
+        _render_family(
+            lines,'pluribus_principal_bytes_received_total','counter',
+            'Bytes received from each principal.',
+            samples('bytes_received'))
+        _render_family(
+            lines,'pluribus_principal_messages_parsed_total','counter',
+            'Messages from each principal that had to be parsed.',
+            samples('msgs_parsed'))
+        _render_family(
+            lines,'pluribus_principal_rejects_total','counter',
+            'Messages from each principal that could not be translated, ' +
+            'by exception.',rejects)
+        _render_family(
+            lines,'pluribus_principal_messages_sent_total','counter',
+            'Messages sent to each principal.',samples('msgs_sent'))
+        _render_family(
+            lines,'pluribus_principal_bytes_sent_total','counter',
+            'Bytes sent to each principal.',samples('bytes_sent'))
+        _render_family(
+            lines,'pluribus_principal_switch_messages_sent_total','counter',
+            'Messages sent to the switch on behalf of each principal.',
+            samples('msgs_to_switch'))
+        _render_family(
+            lines,'pluribus_principal_switch_bytes_sent_total','counter',
+            'Bytes sent to the switch on behalf of each principal.',
+            samples('bytes_to_switch'))
+        _render_histogram_family(
+            lines,'pluribus_principal_handle_seconds',
+            'Time spent handling each principal\'s messages, by type.',
+            handle_latencies)
+        _render_histogram_family(
+            lines,'pluribus_principal_translation_seconds',
+            'Time spent translating each principal\'s messages.',
+            samples('translation_latency'))
+
+    def serve(self,port):
+        '''
+        Serves snapshots over HTTP on localhost, from its own
+        greenlet.  Requests for /trace get a dump of the trace log
+        instead (@see trace_log).
+
+        @param {int} port
+        '''
+        server = hub.WSGIServer(('127.0.0.1',port),self._wsgi_app)
+        pluribus_logger.info('Serving metrics on 127.0.0.1:%i' % port)
+        return hub.spawn(server.serve_forever)
+
+    def _wsgi_app(self,environ,start_response):
+        if environ.get('PATH_INFO') == '/trace':
+            # dump of trace records rather than metrics
+            lines = []
+            if trace_log.trace_log is not None:
+                lines = trace_log.trace_log.dump()
+            lines.append('')
+            body = '\n'.join(lines)
+        else:
+            body = self.render_text()
+        start_response(
+            '200 OK',
+            [('Content-Type',TEXT_CONTENT_TYPE),
+             ('Content-Length',str(len(body)))])
+        return [body]
+
+
+def _msg_type_name(msg_type):
+    return MSG_TYPE_NAMES.get(msg_type,str(msg_type))
+
+def _msg_type_samples(labels,counts):
+    '''
+    @param {list} counts --- Indexed by message type.
+
+    @returns {list} --- Of (labels, count) tuples, only for message
+    types with non-zero counts.
+    '''
+    samples = []
+    for msg_type, count in enumerate(counts):
+        if count:
+            msg_type_labels = dict(labels)
+            msg_type_labels['type'] = _msg_type_name(msg_type)
+            samples.append((msg_type_labels,count))
+    return samples
+
+def _render_family(lines,name,metric_type,help_text,samples):
+    lines.append('# HELP %s %s' % (name,help_text))
+    lines.append('# TYPE %s %s' % (name,metric_type))
+    for labels, value in samples:
+        lines.append('%s%s %s' % (name,_format_labels(labels),value))
+
+def _render_histogram_family(lines,name,help_text,samples):
+    '''
+    @param {list} samples --- Of (labels, Histogram) tuples.
+    '''
+    lines.append('# HELP %s %s' % (name,help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for labels, histogram in samples:
+        cumulative_count = 0
+        for bound, count in zip(
+            histogram.bucket_bounds + ('+Inf',),histogram.counts):
+            cumulative_count += count
+            bucket_labels = dict(labels)
+            bucket_labels['le'] = bound
+            lines.append(
+                '%s_bucket%s %i' % (
+                    name,_format_labels(bucket_labels),cumulative_count))
+        lines.append(
+            '%s_sum%s %r' % (name,_format_labels(labels),histogram.sum))
+        lines.append(
+            '%s_count%s %i' % (name,_format_labels(labels),histogram.count))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key,labels[key]) for key in sorted(labels))
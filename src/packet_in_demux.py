@@ -0,0 +1,130 @@
+'''
+Routes packet ins from the switch to the principals whose rules
+generated them.
+
+In OpenFlow 1.3, a packet in carries the id of the table that sent
+it to the controller.  Every physical table belongs to exactly one
+principal, so the table id alone identifies the owner: routes are kept
+in a 256-element list indexed by physical table id.  Packet ins get
+forwarded in their wire format, with only the table id (and, for
+packets that crossed over from another principal, in_port) patched:
+the packet's payload is never decoded.
+'''
+import struct
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from wire_flow_mod import match_in_port_offset
+
+
+# offsets from the start of a packet in
+PACKET_IN_TABLE_ID_OFFSET = 15
+PACKET_IN_MATCH_OFFSET = ofproto.OFP_PACKET_IN_SIZE - ofproto.OFP_MATCH_SIZE
+
+_UINT8_PACK_STR = '!B'
+_UINT32_PACK_STR = '!I'
+
+
+class PacketInRoute(object):
+    def __init__(self,principal,virtual_table_id,in_port_map=None):
+        '''
+        @param {Principal} principal --- Owner of the physical table.
+
+        @param {int} virtual_table_id --- The principal's id for the
+        physical table.
+
+        @param {dict or None} in_port_map --- Keys are in_ports as the
+        switch reports them; values are the in_ports the principal
+        should see instead.  None if in_ports need no rewriting.
+        '''
+        self.principal = principal
+        self.virtual_table_id = virtual_table_id
+        self.in_port_map = in_port_map
+
+
+class PacketInDemultiplexer(object):
+
+    def __init__(self):
+        # index is a physical table id; value is a PacketInRoute or
+        # None if no principal owns the table.
+        self.routes = [None]*256
+
+        #### counters
+        self.num_routed = 0
+        # packet ins from tables no principal owns (eg., the head
+        # table)
+        self.num_unrouted = 0
+        # packet ins dropped because their principal's connection was
+        # down or backed up
+        self.num_dropped = 0
+
+    def set_routes(self,principals):
+        '''
+        @param {list} principals --- Each element is a Principal.
+        Replaces all routes with the ones principals report (@see
+        Principal.packet_in_routes).
+        '''
+        routes = [None]*256
+        for principal in principals:
+            for physical_table_id, route in principal.packet_in_routes():
+                routes[physical_table_id] = route
+        self.routes = routes
+
+    def demux(self,buf):
+        '''
+        @param {buffer} buf --- A packet in from the switch, in its wire
+        format.
+
+        @returns {tuple or None} --- (principal, packet in) where packet
+        in is a bytearray holding the translated message.  None if no
+        principal owns the table the packet in came from.
+        '''
+        (physical_table_id,) = struct.unpack_from(
+            _UINT8_PACK_STR,buf,PACKET_IN_TABLE_ID_OFFSET)
+        route = self.routes[physical_table_id]
+        if route is None:
+            return None
+
+        packet_in_buf = bytearray(buf)
+        packet_in_buf[PACKET_IN_TABLE_ID_OFFSET] = route.virtual_table_id
+        if route.in_port_map is not None:
+            in_port_offset = match_in_port_offset(
+                packet_in_buf,PACKET_IN_MATCH_OFFSET)
+            if in_port_offset is not None:
+                (in_port,) = struct.unpack_from(
+                    _UINT32_PACK_STR,packet_in_buf,in_port_offset)
+                virtual_in_port = route.in_port_map.get(in_port,None)
+                if virtual_in_port is not None:
+                    struct.pack_into(
+                        _UINT32_PACK_STR,packet_in_buf,in_port_offset,
+                        virtual_in_port)
+        return route.principal, packet_in_buf
+
+    def dispatch(self,buf):
+        '''
+        Forwards a packet in to its principal.  Never blocks: if the
+        principal cannot take the packet in right away, it gets
+        dropped, so that one slow principal cannot hold up packet ins
+        for the others.
+
+        @param {buffer} buf --- @see demux.
+        '''
+        principal_and_buf = self.demux(buf)
+        if principal_and_buf is None:
+            self.num_unrouted += 1
+            return
+        (principal, packet_in_buf) = principal_and_buf
+        if principal.send_packet_in(packet_in_buf):
+            self.num_routed += 1
+        else:
+            self.num_dropped += 1
+
+    def get_counters(self):
+        '''
+        @returns {dict} --- Routed, unrouted and dropped counters.
+        '''
+        return {
+            'num_routed': self.num_routed,
+            'num_unrouted': self.num_unrouted,
+            'num_dropped': self.num_dropped
+            }
@@ -1,27 +1,60 @@
-import threading
 import time
 
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER
-from ryu.controller.handler import HANDSHAKE_DISPATCHER
+from ryu.controller.handler import HANDSHAKE_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls, set_ev_handler
 from ryu.ofproto.ofproto_v1_3_parser import OFPEchoRequest, OFPEchoReply
 from ryu.ofproto.ofproto_v1_3_parser import OFPPortDescStatsRequest
 from ryu.ofproto import ofproto_v1_3
 from ryu.controller import dpset
+from ryu.lib import hub
 import ryu.utils
+from eventlet import tpool
 
 
 import conf
 from conf import PORT_STATS_DELAY_TIME,JSON_PRINCIPALS_TO_LOAD_FILENAME
+from conf import PORT_DESC_POLL_PERIOD, PORT_DESC_MAX_POLL_PERIOD
 from conf import pluribus_logger
+from conf import SWITCH_FLUSH_WINDOW, SWITCH_MAX_BATCH_BYTES
+from conf import SWITCH_BUNDLES, SHADOW_STATS_POLL_PERIOD
+from conf import TRANSLATION_CACHE_SIZE, METRICS_PORT
+from conf import PROFILE_SIGNAL, PROFILE_ON_START, PROFILE_WINDOW
+from conf import PROFILE_INTERVAL, PROFILE_OUTPUT_DIR
+from conf import CHECKPOINT_FILENAME, CHECKPOINT_PERIOD
+from conf import CHECKPOINT_MAX_SNAPSHOTS
 
 from principals_util import load_principals_from_json_file
 
-from port_util import PortNameNumber
+from port_util import PortIndex
+from switch_output import SwitchOutputQueue
+from translation_cache import TranslationCache
+from principal_connection_manager import PrincipalConnectionManager
+from principal_connection_manager import PrincipalConnectionState
+from principal_connection import PrincipalConnection
+from shadow_flow_table import iter_flow_stats
+from match_overlap_index import MatchOverlapIndex
+from packet_in_demux import PacketInDemultiplexer
+from metrics import MetricsRegistry
+from profiling import SamplingProfiler
+from checkpoint import SnapshotBuilder, CheckpointWriter, load_checkpoint
+from trace_log import trace, trace_log, NO_PRINCIPAL_ID, EVENT_SWITCH_ERROR
+from bundle_util import SwitchBundle, set_xid
+from bundle_util import produce_bundle_ctrl, produce_bundle_add
+from bundle_util import parse_bundle_ctrl
+from bundle_util import ONF_EXPERIMENTER_ID, ONF_ET_BUNDLE_CONTROL
+from bundle_util import ONF_BCT_OPEN_REQUEST, ONF_BCT_COMMIT_REQUEST
+from bundle_util import ONF_BCT_COMMIT_REPLY
 
+# how many of the most recent trace records to log when the switch
+# reports an error
+SWITCH_ERROR_TRACE_RECORDS = 256
+# checkpoints yield to other greenlets after serializing this many
+# rules
+CHECKPOINT_YIELD_RULES = 500
 
 class SwitchState(object):
     # have no details about swtich
@@ -39,6 +72,15 @@ class SwitchState(object):
     # controllers.
     RUNNING = 2
 
+    # Lost the connection to the switch after assigning tables and
+    # ports.  Principals stay connected: their rules only go into
+    # their shadow flow tables until the switch is back.
+    DISCONNECTED = 3
+
+    # Switch reconnected.  Waiting for the ports principals were
+    # assigned, then reinstalling every rule (@see _resync_switch).
+    RESYNCING = 4
+
 
 class PluribusSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -51,17 +93,289 @@ class PluribusSwitch(app_manager.RyuApp):
         '''
         super(PluribusSwitch, self).__init__(*args, **kwargs)
 
+        # serves all principal connections on ryu's event loop.
+        self.principal_connection_manager = PrincipalConnectionManager()
+
+        # translated flow mods of all principals
+        self.translation_cache = TranslationCache(TRANSLATION_CACHE_SIZE)
+
+        # shared by all principals' shadow flow tables.  Keys are
+        # (physical table id, priority, canonical match) of switch
+        # rules; values are the ShadowFlowEntry objects they were
+        # installed for.
+        self.shadow_physical_index = {}
+        # xid of the outstanding poll for all of the switch's flow
+        # stats, when it was sent, and the shadow entries its replies
+        # have reported so far.
+        self.flow_stats_poll_xid = None
+        self.flow_stats_poll_time = None
+        self.flow_stats_polled_entries = set()
+
+        # switch rules of all principals, for rejecting rules that
+        # would overlap another principal's.
+        self.match_overlap_index = MatchOverlapIndex()
+
+        # routes packet ins to the principals that own the tables
+        # they came from.  Routes get set once tables are assigned.
+        self.packet_in_demux = PacketInDemultiplexer()
+
         self.principals = []
         if JSON_PRINCIPALS_TO_LOAD_FILENAME is not None:
             self.principals = load_principals_from_json_file(
                 principals_cls,JSON_PRINCIPALS_TO_LOAD_FILENAME,self)
             
         self.state = SwitchState.UNINITIALIZED
+        # set whenever the switch tells us about its ports while
+        # waiting for all of the ports principals need.
+        self.switch_ports_event = hub.Event()
+        # when Pluribus started, the switch connected, the ports
+        # principals need were there and Pluribus started running.
+        self.start_time = time.time()
+        self.switch_connect_time = None
+        self.switch_ports_time = None
+        self.running_time = None
+        # when the switch last disconnected, and how long it took to
+        # get it back in sync once it reconnected.
+        self.switch_disconnect_time = None
+        self.switch_reconnect_time = None
+        self.last_resync_seconds = None
+        self.num_switch_disconnects = 0
+        # keys are numbers of ports assigned to principals; values
+        # are their names.  Snapshotted when the switch disconnects:
+        # the assignment is only reused if they are all still there
+        # when it reconnects.
+        self.assigned_ports = None
         # all of these fields get loaded before transitioning int run state.
         self.switch_dp = None
         self.switch_num_tables = None
+        self.switch_num_buffers = None
+
+        # the switch's ports, except OFPP_LOCAL.  Kept up to date
+        # with the switch's port status messages.
+        self.port_index = None
+
+        # all messages that principals send to the switch go through
+        # here so that they can be written in batches.
+        self.switch_output = SwitchOutputQueue(
+            SWITCH_FLUSH_WINDOW,SWITCH_MAX_BATCH_BYTES)
+
+        # keys are xids of barriers we sent the switch; values are
+        # functions to call when the barrier's reply arrives.
+        self.barrier_callbacks = {}
+
+        # Set to False the first time the switch rejects a bundle
+        # message.  From then on, principals' bundles get sent as a
+        # batch followed by a barrier.
+        self.switch_supports_bundles = SWITCH_BUNDLES
+        self.next_switch_bundle_id = 0
+        # keys are xids of bundle messages sent to switch; values are
+        # SwitchBundle objects.
+        self.pending_switch_bundles = {}
+
+        # principals' barrier requests waiting for the switch to be
+        # resynced.  Each element is a (principal, principal's
+        # barrier xid) tuple.
+        self.queued_principal_barriers = []
+        # xid of the last switch barrier sent for principals' barriers
+        # and switch_output.num_queued right after it.  Principals'
+        # barriers can share it until anything else gets queued.
+        self.last_principal_barrier_xid = None
+        self.last_principal_barrier_num_queued = None
+        # xid translation table for principals' barriers: keys are
+        # xids of barriers sent to the switch; values are lists of
+        # (principal, principal's barrier xid) tuples to reply to
+        # when the switch replies.
+        self.principal_barrier_xids = {}
+
+        # while the switch is disconnected or resyncing, bundles
+        # principals commit wait here for the resync.  Each element is
+        # a SwitchBundle.
+        self.held_switch_bundles = []
+        # barrier callbacks, bundles and principal barriers that were
+        # waiting on the switch's previous connection.  Settled by
+        # _resync_switch.
+        self.stale_barrier_callbacks = {}
+        self.stale_switch_bundles = {}
+        self.stale_principal_barrier_xids = {}
 
-        self.port_name_number_list = None
+        # the last checkpoint written before starting, if any.  Used
+        # up (and closed) once principals have been assigned tables
+        # and ports (@see _restore_checkpoint).
+        self.checkpoint = None
+        self.checkpoint_writer = None
+        if CHECKPOINT_FILENAME is not None:
+            self.checkpoint = load_checkpoint(CHECKPOINT_FILENAME)
+            self.checkpoint_writer = CheckpointWriter(
+                CHECKPOINT_FILENAME,CHECKPOINT_MAX_SNAPSHOTS)
+            # checkpoint writes are the only calls handed to OS
+            # threads, and only one runs at a time.
+            tpool.set_num_threads(1)
+        self.num_checkpoints = 0
+        self.last_checkpoint_seconds = None
+        # sum of principals' shadow flow table changes when the last
+        # checkpoint was taken
+        self.checkpoint_num_changes = None
+
+        # per-principal and switch-wide hot path metrics
+        self.metrics = MetricsRegistry(lambda: self.principals)
+        self._register_metrics()
+        if METRICS_PORT is not None:
+            self.metrics.serve(METRICS_PORT)
+
+        # opt-in: costs nothing until a profile starts
+        self.profiler = SamplingProfiler(
+            PROFILE_INTERVAL,PROFILE_WINDOW,PROFILE_OUTPUT_DIR,
+            [PrincipalConnection.receive_principal_raw_message,
+             PrincipalConnection.receive_principal_message],
+            [PluribusSwitch.recv_packet_in,
+             PluribusSwitch.recv_barrier_response,
+             PluribusSwitch.recv_flow_stats_reply,
+             PluribusSwitch.recv_port_stats_response,
+             PluribusSwitch.recv_experimenter,
+             PluribusSwitch.error_msg_handler])
+        if PROFILE_SIGNAL is not None:
+            self.profiler.install_signal(PROFILE_SIGNAL)
+        if PROFILE_ON_START:
+            self.profiler.start()
+
+    def _register_metrics(self):
+        '''
+        Registers the counters and gauges of the switch's components
+        with self.metrics.  They only get sampled when a snapshot is
+        taken.
+        '''
+        def per_principal(fn):
+            return lambda: [
+                ({'principal': principal.id},fn(principal))
+                for principal in self.principals]
+        def single(fn):
+            return lambda: [({},fn())]
+        register = self.metrics.register
+
+        register(
+            'pluribus_principal_send_queue_depth','gauge',
+            'Messages waiting to be written to each principal.',
+            per_principal(_principal_send_queue_depth))
+        register(
+            'pluribus_principal_connection_state','gauge',
+            'Each principal\'s connection state: 1 for the state it is ' +
+            'in, 0 for the others.',
+            self._connection_state_samples)
+        register(
+            'pluribus_principal_connect_attempts_total','counter',
+            'Attempts to connect to each principal.',
+            per_principal(
+                lambda principal: (
+                    self.principal_connection_manager.num_attempts.get(
+                        principal.id,0))))
+        register(
+            'pluribus_principal_shadow_rules','gauge',
+            'Rules each principal has installed.',
+            per_principal(
+                lambda principal: principal.shadow_flow_table.num_entries))
+        register(
+            'pluribus_principal_open_bundles','gauge',
+            'Bundles each principal has opened but not committed.',
+            per_principal(lambda principal: len(principal.open_bundles)))
+        register(
+            'pluribus_principal_buffer_ids_allocated','gauge',
+            'Virtual buffer ids each principal has been given and ' +
+            'not used.',
+            per_principal(
+                lambda principal: principal.buffer_ids.num_allocated()))
+        register(
+            'pluribus_principal_buffer_ids_expired_total','counter',
+            'Virtual buffer ids that expired unused.',
+            per_principal(
+                lambda principal: principal.buffer_ids.num_expired))
+        register(
+            'pluribus_principal_buffer_ids_evicted_total','counter',
+            'Virtual buffer ids reclaimed because all were in use.',
+            per_principal(
+                lambda principal: principal.buffer_ids.num_evicted))
+
+        register(
+            'pluribus_startup_seconds','gauge',
+            'Seconds from starting until the switch connected, until ' +
+            'its ports were ready, and until running.',
+            self._startup_samples)
+        register(
+            'pluribus_switch_disconnects_total','counter',
+            'Times the connection to the switch was lost.',
+            single(lambda: self.num_switch_disconnects))
+        register(
+            'pluribus_switch_resync_seconds','gauge',
+            'Seconds from the switch reconnecting until its rules were ' +
+            'reinstalled, for the last reconnect.',
+            lambda: (
+                [] if self.last_resync_seconds is None
+                else [({},self.last_resync_seconds)]))
+        register(
+            'pluribus_checkpoints_total','counter',
+            'Checkpoints written.',
+            single(lambda: self.num_checkpoints))
+        register(
+            'pluribus_checkpoint_seconds','gauge',
+            'Seconds it took to take and write the last checkpoint.',
+            lambda: (
+                [] if self.last_checkpoint_seconds is None
+                else [({},self.last_checkpoint_seconds)]))
+        register(
+            'pluribus_switch_send_queue_depth','gauge',
+            'Batches waiting to be written to the switch.',
+            single(self._switch_send_queue_depth))
+        register(
+            'pluribus_switch_output_pending_messages','gauge',
+            'Messages queued for the next batch to the switch.',
+            single(lambda: len(self.switch_output.pending)))
+        register(
+            'pluribus_switch_output_pending_bytes','gauge',
+            'Bytes queued for the next batch to the switch.',
+            single(lambda: self.switch_output.pending_bytes))
+        register(
+            'pluribus_switch_output_batches_total','counter',
+            'Batches written to the switch.',
+            single(lambda: self.switch_output.num_batches))
+        register(
+            'pluribus_switch_output_max_flush_latency_seconds','gauge',
+            'Longest a batch waited to be written to the switch.',
+            single(lambda: self.switch_output.max_flush_latency))
+        register(
+            'pluribus_switch_pending_principal_barriers','gauge',
+            'Switch barriers waiting to be answered for principals.',
+            single(lambda: len(self.principal_barrier_xids)))
+        register(
+            'pluribus_translation_cache_entries','gauge',
+            'Translated flow mods in the translation cache.',
+            single(lambda: len(self.translation_cache.entries)))
+        register(
+            'pluribus_translation_cache_hits_total','counter',
+            'Flow mods whose translations were found in the cache.',
+            single(lambda: self.translation_cache.num_hits))
+        register(
+            'pluribus_translation_cache_misses_total','counter',
+            'Flow mods whose translations were not in the cache.',
+            single(lambda: self.translation_cache.num_misses))
+        register(
+            'pluribus_translation_cache_evictions_total','counter',
+            'Translations evicted from the cache.',
+            single(lambda: self.translation_cache.num_evictions))
+        register(
+            'pluribus_match_overlap_index_rules','gauge',
+            'Switch rules checked for overlaps between principals.',
+            single(self.match_overlap_index.num_rules))
+        register(
+            'pluribus_packet_ins_total','counter',
+            'Packet ins from the switch, by what became of them.',
+            lambda: [
+                ({'result': 'routed'},self.packet_in_demux.num_routed),
+                ({'result': 'unrouted'},self.packet_in_demux.num_unrouted),
+                ({'result': 'dropped'},self.packet_in_demux.num_dropped)])
+
+    def _switch_send_queue_depth(self):
+        if (self.switch_dp is None) or (self.switch_dp.send_q is None):
+            return 0
+        return self.switch_dp.send_q.qsize()
 
     def send_feature_request(self):
         '''
@@ -70,7 +384,7 @@ class PluribusSwitch(app_manager.RyuApp):
         if self.switch_dp is not None:
             feature_msg = self.switch_dp.ofproto_parser.OFPFeaturesRequest(
                 self.switch_dp)
-            self.switch_dp.send_msg(feature_msg)
+            self.send_msg_now(feature_msg)
         else:
             # not yet initialized
             assert False
@@ -81,7 +395,7 @@ class PluribusSwitch(app_manager.RyuApp):
         '''
         if self.switch_dp is not None:
             echo_msg = OFPEchoRequest(self.switch_dp)
-            self.switch_dp.send_msg(echo_msg)
+            self.send_msg_now(echo_msg)
         else:
             # not yet initialized
             assert False
@@ -91,10 +405,95 @@ class PluribusSwitch(app_manager.RyuApp):
         Request port stats
         '''
         port_desc_stats_msg = OFPPortDescStatsRequest(self.switch_dp)
-        self.switch_dp.send_msg(port_desc_stats_msg)
+        self.send_msg_now(port_desc_stats_msg)
             
-    def send_barrier(self):
-        self.switch_dp.send_barrier()
+    def send_barrier(self,callback=None):
+        '''
+        @param {function or None} callback --- Called with no
+        arguments when the switch replies to the barrier.
+
+        @returns {int} --- xid of the barrier sent to the switch.
+        '''
+        barrier_msg = self.switch_dp.ofproto_parser.OFPBarrierRequest(
+            self.switch_dp)
+        xid = self.switch_dp.set_xid(barrier_msg)
+        if callback is not None:
+            self.barrier_callbacks[xid] = callback
+        self.send_msg_now(barrier_msg)
+        return xid
+
+    def send_flow_stats_poll(self):
+        '''
+        Request counters for every rule on the switch.  Replies update
+        principals' shadow flow tables (@see recv_flow_stats_reply).
+        Goes through the output queue, so the switch has applied
+        every flow mod sent before the poll when it answers.
+        '''
+        ofproto = self.switch_dp.ofproto
+        stats_msg = self.switch_dp.ofproto_parser.OFPFlowStatsRequest(
+            self.switch_dp,0,ofproto.OFPTT_ALL,ofproto.OFPP_ANY,
+            ofproto.OFPG_ANY,0,0,self.switch_dp.ofproto_parser.OFPMatch())
+        self.flow_stats_poll_xid = self.switch_dp.set_xid(stats_msg)
+        self.flow_stats_poll_time = time.time()
+        self.flow_stats_polled_entries = set()
+        self.send_msg(stats_msg)
+
+    def _poll_flow_stats_loop(self,datapath):
+        '''
+        Runs in its own greenlet once the switch is running, until
+        the switch's connection (datapath) goes away.
+        '''
+        while True:
+            hub.sleep(SHADOW_STATS_POLL_PERIOD)
+            if ((self.state != SwitchState.RUNNING) or
+                (self.switch_dp is not datapath)):
+                return
+            if self.shadow_physical_index:
+                self.send_flow_stats_poll()
+
+    def virtualize_barrier(self,principal,principal_xid):
+        '''
+        @param {Principal} principal --- Principal that sent a barrier
+        request.
+
+        @param {int} principal_xid --- xid of principal's barrier
+        request.
+
+        Calls principal.send_barrier_reply(principal_xid) once the
+        switch has processed everything principal sent before its
+        barrier.  Barriers from all principals that arrive with
+        nothing sent to the switch in between share a single switch
+        barrier.  While the switch is away, barriers wait for the
+        resync to finish.
+        '''
+        self.queued_principal_barriers.append((principal,principal_xid))
+        if self.state == SwitchState.RUNNING:
+            self._send_principal_barriers()
+
+    def _send_principal_barriers(self):
+        '''
+        Queues a switch barrier for the queued principal barriers
+        right behind everything principals sent before them, without
+        flushing: it goes out with their batch.  If nothing was queued
+        since the last such switch barrier, they share it instead.
+        '''
+        queued_barriers = self.queued_principal_barriers
+        self.queued_principal_barriers = []
+        shared_barriers = self.principal_barrier_xids.get(
+            self.last_principal_barrier_xid,None)
+        if ((shared_barriers is not None) and
+            (self.switch_output.num_queued ==
+             self.last_principal_barrier_num_queued)):
+            shared_barriers.extend(queued_barriers)
+            return
+
+        barrier_msg = self.switch_dp.ofproto_parser.OFPBarrierRequest(
+            self.switch_dp)
+        switch_xid = self.switch_dp.set_xid(barrier_msg)
+        self.principal_barrier_xids[switch_xid] = queued_barriers
+        self.send_msg(barrier_msg)
+        self.last_principal_barrier_xid = switch_xid
+        self.last_principal_barrier_num_queued = self.switch_output.num_queued
         
     def add_flow_mod(self,match,instructions,priority,table_id):
         flow_mod_msg = self.switch_dp.ofproto_parser.OFPFlowMod(
@@ -120,15 +519,225 @@ class PluribusSwitch(app_manager.RyuApp):
 
         self.send_msg(flow_mod_msg)
 
+    def num_buffers_per_principal(self):
+        '''
+        @returns {int} --- Each principal's equal share of the
+        switch's packet buffers.  0 if the switch does not buffer
+        packets.
+        '''
+        if not self.principals:
+            return 0
+        return self.switch_num_buffers / len(self.principals)
+
     def send_msg(self,msg_to_send):
         '''
         @param {Subclass of MsgBase} msg_to_send
         '''
-        self.switch_dp.send_msg(msg_to_send)        
+        buf = self.serialize_msg(msg_to_send)
+        self.metrics.msgs_to_switch[msg_to_send.msg_type] += 1
+        self.metrics.bytes_to_switch += len(buf)
+        self.switch_output.send(buf)
+
+    def send_msg_now(self,msg_to_send):
+        '''
+        @param {Subclass of MsgBase} msg_to_send --- Sent behind
+        everything already queued for the switch, without waiting for
+        its batch to fill.
+        '''
+        if self.switch_output.datapath is not self.switch_dp:
+            # resyncing: the output queue stays on the switch's old
+            # connection until _resync_switch, and nothing else gets
+            # sent on the new one before then.
+            self.switch_dp.send_msg(msg_to_send)
+            return
+        self.send_msg(msg_to_send)
+        self.switch_output.flush()
+
+    def serialize_msg(self,msg_to_send):
+        '''
+        @param {Subclass of MsgBase} msg_to_send --- Gets an xid from
+        the switch's datapath if it does not have one yet.
+
+        @returns {bytearray} --- msg_to_send's serialized buf.
+        '''
+        if msg_to_send.xid is None:
+            self.switch_dp.set_xid(msg_to_send)
+        msg_to_send.serialize()
+        return msg_to_send.buf
+
+    def send_raw(self,buf):
+        '''
+        @param {bytearray} buf --- A complete, already-serialized
+        OpenFlow message.  Caller must not modify it after this call.
+        '''
+        self.metrics.raw_msgs_to_switch += 1
+        self.metrics.bytes_to_switch += len(buf)
+        self.switch_output.send(buf)
+
+    def commit_bundle(self,principal,commit_xid,bundle_id,flags,
+                      translated_bufs):
+        '''
+        @param {Principal} principal --- Principal committing bundle.
+        
+        @param {int} commit_xid --- xid of principal's commit request.
+
+        @param {int} bundle_id --- Principal's id for bundle.
+
+        @param {int} flags --- Principal's bundle flags.
+        
+        @param {list} translated_bufs --- Each element is a bytearray
+        holding a translated message.
+
+        Applies all translated messages as a single bundle on the
+        switch, or, if the switch does not support bundles, as a batch
+        followed by a barrier.  Either way, principal.bundle_committed
+        gets called once they have been applied.
+        '''
+        switch_bundle = SwitchBundle(
+            principal,commit_xid,bundle_id,flags,translated_bufs)
+        if self.state != SwitchState.RUNNING:
+            # switch is away.  Its outcome could not be reported until
+            # the resync anyway.
+            self.held_switch_bundles.append(switch_bundle)
+        elif self.switch_supports_bundles:
+            self._send_switch_bundle(switch_bundle)
+        else:
+            self._send_bundle_as_batch(switch_bundle)
+
+    def _send_switch_bundle(self,switch_bundle):
+        switch_bundle_id = self.next_switch_bundle_id
+        self.next_switch_bundle_id = (
+            (self.next_switch_bundle_id + 1) & 0xffffffff)
+        flags = switch_bundle.flags
+
+        open_xid = self._next_switch_xid()
+        switch_bundle.switch_xids.append(open_xid)
+        self.switch_output.send(
+            produce_bundle_ctrl(
+                open_xid,switch_bundle_id,ONF_BCT_OPEN_REQUEST,flags))
+
+        for translated_buf in switch_bundle.translated_bufs:
+            # translated messages still carry the principal's xids,
+            # which could collide with ours.
+            add_xid = self._next_switch_xid()
+            set_xid(translated_buf,add_xid)
+            switch_bundle.switch_xids.append(add_xid)
+            self.switch_output.send(
+                produce_bundle_add(switch_bundle_id,flags,translated_buf))
+
+        commit_xid = self._next_switch_xid()
+        switch_bundle.switch_xids.append(commit_xid)
+        self.switch_output.send(
+            produce_bundle_ctrl(
+                commit_xid,switch_bundle_id,ONF_BCT_COMMIT_REQUEST,flags))
+        self.switch_output.flush()
+
+        for xid in switch_bundle.switch_xids:
+            self.pending_switch_bundles[xid] = switch_bundle
+
+    def _send_bundle_as_batch(self,switch_bundle):
+        for translated_buf in switch_bundle.translated_bufs:
+            self.switch_output.send(translated_buf)
+        self.send_barrier(
+            lambda: self._finish_switch_bundle(switch_bundle,True))
+
+    def _finish_switch_bundle(self,switch_bundle,succeeded):
+        '''
+        Reports outcome of switch_bundle to the principal that
+        committed it.
+        '''
+        switch_bundle.done = True
+        for xid in switch_bundle.switch_xids:
+            self.pending_switch_bundles.pop(xid,None)
+
+        principal = switch_bundle.principal
+        if succeeded:
+            principal.bundle_committed(
+                switch_bundle.bundle_id,switch_bundle.commit_xid,
+                switch_bundle.flags)
+        else:
+            principal.bundle_failed(
+                switch_bundle.bundle_id,switch_bundle.commit_xid,
+                switch_bundle.flags)
+
+    def _recv_switch_bundle_error(self,switch_bundle,msg):
+        '''
+        @param {SwitchBundle} switch_bundle --- Bundle that msg is an
+        error for.
+
+        @param {OFPErrorMsg} msg
+        '''
+        if switch_bundle.done:
+            # already reported on: subsequent errors are for the
+            # remaining messages in a rejected bundle.
+            self.pending_switch_bundles.pop(msg.xid,None)
+            return
+
+        ofproto = self.switch_dp.ofproto
+        if ((msg.type == ofproto.OFPET_BAD_REQUEST) and
+            ((msg.code == ofproto.OFPBRC_BAD_EXPERIMENTER) or
+             (msg.code == ofproto.OFPBRC_BAD_EXP_TYPE))):
+            pluribus_logger.warning(
+                'Switch does not support bundles.  Sending bundles ' +
+                'as batches followed by barriers.')
+            self.switch_supports_bundles = False
+            # keep the bundle's xids around so that errors for the
+            # rest of its messages get swallowed.
+            switch_bundle.done = True
+            self._send_bundle_as_batch(switch_bundle)
+        else:
+            pluribus_logger.error(
+                'Switch rejected bundle: ' +
+                ('type=0x%02x code=0x%02x' % (msg.type, msg.code)))
+            self._finish_switch_bundle(switch_bundle,False)
+
+    def _next_switch_xid(self):
+        '''
+        @returns {int} --- An xid for a message to the switch that we
+        serialize ourselves.  Shares ryu's counter so that it never
+        collides with xids ryu assigns.
+        '''
+        self.switch_dp.xid += 1
+        self.switch_dp.xid &= self.switch_dp.ofproto.MAX_XID
+        return self.switch_dp.xid
+
+    @set_ev_cls(ofp_event.EventOFPExperimenter, MAIN_DISPATCHER)
+    def recv_experimenter(self,ev):
+        msg = ev.msg
+        if ((msg.experimenter != ONF_EXPERIMENTER_ID) or
+            (msg.exp_type != ONF_ET_BUNDLE_CONTROL)):
+            pluribus_logger.error(
+                'Received unknown experimenter message from switch')
+            return
+
+        switch_bundle = self.pending_switch_bundles.get(msg.xid,None)
+        if (switch_bundle is None) or switch_bundle.done:
+            return
+
+        (_, ctrl_type, _) = parse_bundle_ctrl(msg.buf)
+        if ctrl_type == ONF_BCT_COMMIT_REPLY:
+            self._finish_switch_bundle(switch_bundle,True)
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def recv_packet_in(self,ev):
+        '''
+        Forwards packet ins, still in their wire format, to the
+        principal whose table sent them.
+        '''
+        self.packet_in_demux.dispatch(ev.msg.buf)
 
     @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)                
     def recv_barrier_response(self,ev):
-        if self.state == SwitchState.INSTALLING_HEAD_TABLES:
+        principal_barriers = self.principal_barrier_xids.pop(ev.msg.xid,None)
+        if principal_barriers is not None:
+            for principal, principal_xid in principal_barriers:
+                principal.send_barrier_reply(principal_xid)
+            return
+
+        callback = self.barrier_callbacks.pop(ev.msg.xid,None)
+        if callback is not None:
+            callback()
+        elif self.state == SwitchState.INSTALLING_HEAD_TABLES:
             self._transition_from_installing_head_tables()
         else:
             # actually process barrier response
@@ -137,20 +746,58 @@ class PluribusSwitch(app_manager.RyuApp):
             
     @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, [MAIN_DISPATCHER])
     def recv_port_stats_response(self,ev):
-        if self.state != SwitchState.RUNNING:
-            self._init_recv_port_stats_response_config(ev)
+        if self.state in (SwitchState.UNINITIALIZED,SwitchState.RESYNCING):
+            self._populate_ports_from_port_stats_response(ev)
+            self.switch_ports_event.set()
+        elif self.state != SwitchState.RUNNING:
+            pass
         else:
             # actually process port stats responses for 
             pluribus_logger.error(
                 'Received port stats when running.  Must finish.')
 
 
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, [MAIN_DISPATCHER])
+    def recv_flow_stats_reply(self,ev):
+        '''
+        Copies counters from a reply to send_flow_stats_poll into the
+        shadow entries of the rules they are for.  Once the last reply
+        arrives, shadow entries the switch no longer has get removed.
+        '''
+        msg = ev.msg
+        if msg.xid != self.flow_stats_poll_xid:
+            return
+
+        for physical_key, packet_count, byte_count in iter_flow_stats(
+            msg.buf):
+            entry = self.shadow_physical_index.get(physical_key,None)
+            if entry is not None:
+                entry.set_polled_counters(packet_count,byte_count)
+                self.flow_stats_polled_entries.add(entry)
+
+        if not (msg.flags & self.switch_dp.ofproto.OFPMPF_REPLY_MORE):
+            for principal in self.principals:
+                principal.shadow_flow_table.remove_stale_entries(
+                    self.flow_stats_polled_entries,self.flow_stats_poll_time)
+            self.flow_stats_poll_xid = None
+            self.flow_stats_polled_entries = set()
+
     @set_ev_cls(ofp_event.EventOFPErrorMsg,
                 [CONFIG_DISPATCHER, MAIN_DISPATCHER])
     def error_msg_handler(self, ev):
         msg = ev.msg
-        
-        if self.state != SwitchState.RUNNING:
+
+        switch_bundle = self.pending_switch_bundles.get(msg.xid,None)
+        if switch_bundle is not None:
+            self._recv_switch_bundle_error(switch_bundle,msg)
+            return
+
+        # show what led up to the error
+        trace(NO_PRINCIPAL_ID,EVENT_SWITCH_ERROR,msg.xid,msg.type,msg.code)
+        if trace_log is not None:
+            trace_log.dump_to_log(SWITCH_ERROR_TRACE_RECORDS)
+
+        if self.running_time is None:
             # no graceful retries or anything if get an error while
             # setting up head tables, getting port descriptors, etc.
             # Just fail.
@@ -176,26 +823,168 @@ class PluribusSwitch(app_manager.RyuApp):
             
     ##### Switch initialization code ####
 
-    def _init_recv_port_stats_response_config(self,ev):
+    def _init_switch_ports(self):
         '''
-        As part of initialization, determine which ports are logical
-        and which ports are physical.
+        Called once port_index has the ports principals need (or
+        after waiting PORT_STATS_DELAY_TIME for them).  As part of
+        initialization, determine which ports are logical and which
+        ports are physical.
+        '''
+        assert False
+
+    def _switch_ports_ready(self):
+        '''
+        @returns {bool} --- True if port_index has all of the ports
+        principals need.  Subclasses that need more than principals'
+        physical ports extend this.
+        '''
+        if self.port_index is None:
+            return False
+        for principal in self.principals:
+            for port_number in principal.physical_port_set:
+                if self.port_index.get(port_number) is None:
+                    return False
+        return True
+
+    def _await_switch_ports(self,connect_time):
+        '''
+        @param {float} connect_time --- When the switch connected.
+
+        Runs in its own greenlet once the switch connects.  Waits for
+        the ports principals need, acting on port status messages as
+        they arrive and polling for the switch's ports with backoff,
+        then initializes (or resyncs, if the switch reconnected).
+        '''
+        datapath = self.switch_dp
+        deadline = connect_time + PORT_STATS_DELAY_TIME
+        poll_period = PORT_DESC_POLL_PERIOD
+        next_poll_time = time.time()
+        while not self._switch_ports_ready():
+            if self.switch_dp is not datapath:
+                # switch reconnected again: its own greenlet takes over.
+                return
+            now = time.time()
+            if now >= deadline:
+                pluribus_logger.warning(
+                    'Switch ports still missing after %.1fs.  ' %
+                    PORT_STATS_DELAY_TIME +
+                    'Initializing with the ports there are.')
+                break
+            if now >= next_poll_time:
+                self.send_port_stats_request()
+                next_poll_time = now + poll_period
+                poll_period = min(2*poll_period,PORT_DESC_MAX_POLL_PERIOD)
+            self.switch_ports_event.clear()
+            self.switch_ports_event.wait(min(next_poll_time,deadline) - now)
+
+        if self.switch_dp is not datapath:
+            return
+        if self.port_index is None:
+            pluribus_logger.error('Switch never reported its ports')
+            assert False
+        if self.state == SwitchState.RESYNCING:
+            self._resync_switch()
+            return
+        self.switch_ports_time = time.time()
+        pluribus_logger.info(
+            'Switch ports ready %.3fs after the switch connected' %
+            (self.switch_ports_time - self.switch_connect_time))
+        self._init_switch_ports()
+
+    def _send_head_table_flow_mod(self,principal):
+        '''
+        Should be overridden to send the head table rules that direct
+        principal's packets to its tables.  Must not send a barrier.
         '''
         assert False
+
+    def _assigned_port_numbers(self):
+        '''
+        @returns {set} --- Numbers of the switch ports assigned to
+        principals.  Subclasses that assign more than principals'
+        physical ports extend this.
+        '''
+        port_numbers = set()
+        for principal in self.principals:
+            port_numbers.update(principal.physical_port_set)
+        return port_numbers
+
+    def _connection_state_samples(self):
+        states = self.principal_connection_manager.states
+        samples = []
+        for principal in self.principals:
+            principal_state = states.get(
+                principal.id,PrincipalConnectionState.DOWN)
+            for state, name in PrincipalConnectionState.NAMES.iteritems():
+                samples.append(
+                    ({'principal': principal.id,'state': name},
+                     int(state == principal_state)))
+        return samples
+
+    def _startup_samples(self):
+        samples = []
+        for phase, phase_time in (('connect',self.switch_connect_time),
+                                  ('ports',self.switch_ports_time),
+                                  ('running',self.running_time)):
+            if phase_time is not None:
+                samples.append(
+                    ({'phase': phase},phase_time - self.start_time))
+        return samples
     
     def _populate_ports_from_port_stats_response(self,ev):
         '''
         As part of initialization, determine which ports are logical
         and which ports are physical.
         '''
-        self.port_name_number_list = []
+        self.port_index = PortIndex()
         for p in ev.msg.body:
             if p.port_no ==  ofproto_v1_3.OFPP_LOCAL:
                 # do not forward back local port to other principals
                 continue
             
-            self.port_name_number_list.append(
-                PortNameNumber(p.name,p.port_no))        
+            self.port_index.add(p.name,p.port_no)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus,MAIN_DISPATCHER)
+    def recv_port_status(self,ev):
+        '''
+        Keeps port_index up to date as ports get added, deleted and
+        renamed on the switch, without re-running initialization.
+        '''
+        msg = ev.msg
+        port = msg.desc
+        if ((self.port_index is None) or
+            (port.port_no == ofproto_v1_3.OFPP_LOCAL)):
+            # ports get listed in full when we ask for them
+            return
+
+        if msg.reason == ofproto_v1_3.OFPPR_DELETE:
+            if self.port_index.remove(port.port_no) is None:
+                return
+        else:
+            # OFPPR_ADD, or OFPPR_MODIFY, which only concerns us if
+            # the port got renamed.
+            existing = self.port_index.get(port.port_no)
+            if (existing is not None) and (existing.port_name == port.name):
+                return
+            self.port_index.add(port.name,port.port_no)
+
+        pluribus_logger.info(
+            'Port %s (%i) %s' %
+            (port.name,port.port_no,
+             'deleted' if msg.reason == ofproto_v1_3.OFPPR_DELETE
+             else 'added'))
+        if self.state in (SwitchState.UNINITIALIZED,SwitchState.RESYNCING):
+            # might be the port _await_switch_ports is waiting on
+            self.switch_ports_event.set()
+        else:
+            self._ports_changed()
+
+    def _ports_changed(self):
+        '''
+        Called after port_index changes, once initialized.  Subclasses
+        override to update anything derived from the switch's ports.
+        '''
+        pass
 
 
     def _transition_from_installing_head_tables(self):
@@ -203,43 +992,364 @@ class PluribusSwitch(app_manager.RyuApp):
         Should connect to principals and transition into running
         state.
         '''
-        pluribus_logger.info('Transitioning into running state')
+        self.running_time = time.time()
+        pluribus_logger.warning(
+            ('Running %.3fs after starting ' %
+             (self.running_time - self.start_time)) +
+            ('(%.3fs after the switch connected)' %
+             (self.running_time - self.switch_connect_time)))
         self.state = SwitchState.RUNNING
+        self.packet_in_demux.set_routes(self.principals)
 
+        # connects concurrently, without blocking this handler.
         for principal in self.principals:
             principal.connect()
 
+        if SHADOW_STATS_POLL_PERIOD > 0:
+            hub.spawn(self._poll_flow_stats_loop,self.switch_dp)
+        if self.checkpoint_writer is not None:
+            hub.spawn(self._checkpoint_loop)
+
+
+    #### Checkpointing code ####
+
+    def _checkpoint_loop(self):
+        '''
+        Runs in its own greenlet once running.  Checkpoints whenever
+        principals' rules changed since the last checkpoint, unless
+        the switch is away.
+        '''
+        while True:
+            hub.sleep(CHECKPOINT_PERIOD)
+            if self.state != SwitchState.RUNNING:
+                continue
+            num_changes = sum(
+                principal.shadow_flow_table.num_changes
+                for principal in self.principals)
+            if num_changes != self.checkpoint_num_changes:
+                self.write_checkpoint()
+                self.checkpoint_num_changes = num_changes
+
+    def write_checkpoint(self):
+        '''
+        Appends a snapshot of principals' assignments and translated
+        rules to the checkpoint file, so that restoring is a bulk
+        copy.  Rules are serialized in chunks, between which principals
+        and the switch get served, and the file is written and synced
+        from an OS thread.  Rules that change while it runs may or may
+        not make it in: the next checkpoint has them.
+        '''
+        start = time.time()
+        builder = SnapshotBuilder()
+        builder.add_switch(
+            self.switch_dp.id,self.switch_num_tables,
+            [(port.port_number,port.port_name) for port in self.port_index])
+        for principal in self.principals:
+            builder.add_assignment(
+                principal.id,principal.checkpoint_assignment())
+        for principal in self.principals:
+            for entry, translated_bufs in (
+                principal.translated_shadow_entries()):
+                builder.add_rule(principal.id,entry,translated_bufs)
+                if builder.num_rules % CHECKPOINT_YIELD_RULES == 0:
+                    hub.sleep(0)
+        num_bytes = tpool.execute(self.checkpoint_writer.write,builder,start)
+
+        self.num_checkpoints += 1
+        self.last_checkpoint_seconds = time.time() - start
+        pluribus_logger.info(
+            'Checkpointed %i rules (%i bytes) in %.3fs' %
+            (builder.num_rules,num_bytes,self.last_checkpoint_seconds))
+
+    def _restore_checkpoint(self):
+        '''
+        Called while installing head tables, once principals have
+        been assigned tables and ports, and before any head table
+        rules get sent.  If the checkpoint loaded on starting was
+        taken on the same switch, with the same ports and
+        assignments, clears the switch and puts the checkpoint's
+        rules back on it and into principals' shadow flow tables.
+        Principals only get connected afterwards, so their
+        controllers find their rules in place (and just replace them
+        if they re-push them anyway).
+        '''
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return
+        self.checkpoint = None
+        try:
+            mismatch = self._checkpoint_mismatch(checkpoint)
+            if mismatch is not None:
+                pluribus_logger.warning(
+                    'Not restoring checkpoint: %s' % mismatch)
+                return
+
+            start = time.time()
+            self._send_delete_all_flows()
+            principals_by_id = dict(
+                (principal.id,principal) for principal in self.principals)
+            num_restored = 0
+            num_expired = 0
+            for principal_id, rule in checkpoint.iter_rules():
+                principal = principals_by_id[principal_id]
+                if principal.restore_rule(rule,start):
+                    num_restored += 1
+                else:
+                    num_expired += 1
+            pluribus_logger.warning(
+                ('Restored %i rules (%i expired) from checkpoint ' %
+                 (num_restored,num_expired)) +
+                ('taken %.1fs ago, in %.3fs' %
+                 (start - checkpoint.snapshot_time,time.time() - start)))
+        finally:
+            checkpoint.close()
+
+    def _checkpoint_mismatch(self,checkpoint):
+        '''
+        @returns {str or None} --- Why checkpoint cannot be restored.
+        None if it can.
+        '''
+        if checkpoint.datapath_id != self.switch_dp.id:
+            return 'taken on switch %016x' % checkpoint.datapath_id
+        if checkpoint.num_tables != self.switch_num_tables:
+            return 'taken on a switch with %i tables' % checkpoint.num_tables
+        for port_number in self._assigned_port_numbers():
+            port = self.port_index.get(port_number)
+            if ((port is None) or
+                (checkpoint.ports.get(port_number) !=
+                 port.port_name.rstrip('\x00'))):
+                return 'port %i changed' % port_number
+        assignments = dict(
+            (principal.id,principal.checkpoint_assignment())
+            for principal in self.principals)
+        if assignments != checkpoint.assignments:
+            return 'principals or their assignments changed'
+        return None
+
+
+    #### Switch reconnection code ####
+
+    @set_ev_cls(ofp_event.EventOFPStateChange,DEAD_DISPATCHER)
+    def _recv_switch_dead(self,ev):
+        if ((ev.datapath is not self.switch_dp) or
+            (self.state == SwitchState.DISCONNECTED)):
+            # an older connection, or already handled
+            return
+        if self.state == SwitchState.UNINITIALIZED:
+            # nothing assigned yet: just start over on reconnecting.
+            pluribus_logger.error('Lost connection to switch')
+            return
+        self._switch_disconnected()
+
+    def _switch_disconnected(self):
+        '''
+        Keeps principals connected and their assignments as they are,
+        so that the switch can be resynced when it reconnects.  Their
+        rules still get applied to their shadow flow tables; what gets
+        sent to the switch's dead connection is dropped.
+        '''
+        if self.state != SwitchState.RESYNCING:
+            # while resyncing, the ports have not been checked against
+            # the last snapshot yet (or were, and matched).
+            self.assigned_ports = {}
+            for port_number in self._assigned_port_numbers():
+                port = self.port_index.get(port_number)
+                if port is not None:
+                    self.assigned_ports[port_number] = port.port_name
+        # the reconnected switch gets asked for its ports afresh.
+        self.port_index = None
+
+        self.state = SwitchState.DISCONNECTED
+        self.switch_disconnect_time = time.time()
+        self.num_switch_disconnects += 1
+        self.flow_stats_poll_xid = None
+        pluribus_logger.error(
+            'Lost connection to switch.  Keeping principals connected ' +
+            'until it reconnects.')
+
+    def _resync_switch(self):
+        '''
+        Called once the reconnected switch has the ports principals
+        were assigned.  Clears the switch and reinstalls the head
+        table and every principal's rules from their shadow flow
+        tables, as one batch behind one barrier.  Principals never
+        notice: what they sent while the switch was away is in their
+        shadow flow tables, and their barriers and bundle commits get
+        sent on once the barrier is answered.
+        '''
+        for port_number, port_name in self.assigned_ports.iteritems():
+            port = self.port_index.get(port_number)
+            if (port is None) or (port.port_name != port_name):
+                pluribus_logger.error(
+                    ('Switch port %i (%s) missing after reconnecting.  ' %
+                     (port_number,port_name)) +
+                    'Cannot reuse principals\' assignments.  QUITTING')
+                assert False
+        # anything derived from the previous connection's ports
+        self._ports_changed()
+
+        resync_start = time.time()
+        self._settle_stale_switch_requests()
+
+        # the switch's buffers did not survive the reconnect
+        for principal in self.principals:
+            principal.set_num_buffers(self.num_buffers_per_principal())
+
+        self.switch_output.set_datapath(self.switch_dp)
+        self._send_delete_all_flows()
+        for principal in self.principals:
+            self._send_head_table_flow_mod(principal)
+        num_flow_mods = 0
+        for principal in self.principals:
+            num_flow_mods += principal.reinstall_rules()
+
+        # bundles principals committed while the switch was away,
+        # in the order they committed them.
+        held_switch_bundles = self.held_switch_bundles
+        self.held_switch_bundles = []
+        for switch_bundle in held_switch_bundles:
+            if self.switch_supports_bundles:
+                self._send_switch_bundle(switch_bundle)
+            else:
+                self._send_bundle_as_batch(switch_bundle)
+
+        pluribus_logger.info(
+            'Reinstalling %i rules for %i principals, %.3fs after the ' %
+            (num_flow_mods,len(self.principals),
+             resync_start - self.switch_reconnect_time) +
+            'switch reconnected')
+        datapath = self.switch_dp
+        self.send_barrier(lambda: self._transition_from_resyncing(datapath))
+
+    def _settle_stale_switch_requests(self):
+        '''
+        Settles what was waiting on the switch's previous connection.
+        Bundles that were not acknowledged fail: whatever the switch
+        did with them is about to be cleared.  Barrier callbacks run:
+        what they were waiting on is in the shadow flow tables, and
+        so gets reinstalled.  Principals' barriers get sent again once
+        resynced.
+        '''
+        stale_switch_bundles = set(
+            switch_bundle
+            for switch_bundle in self.stale_switch_bundles.itervalues()
+            if not switch_bundle.done)
+        for switch_bundle in stale_switch_bundles:
+            self._finish_switch_bundle(switch_bundle,False)
+        self.stale_switch_bundles = {}
+
+        stale_barrier_callbacks = self.stale_barrier_callbacks
+        self.stale_barrier_callbacks = {}
+        for callback in stale_barrier_callbacks.itervalues():
+            callback()
+
+        for principal_barriers in (
+            self.stale_principal_barrier_xids.itervalues()):
+            self.queued_principal_barriers.extend(principal_barriers)
+        self.stale_principal_barrier_xids = {}
+
+    def _send_delete_all_flows(self):
+        '''
+        Deletes every rule on the switch, eg., rules it kept while
+        disconnected that principals have since deleted.
+        '''
+        ofproto = self.switch_dp.ofproto
+        flow_mod_msg = self.switch_dp.ofproto_parser.OFPFlowMod(
+            self.switch_dp,0,0,ofproto.OFPTT_ALL,ofproto.OFPFC_DELETE,
+            0,0,0,ofproto.OFP_NO_BUFFER,ofproto.OFPP_ANY,ofproto.OFPG_ANY,
+            0,self.switch_dp.ofproto_parser.OFPMatch(),[])
+        self.send_msg(flow_mod_msg)
+
+    def _transition_from_resyncing(self,datapath):
+        '''
+        Called when the switch replies to the resync's barrier, sent
+        on datapath.
+        '''
+        if ((self.switch_dp is not datapath) or
+            (self.state != SwitchState.RESYNCING)):
+            # switch disconnected again before replying
+            return
+
+        if self.running_time is None:
+            # lost the switch while installing head tables: principals
+            # still need connecting.
+            self._transition_from_installing_head_tables()
+        else:
+            self.state = SwitchState.RUNNING
+            if SHADOW_STATS_POLL_PERIOD > 0:
+                hub.spawn(self._poll_flow_stats_loop,self.switch_dp)
+        self.last_resync_seconds = time.time() - self.switch_reconnect_time
+        pluribus_logger.warning(
+            ('Switch back in sync %.3fs after reconnecting ' %
+             self.last_resync_seconds) +
+            ('(%.3fs after disconnecting)' %
+             (time.time() - self.switch_disconnect_time)))
+
+        if self.queued_principal_barriers:
+            # a barrier of their own, rather than the resync's: held
+            # bundles that fell back to batches may still be waiting
+            # on theirs.
+            self._send_principal_barriers()
+        # port status messages while resyncing only updated port_index
+        self._ports_changed()
+
             
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures,[CONFIG_DISPATCHER])
     def _recv_switch_features_response(self,ev):
         msg = ev.msg
-        self.switch_num_tables = msg.n_tables
+        if self.state in (SwitchState.RUNNING,SwitchState.RESYNCING,
+                          SwitchState.INSTALLING_HEAD_TABLES):
+            # switch reconnected before we noticed its previous
+            # connection die.
+            self._switch_disconnected()
+        if self.state == SwitchState.DISCONNECTED:
+            if msg.n_tables < self.switch_num_tables:
+                pluribus_logger.error(
+                    ('Switch reconnected with %i tables instead of %i.  ' %
+                     (msg.n_tables,self.switch_num_tables)) +
+                    'Cannot reuse principals\' assignments.  QUITTING')
+                assert False
+            # whatever was waiting on the previous connection gets
+            # settled once resyncing.
+            self.stale_barrier_callbacks.update(self.barrier_callbacks)
+            self.barrier_callbacks = {}
+            self.stale_switch_bundles.update(self.pending_switch_bundles)
+            self.pending_switch_bundles = {}
+            self.stale_principal_barrier_xids.update(
+                self.principal_barrier_xids)
+            self.principal_barrier_xids = {}
+        else:
+            self.switch_num_tables = msg.n_tables
+        self.switch_num_buffers = msg.n_buffers
         self.switch_dp = msg.datapath
 
         pluribus_logger.info(
-            'Received switch features.  Num tables %i' %
-            msg.n_tables)
+            'Received switch features.  Num tables %i, num buffers %i' %
+            (msg.n_tables,msg.n_buffers))
 
+        connect_time = time.time()
         if self.state == SwitchState.UNINITIALIZED:
-             self._delayed_port_stats_request_outer(PORT_STATS_DELAY_TIME)
+            self.switch_connect_time = connect_time
+            self.switch_output.set_datapath(self.switch_dp)
+            hub.spawn(self._await_switch_ports,connect_time)
+        elif self.state == SwitchState.DISCONNECTED:
+            # principals' messages keep going to the old connection,
+            # and getting dropped, until resyncing.
+            self.switch_reconnect_time = connect_time
+            self.state = SwitchState.RESYNCING
+            hub.spawn(self._await_switch_ports,connect_time)
         #### DEBUG
         else:
             pluribus_logger.error('Unexpected state transition')
             assert False
         #### END DEBUG
 
-    def _delayed_port_stats_request_outer(self,seconds_to_delay):
-        '''
-        @param {int} seconds_to_delay
-        
-        Wait seconds_to_delay before sending a port stats request.
-        '''
-        t = threading.Thread(
-            target=self._delayed_port_stats_request_inner,
-            args=(seconds_to_delay,))
-        t.start()
 
-    def _delayed_port_stats_request_inner(self,seconds_to_delay):
-        time.sleep(seconds_to_delay)
-        self.send_port_stats_request()
-        
+
+def _principal_send_queue_depth(principal):
+    if not principal.is_connected():
+        return 0
+    send_q = principal.connection.datapath.send_q
+    if send_q is None:
+        return 0
+    return send_q.qsize()
@@ -13,43 +13,14 @@ def set_logical_physical(port_name_number_list):
     list.  (Basic idea is that iterating through the list allows you
     to quickly get a unique logical port pair.
     '''
-    to_return = []
-    
-    # first, identify all physical ports
+    port_index = PortIndex()
     for port_name_number in port_name_number_list:
-        if not is_loopback_port(port_name_number.port_name):
-            port_name_number.set_physical()
-    
-    # Next, pair logical ports. Basic algorithm: principals are listed
-    # in incremental order from 0.  Ie., princiapl 0, 1, 2, ...  As
-    # soon as missing next highest principal id number, know that
-    # we're out of principals and return.
-    port_pair_num = 0
-    while True:
-        port_a_name = produce_loopback_port_a(port_pair_num)
-        port_b_name = produce_loopback_port_b(port_pair_num)
-        port_pair_num += 1 # go on to next principal number
-        
-        port_name_number_a = None
-        port_name_number_b = None
-        
-        for port_name_number in port_name_number_list:
-            if port_name_number.port_name == port_a_name:
-                port_name_number_a = port_name_number
-            elif port_name_number.port_name == port_b_name:
-                port_name_number_b = port_name_number
-
-        # no more principals to match
-        if (port_name_number_a is None) and (port_name_number_b is None):
-            return to_return
-
-        # check for unmatched logical port
-        if (port_name_number_a is None) or (port_name_number_b is None):
-            assert False
+        port_index.add_port_name_number(port_name_number)
 
-        port_name_number_a.set_logical(port_name_number_b)
-        port_name_number_b.set_logical(port_name_number_a)
-        to_return.append(port_name_number_a)
+    # check for unmatched logical port
+    if port_index.unmatched_loopback_ports():
+        assert False
+    return port_index.logical_port_pair_halves()
 
 
 def num_logical_port_pairs_from_num_principals(num_principals):
@@ -129,3 +100,140 @@ def is_loopback_port(port_name):
     if LOOPBACK_PORT_NAME_PREFIX in port_name:
         return True
     return False
+
+def parse_loopback_port(port_name):
+    '''
+    @returns {2-tuple or None} --- (a,b): a is the port pair number;
+    b is 0 for the pair's a port and 1 for its b port.  None if
+    port_name is not in the format produce_loopback_port_a and
+    produce_loopback_port_b produce.
+    '''
+    prefix_index = port_name.find(LOOPBACK_PORT_NAME_PREFIX)
+    if prefix_index == -1:
+        return None
+    suffix = port_name[prefix_index + len(LOOPBACK_PORT_NAME_PREFIX):]
+    pair_number, _, half = suffix.rpartition('_')
+    if (not pair_number.isdigit()) or (half not in ('a','b')):
+        return None
+    return int(pair_number), 0 if half == 'a' else 1
+
+
+class PortIndex(object):
+    '''
+    A switch's ports, indexed by number and by loopback pair number,
+    so that classifying ports as physical or logical and pairing
+    logical ports takes time linear in the number of ports.
+
+    Ports can be added and removed one at a time (eg., as the switch
+    reports them in OFPT_PORT_STATUS messages): each change only
+    touches the port and, for loopback ports, its partner.
+    '''
+
+    def __init__(self):
+        # keys are port numbers; values are PortNameNumbers
+        self.by_number = {}
+        # keys are loopback port pair numbers; values are two-element
+        # lists: the pair's a and b PortNameNumbers, or None for a
+        # half the switch has not reported (yet).
+        self.loopback_pairs = {}
+
+    def __len__(self):
+        return len(self.by_number)
+
+    def __iter__(self):
+        return self.by_number.itervalues()
+
+    def get(self,port_number):
+        '''
+        @returns {PortNameNumber or None}
+        '''
+        return self.by_number.get(port_number,None)
+
+    def add(self,port_name,port_number):
+        '''
+        @returns {PortNameNumber} --- For the added port.  Replaces
+        any port that already had port_number.
+        '''
+        port_name_number = PortNameNumber(port_name,port_number)
+        self.add_port_name_number(port_name_number)
+        return port_name_number
+
+    def add_port_name_number(self,port_name_number):
+        if port_name_number.port_number in self.by_number:
+            self.remove(port_name_number.port_number)
+        self.by_number[port_name_number.port_number] = port_name_number
+
+        if not is_loopback_port(port_name_number.port_name):
+            port_name_number.set_physical()
+            return
+
+        parsed = parse_loopback_port(port_name_number.port_name)
+        if parsed is None:
+            # neither physical nor logical
+            return
+        pair_number, half = parsed
+        pair = self.loopback_pairs.setdefault(pair_number,[None,None])
+        pair[half] = port_name_number
+        if (pair[0] is not None) and (pair[1] is not None):
+            pair[0].set_logical(pair[1])
+            pair[1].set_logical(pair[0])
+
+    def remove(self,port_number):
+        '''
+        @returns {PortNameNumber or None} --- For the removed port.
+        None if there was no port with port_number.  If it was
+        logical, its partner is left unpaired (neither physical nor
+        logical) until a port takes its place.
+        '''
+        port_name_number = self.by_number.pop(port_number,None)
+        if port_name_number is None:
+            return None
+
+        parsed = parse_loopback_port(port_name_number.port_name)
+        if parsed is None:
+            return port_name_number
+        pair_number, half = parsed
+        pair = self.loopback_pairs[pair_number]
+        pair[half] = None
+        partner = pair[1 - half]
+        if partner is None:
+            del self.loopback_pairs[pair_number]
+        else:
+            partner.is_physical = None
+            partner.partner = None
+        return port_name_number
+
+    def logical_port_pair_halves(self):
+        '''
+        @returns {list} --- @see set_logical_physical.  Pairs are
+        numbered from 0: stops at the first pair that is missing a
+        port.
+        '''
+        to_return = []
+        port_pair_num = 0
+        while True:
+            pair = self.loopback_pairs.get(port_pair_num,None)
+            if (pair is None) or (pair[0] is None) or (pair[1] is None):
+                return to_return
+            to_return.append(pair[0])
+            port_pair_num += 1
+
+    def unmatched_loopback_ports(self):
+        '''
+        @returns {list} --- PortNameNumbers of loopback ports whose
+        partner is missing.
+        '''
+        return [
+            port_name_number
+            for pair in self.loopback_pairs.itervalues()
+            for port_name_number in pair
+            if (port_name_number is not None) and
+            (port_name_number.partner is None)]
+
+    def highest_port_number(self):
+        '''
+        @returns {int} --- -1 if there are no ports.
+        '''
+        if not self.by_number:
+            return -1
+        return max(self.by_number)
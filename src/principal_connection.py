@@ -1,7 +1,7 @@
-import socket
-import threading
 import sys
 import os
+import time
+import socket
 
 from ryu.lib import rpc
 from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
@@ -16,6 +16,9 @@ from ryu.controller.handler import HANDSHAKE_DISPATCHER
 from ryu.controller.handler import set_ev_cls, set_ev_handler
 
 from conf import pluribus_logger
+from shadow_flow_table import stats_request_type
+from bundle_util import onf_bundle_exp_type
+from bundle_util import ONF_ET_BUNDLE_CONTROL, ONF_ET_BUNDLE_ADD_MESSAGE
 
 
 sys.path.append(
@@ -27,31 +30,110 @@ import extended_v3_parser
 
 class PrincipalConnection(object):
 
-    def __init__(self,ipaddr,tcp_port,principal):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ipaddr, tcp_port))
+    def __init__(self,sock,address,principal):
+        '''
+        @param {socket} sock --- Connected (green) socket to principal.
 
+        @param {tuple} address --- (ip address, tcp port) of principal.
+        '''
         self.principal = principal
-        self.datapath = PrincipalDatapath(self,s,(ipaddr,str(tcp_port)))
-        self.perform_handshake()
-        
+        self.datapath = PrincipalDatapath(self,sock,address)
+        # True once the principal has sent its features request, ie.,
+        # finished the OpenFlow handshake.  handshake_event gets set
+        # then, or when the connection closes, whichever is first.
+        self.handshake_done = False
+        self.handshake_event = hub.Event()
 
-    def perform_handshake(self):
+    def serve(self):
         '''
-        Sends ofp hello to other side
+        Sends ofp hello to other side and then handles the principal's
+        messages until it disconnects.  Must be called from a
+        greenlet: see PrincipalConnectionManager.
         '''
         pluribus_logger.debug(
             'Sending handshake to principal %i' % self.principal.id)
-        t = threading.Thread(target=self.datapath.serve)
-        t.start()
+        try:
+            self.datapath.serve()
+        finally:
+            self.handshake_event.set()
+
+    def close(self):
+        '''
+        Ends serve: the principal's messages stop being read.
+        '''
+        self.datapath.is_active = False
+        try:
+            self.datapath.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            # already closed
+            pass
+
+    def receive_principal_raw_message(self,msg_type,buf):
+        '''
+        @param {int} msg_type --- OpenFlow message type of buf.
+
+        @param {buffer} buf --- A message from the principal, still in
+        its wire format.  Only valid until this method returns.
+
+        @returns {bool} --- True if the principal handled the message
+        without needing it parsed.  False if caller should parse the
+        message and pass it through receive_principal_message.
+        '''
+        metrics = self.principal.metrics
+        metrics.msgs_received[msg_type] += 1
+        metrics.bytes_received += len(buf)
 
+        start = time.time()
+        handled = self._dispatch_raw_message(msg_type,buf)
+        if handled:
+            metrics.observe_handle(msg_type,time.time() - start)
+        return handled
+
+    def _dispatch_raw_message(self,msg_type,buf):
+        '''
+        @see receive_principal_raw_message
+        '''
+        if msg_type == ofproto_v1_3.OFPT_FLOW_MOD:
+            return self.principal.handle_raw_flow_mod(buf)
+        elif msg_type == ofproto_v1_3.OFPT_MULTIPART_REQUEST:
+            stats_type = stats_request_type(buf)
+            if stats_type == ofproto_v1_3.OFPMP_FLOW:
+                self.principal.handle_flow_stats_request(buf)
+                return True
+            elif stats_type == ofproto_v1_3.OFPMP_AGGREGATE:
+                self.principal.handle_aggregate_stats_request(buf)
+                return True
+        elif msg_type == ofproto_v1_3.OFPT_PACKET_OUT:
+            self.principal.handle_packet_out(buf)
+            return True
+        elif msg_type == ofproto_v1_3.OFPT_BARRIER_REQUEST:
+            self.principal.handle_barrier_request(buf)
+            return True
+        elif msg_type == ofproto_v1_3.OFPT_EXPERIMENTER:
+            exp_type = onf_bundle_exp_type(buf)
+            if exp_type == ONF_ET_BUNDLE_CONTROL:
+                self.principal.handle_bundle_ctrl(buf)
+                return True
+            elif exp_type == ONF_ET_BUNDLE_ADD_MESSAGE:
+                self.principal.handle_bundle_add(buf)
+                return True
+        return False
 
     def receive_principal_message(self,msg):
         '''
         Receive some message from principal.
         '''
+        metrics = self.principal.metrics
+        metrics.msgs_parsed += 1
+        start = time.time()
+        self._dispatch_message(msg)
+        metrics.observe_handle(msg.msg_type,time.time() - start)
+
+    def _dispatch_message(self,msg):
         if isinstance(msg, extended_v3_parser.OFPFeaturesRequest):
             self.principal.handle_features_request(msg)
+            self.handshake_done = True
+            self.handshake_event.set()
         elif isinstance(msg,extended_v3_parser.OFPDescStatsRequest):
             self.principal.handle_desc_stats_request(msg)
         elif isinstance(msg,extended_v3_parser.OFPFlowMod):
@@ -0,0 +1,144 @@
+import random
+import socket
+
+from ryu.lib import hub
+
+from conf import pluribus_logger
+from conf import PRINCIPAL_CONNECT_TIMEOUT, PRINCIPAL_HANDSHAKE_TIMEOUT
+from conf import PRINCIPAL_RECONNECT_BACKOFF, PRINCIPAL_MAX_RECONNECT_BACKOFF
+from principal_connection import PrincipalConnection
+
+
+class PrincipalConnectionState(object):
+    # waiting to (re)try connecting
+    DOWN = 0
+    # waiting for principal's controller to accept
+    CONNECTING = 1
+    # connected; waiting for principal's features request
+    HANDSHAKING = 2
+    # handshake done: serving principal
+    UP = 3
+
+    NAMES = {
+        DOWN: 'down',
+        CONNECTING: 'connecting',
+        HANDSHAKING: 'handshaking',
+        UP: 'up',
+        }
+
+
+class PrincipalConnectionManager(object):
+    '''
+    Owns the connections to all principals.
+
+    Every connection runs as a pair of greenlets (receive and send
+    loops) on ryu's hub, the same event loop that serves the switch
+    connection, instead of on an OS thread per principal.  Connects
+    are cooperative: a principal that is slow to accept (or not
+    listening at all) does not hold up connecting to the others or
+    handling the switch.
+
+    Each principal goes through the states of
+    PrincipalConnectionState independently.  Connect attempts and
+    handshakes time out; failed attempts and disconnects are retried
+    with jittered exponential backoff, for as long as Pluribus runs.
+    '''
+
+    def __init__(self):
+        # keys are principal ids; values are PrincipalConnection
+        # objects that have connected and are being served.
+        self.connections = {}
+        # keys are principal ids; values are the greenlets connecting
+        # to and then serving each principal.
+        self.principal_threads = {}
+        # keys are principal ids; values are PrincipalConnectionState
+        # values.
+        self.states = {}
+        # keys are principal ids; values are number of connect attempts
+        self.num_attempts = {}
+
+    def connect(self,principal):
+        '''
+        Start connecting to principal.  Returns immediately; the
+        connection is made and served in its own greenlet.
+
+        @param {Principal} principal
+        '''
+        self.states[principal.id] = PrincipalConnectionState.DOWN
+        self.num_attempts[principal.id] = 0
+        self.principal_threads[principal.id] = hub.spawn(
+            self._connect_and_serve,principal)
+
+    def connect_all(self,principals):
+        '''
+        @param {list} principals --- Each element is a Principal.
+        Connects to all of them concurrently.
+        '''
+        for principal in principals:
+            self.connect(principal)
+
+    def num_connected(self):
+        return len(self.connections)
+
+    def num_in_state(self,state):
+        return sum(
+            1 for principal_state in self.states.itervalues()
+            if principal_state == state)
+
+    def _connect_and_serve(self,principal):
+        '''
+        Runs in a greenlet for as long as Pluribus runs: connects to
+        principal, serves it until it disconnects, and then
+        reconnects.
+        '''
+        address = (principal.listening_ip_addr,principal.listening_port_addr)
+        backoff = PRINCIPAL_RECONNECT_BACKOFF
+        while True:
+            if self._connect_and_serve_once(principal,address):
+                # was up: start backing off afresh
+                backoff = PRINCIPAL_RECONNECT_BACKOFF
+            self.states[principal.id] = PrincipalConnectionState.DOWN
+            hub.sleep(backoff*random.uniform(.5,1.))
+            backoff = min(2*backoff,PRINCIPAL_MAX_RECONNECT_BACKOFF)
+
+    def _connect_and_serve_once(self,principal,address):
+        '''
+        @returns {bool} --- True if the principal was up before it
+        disconnected.  False if the attempt failed.
+        '''
+        self.states[principal.id] = PrincipalConnectionState.CONNECTING
+        self.num_attempts[principal.id] += 1
+        pluribus_logger.info(
+            'Connecting to principal at %s:%i' % address)
+        try:
+            with hub.Timeout(PRINCIPAL_CONNECT_TIMEOUT):
+                sock = hub.connect(address)
+        except (socket.error, hub.Timeout) as ex:
+            reason = str(ex)
+            if isinstance(ex,hub.Timeout):
+                reason = 'timed out'
+            pluribus_logger.error(
+                'Could not connect to principal %i at %s:%i: %s' %
+                (principal.id,address[0],address[1],reason))
+            return False
+
+        self.states[principal.id] = PrincipalConnectionState.HANDSHAKING
+        connection = PrincipalConnection(sock,address,principal)
+        principal.connection = connection
+        self.connections[principal.id] = connection
+        serve_thread = hub.spawn(connection.serve)
+        connection.handshake_event.wait(PRINCIPAL_HANDSHAKE_TIMEOUT)
+        was_up = connection.handshake_done
+        if was_up:
+            self.states[principal.id] = PrincipalConnectionState.UP
+        elif connection.datapath.is_active:
+            pluribus_logger.error(
+                'Principal %i did not finish handshake' % principal.id)
+            connection.close()
+        try:
+            serve_thread.wait()
+        finally:
+            pluribus_logger.info(
+                'Principal %i disconnected' % principal.id)
+            del self.connections[principal.id]
+        return was_up
@@ -5,45 +5,86 @@ from ryu.ofproto import ofproto_protocol
 from ryu.ofproto import ofproto_v1_0
 from ryu.ofproto import nx_match
 from ryu.controller import ofp_event
-from conf import pluribus_logger
+from ryu.lib import hub
+from conf import pluribus_logger, PRINCIPAL_RECV_BUFFER_SIZE
+from conf import PRINCIPAL_SEND_QUEUE_SIZE
+from recv_buffer import ReceiveBuffer
 
 class PrincipalDatapath(Datapath):
 
     def __init__(self, principal_connection,socket, address):
         self.principal_connection = principal_connection
         super(PrincipalDatapath, self).__init__(socket,address)
+        self.send_q = hub.Queue(PRINCIPAL_SEND_QUEUE_SIZE)
 
         # FIXME: hardcoded principal's datapath
         pluribus_logger.error('FIXME: hardcoded principal datapath ids')
         self.id = 150
-        
+
+    def set_state(self, state):
+        '''
+        Principal connections are not switches: unlike ryu's
+        Datapath, do not announce their state changes to ryu apps
+        (which would otherwise treat them as switch connections).
+        '''
+        self.state = state
+
+    def send(self,buf):
+        send_q = self.send_q
+        if send_q is None:
+            # connection closed: buf is dropped, as ryu's send would
+            return
+        send_q.put(buf)
+        metrics = self.principal_connection.principal.metrics
+        metrics.msgs_sent += 1
+        metrics.bytes_sent += len(buf)
+
+    def send_nowait(self,buf):
+        '''
+        Like send, but never blocks.
+
+        @returns {bool} --- True if buf was queued.  False if the
+        connection is closed or its send queue is full.
+        '''
+        send_q = self.send_q
+        if (send_q is None) or send_q.full():
+            return False
+        send_q.put_nowait(buf)
+        metrics = self.principal_connection.principal.metrics
+        metrics.msgs_sent += 1
+        metrics.bytes_sent += len(buf)
+        return True
+
     # Low level socket handling layer
     @_deactivate
     def _recv_loop(self):
-        buf = bytearray()
-        required_len = ofproto_common.OFP_HEADER_SIZE
+        recv_buffer = ReceiveBuffer(PRINCIPAL_RECV_BUFFER_SIZE)
 
         count = 0
         while self.is_active:
-            ret = self.socket.recv(required_len)
-            if len(ret) == 0:
+            if recv_buffer.fill(self.socket) == 0:
                 self.is_active = False
                 break
-            buf += ret
-            while len(buf) >= required_len:
-                (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
-                required_len = msg_len
-                if len(buf) < required_len:
-                    break
 
-                msg = ofproto_parser.msg(self,
-                                         version, msg_type, msg_len, xid, buf)
-                # LOG.debug('queue msg %s cls %s', msg, msg.__class__)
-                if msg:
-                    self.principal_connection.receive_principal_message(msg)
+            while True:
+                header_and_buf = recv_buffer.next_message()
+                if header_and_buf is None:
+                    break
+                (version, msg_type, msg_len, xid, buf) = header_and_buf
 
-                buf = buf[required_len:]
-                required_len = ofproto_common.OFP_HEADER_SIZE
+                # note: buf is a view into recv_buffer.  Handlers that
+                # need its bytes after returning must copy them.
+                # try to handle without building ryu objects first.
+                handled = (
+                    self.principal_connection.receive_principal_raw_message(
+                        msg_type,buf))
+                if not handled:
+                    msg = ofproto_parser.msg(
+                        self,version, msg_type, msg_len, xid, buf)
+                    # LOG.debug('queue msg %s cls %s', msg, msg.__class__)
+                    if msg:
+                        self.principal_connection.receive_principal_message(
+                            msg)
 
                 # We need to schedule other greenlets. Otherwise, ryu
                 # can't accept new switches or handle the existing
@@ -53,4 +94,3 @@ class PrincipalDatapath(Datapath):
                 if count > 2048:
                     count = 0
                     hub.sleep(0)
-
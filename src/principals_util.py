@@ -1,9 +1,71 @@
 import sets
 import json
+import math
+import time
+import zlib
 
-from conf import pluribus_logger
-from principal_connection import PrincipalConnection
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_v1_3
+
+from conf import pluribus_logger, BUFFER_ID_TIMEOUT
 from extended_v3_parser import OFPDescStatsReply as PluribusDescStatsReply
+from extended_v3_parser import OFPFlowMod as PluribusFlowMod
+
+from translation_exceptions import InvalidTableWriteException
+from translation_exceptions import InvalidGotoTableException
+from translation_exceptions import InvalidOutputAction
+from translation_exceptions import MalformedFlowModException
+from translation_exceptions import InvalidPacketInPortMatch
+from translation_exceptions import IsolationViolationException
+
+from shadow_flow_table import ShadowFlowTable
+from shadow_flow_table import produce_flow_stats_replies
+from shadow_flow_table import produce_aggregate_stats_reply
+from shadow_flow_table import ShadowFlowEntry, produce_flow_mod_add
+from wire_flow_mod import canonical_match, set_flow_mod_hard_timeout
+from wire_flow_mod import produce_error
+from wire_flow_mod import FLOW_MOD_BUFFER_ID_OFFSET
+from wire_packet_out import translate_packet_out_wire, packet_out_fields
+from wire_packet_out import get_buffer_id, set_buffer_id
+from wire_packet_out import PACKET_IN_BUFFER_ID_OFFSET
+from buffer_id_pool import BufferIdPool
+from metrics import PrincipalMetrics
+from trace_log import trace, EVENT_MESSAGE_REJECTED
+from bundle_util import OpenBundle, get_xid
+from bundle_util import parse_bundle_ctrl, parse_bundle_add
+from bundle_util import produce_bundle_ctrl, produce_bundle_error
+from bundle_util import ONF_BCT_OPEN_REQUEST, ONF_BCT_OPEN_REPLY
+from bundle_util import ONF_BCT_CLOSE_REQUEST, ONF_BCT_CLOSE_REPLY
+from bundle_util import ONF_BCT_COMMIT_REQUEST, ONF_BCT_COMMIT_REPLY
+from bundle_util import ONF_BCT_DISCARD_REQUEST, ONF_BCT_DISCARD_REPLY
+from bundle_util import ONFERR_ET_UNKNOWN, ONFERR_ET_BAD_ID
+from bundle_util import ONFERR_ET_BUNDLE_EXIST, ONFERR_ET_BUNDLE_CLOSED
+from bundle_util import ONFERR_ET_MSG_UNSUP, ONFERR_ET_FAILED
+
+# Exceptions that mean a principal's message cannot be translated.
+TRANSLATION_EXCEPTIONS = (
+    InvalidTableWriteException, InvalidGotoTableException,
+    InvalidOutputAction, MalformedFlowModException,
+    InvalidPacketInPortMatch, IsolationViolationException)
+
+# keys are TRANSLATION_EXCEPTIONS; values are the (OFPET_* type,
+# code) of the error a principal gets when its message raises them.
+TRANSLATION_ERRORS = {
+    InvalidTableWriteException: (
+        ofproto_v1_3.OFPET_FLOW_MOD_FAILED,
+        ofproto_v1_3.OFPFMFC_BAD_TABLE_ID),
+    InvalidGotoTableException: (
+        ofproto_v1_3.OFPET_BAD_INSTRUCTION,
+        ofproto_v1_3.OFPBIC_BAD_TABLE_ID),
+    InvalidOutputAction: (
+        ofproto_v1_3.OFPET_BAD_ACTION,ofproto_v1_3.OFPBAC_BAD_OUT_PORT),
+    MalformedFlowModException: (
+        ofproto_v1_3.OFPET_BAD_REQUEST,ofproto_v1_3.OFPBRC_BAD_LEN),
+    InvalidPacketInPortMatch: (
+        ofproto_v1_3.OFPET_BAD_MATCH,ofproto_v1_3.OFPBMC_BAD_VALUE),
+    IsolationViolationException: (
+        ofproto_v1_3.OFPET_FLOW_MOD_FAILED,ofproto_v1_3.OFPFMFC_OVERLAP)
+    }
 
 
 class Principal(object):
@@ -41,26 +103,117 @@ class Principal(object):
              })
         
         self.num_buffers = None
+        # maps buffer ids of packet ins to this principal's own.
+        # Replaced by set_num_buffers.
+        self.buffer_ids = BufferIdPool(0,BUFFER_ID_TIMEOUT)
+        # set by PrincipalConnectionManager once connected.
+        self.connection = None
+
+        # keys are bundle ids of bundles this principal has opened
+        # but not yet committed or discarded.  Values are OpenBundle
+        # objects.
+        self.open_bundles = {}
+        # keys are xids of commit requests for bundles sent to the
+        # switch but not yet acknowledged.  Values are the bundles'
+        # OpenBundle.flow_mods lists, to apply to the shadow flow
+        # table once the switch commits them.
+        self.committing_bundles = {}
+
+        # part of the translation cache's keys: incremented whenever
+        # this principal's table or port mappings change, so that
+        # flow mods translated under the old mappings are never
+        # reused.
+        self.translation_generation = 0
+        # set by compile_translation_plan of subclasses
+        self.translation_plan = None
+        # ports packet outs may output to, and what OFPP_FLOOD and
+        # OFPP_ALL expand to.  Set by compile_translation_plan of
+        # subclasses.
+        self.packet_out_ports = frozenset()
+
+        # every rule this principal has installed.
+        self.shadow_flow_table = ShadowFlowTable(
+            pluribus_switch.shadow_physical_index,
+            pluribus_switch.match_overlap_index,self.id)
+
+        # load this principal puts on Pluribus (@see MetricsRegistry)
+        self.metrics = PrincipalMetrics(self.id,TRANSLATION_EXCEPTIONS)
         
 
     def set_num_buffers(self, num_buffers):
         '''
         @param {int} num_buffers --- Number of buffers this principal
-        can use.
+        can use: its share of the switch's buffers.
         '''
         self.num_buffers = num_buffers
+        self.buffer_ids = BufferIdPool(num_buffers,BUFFER_ID_TIMEOUT)
                 
+    def invalidate_translations(self):
+        '''
+        Subclasses must call this whenever they change a mapping that
+        translation depends on.
+        '''
+        self.translation_generation += 1
+        self.compile_translation_plan()
+        self.shadow_flow_table.forget_translations()
+
+    def compile_translation_plan(self):
+        '''
+        Should be overridden to set self.translation_plan to a
+        TranslationPlan built from current mappings.
+        '''
+        pass
+
     def connect(self):
         '''
-        Create connection with principal.
+        Start connecting to principal.  Does not block: the
+        switch's PrincipalConnectionManager sets self.connection once
+        connected.
         '''
-        pluribus_logger.info(
-            'Connecting to principal at %s:%i' %
-            (self.listening_ip_addr,self.listening_port_addr))
-        
-        self.connection = PrincipalConnection(
-            self.listening_ip_addr,self.listening_port_addr,self)
+        self.pluribus_switch.principal_connection_manager.connect(self)
         
+    def is_connected(self):
+        '''
+        @returns {bool} --- True if we can still send messages to the
+        principal.
+        '''
+        return (
+            (self.connection is not None) and
+            self.connection.datapath.is_active)
+
+    def packet_in_routes(self):
+        '''
+        Should be overridden.
+
+        @returns {list} --- Each element is a (physical table id,
+        PacketInRoute) tuple, one for each physical table this
+        principal owns.
+        '''
+        return []
+
+    def send_packet_in(self,buf):
+        '''
+        @param {bytearray} buf --- Packet in, already translated for
+        this principal (@see PacketInDemultiplexer).
+
+        @returns {bool} --- False if buf had to be dropped because the
+        principal is not connected or is not keeping up.
+        '''
+        if not self.is_connected():
+            return False
+
+        physical_buffer_id = get_buffer_id(buf,PACKET_IN_BUFFER_ID_OFFSET)
+        virtual_buffer_id = ofproto_v1_3.OFP_NO_BUFFER
+        if physical_buffer_id != ofproto_v1_3.OFP_NO_BUFFER:
+            virtual_buffer_id = self.buffer_ids.allocate(physical_buffer_id)
+            set_buffer_id(buf,PACKET_IN_BUFFER_ID_OFFSET,virtual_buffer_id)
+
+        if self.connection.datapath.send_nowait(buf):
+            return True
+        if virtual_buffer_id != ofproto_v1_3.OFP_NO_BUFFER:
+            self.buffer_ids.release(virtual_buffer_id)
+        return False
+
     def to_json_str(self):
         '''
         @returns {string} --- A serialized representation of this
@@ -101,8 +254,554 @@ class Principal(object):
         Rewrites rules not to goto incorrect tables.
         Rewrites rules to use different ports.
         '''
+        # translation may hand back msg itself (eg., as a chained
+        # table principal's early flow mod), whose buf then gets
+        # overwritten with the translated bytes.
+        buf = str(msg.buf)
+        start = time.time()
+        try:
+            translated_bufs = [
+                self.pluribus_switch.serialize_msg(translated_msg)
+                for translated_msg in self.translate_flow_mod(msg)]
+        except TRANSLATION_EXCEPTIONS as ex:
+            self.reject(buf,ex)
+            return
+        self.metrics.translation_latency.observe(time.time() - start)
+        self.pluribus_switch.translation_cache.insert(
+            self,buf,translated_bufs)
+        if not self.isolated(buf,translated_bufs):
+            return
+        for buf_to_send in self.translate_flow_mod_buffer_id(
+            buf,translated_bufs):
+            self.send_to_switch(buf_to_send)
+        self.shadow_flow_table.apply_flow_mod(buf,translated_bufs)
+
+    def handle_raw_flow_mod(self,buf):
+        '''
+        @param {buffer} buf --- Flow mod in its wire format.  Only valid
+        until this method returns: copy before keeping it.
+
+        Fast path for flow mods that have been translated before, or
+        that can be translated by patching fixed-offset fields.
+
+        @returns {bool} --- True if handled the flow mod.  False if it
+        needs structural changes, in which case it gets fully parsed
+        and passed to handle_flow_mod instead.
+        '''
+        start = time.time()
+        translation_cache = self.pluribus_switch.translation_cache
+        translated_bufs = translation_cache.lookup(self,buf)
+        if translated_bufs is None:
+            try:
+                translated_bufs = self.translate_raw_flow_mod(buf)
+            except TRANSLATION_EXCEPTIONS as ex:
+                self.reject(buf,ex)
+                return True
+            if translated_bufs is None:
+                return False
+            translation_cache.insert(self,buf,translated_bufs)
+        self.metrics.translation_latency.observe(time.time() - start)
+        if not self.isolated(buf,translated_bufs):
+            return True
+        for buf_to_send in self.translate_flow_mod_buffer_id(
+            buf,translated_bufs):
+            self.send_to_switch(buf_to_send)
+        if len(translated_bufs) > 1:
+            # flow mod was fanned out (eg., a delete over all tables).
+            # Its parts go out in a single batch; the barrier keeps the
+            # switch from reordering anything the principal sends
+            # afterwards ahead of them.
+            self.pluribus_switch.send_barrier(_ignore_barrier_reply)
+        self.shadow_flow_table.apply_flow_mod(buf,translated_bufs)
+        return True
+
+    def isolated(self,buf,translated_bufs):
+        '''
+        @param {buffer} buf --- Flow mod from the principal.
+
+        @param {list} translated_bufs --- What buf was translated to.
+
+        @returns {bool} --- True if translated_bufs can be sent to the
+        switch.  False if they would overlap another principal's
+        rules, in which case the principal gets an OFPFMFC_OVERLAP
+        error instead.
+        '''
+        try:
+            self.pluribus_switch.match_overlap_index.check_flow_mods(
+                self.id,translated_bufs)
+        except IsolationViolationException as ex:
+            self.reject(buf,ex)
+            return False
+        return True
+
+    def reject(self,buf,ex):
+        '''
+        @param {buffer} buf --- Message from the principal that could
+        not be translated.
+
+        @param {Exception} ex --- One of TRANSLATION_EXCEPTIONS, raised
+        translating buf.
+
+        Counts and traces the reject and sends the principal the
+        error for ex (@see TRANSLATION_ERRORS).
+        '''
+        self.count_reject(buf,ex)
+        (error_type, error_code) = TRANSLATION_ERRORS[type(ex)]
+        self.connection.datapath.send(
+            produce_error(get_xid(buf),error_type,error_code,buf))
+
+    def count_reject(self,buf,ex):
+        '''
+        @see reject.  Only counts and traces.
+        '''
+        self.metrics.count_reject(ex)
+        (_, msg_type, _, xid) = ofproto_parser.header(buf)
+        trace(
+            self.id,EVENT_MESSAGE_REJECTED,xid,msg_type,
+            self.metrics.reject_indices.get(type(ex),0))
+
+    def send_to_switch(self,buf):
+        '''
+        @param {bytearray} buf --- Translated message to send to the
+        switch on this principal's behalf.
+        '''
+        self.metrics.msgs_to_switch += 1
+        self.metrics.bytes_to_switch += len(buf)
+        self.pluribus_switch.send_raw(buf)
+
+    def reinstall_rules(self):
+        '''
+        Sends the switch every rule in this principal's shadow flow
+        table, translated under its current mappings, eg., after the
+        switch reconnected (@see PluribusSwitch._resync_switch).
+        Rules whose hard timeouts ran out in the meantime get removed
+        instead; the others get reinstalled with what is left of
+        their hard timeouts.
+
+        @returns {int} --- Number of translated flow mods sent.
+        '''
+        now = time.time()
+        num_sent = 0
+        for entry in self.shadow_flow_table.entries():
+            hard_timeout = entry.hard_timeout
+            if hard_timeout != 0:
+                remaining = entry.install_time + hard_timeout - now
+                if remaining <= 0:
+                    self.shadow_flow_table.remove(entry)
+                    continue
+                hard_timeout = int(math.ceil(remaining))
+
+            buf = produce_flow_mod_add(entry,hard_timeout)
+            try:
+                translated_bufs = self._translate_flow_mod_add(buf)
+            except TRANSLATION_EXCEPTIONS as ex:
+                # mappings are unchanged, so this only happens if
+                # translation itself changed.
+                self.count_reject(buf,ex)
+                self.shadow_flow_table.remove(entry)
+                continue
+
+            for translated_buf in translated_bufs:
+                self.send_to_switch(translated_buf)
+            entry.rebase_counters()
+            num_sent += len(translated_bufs)
+        return num_sent
+
+    def checkpoint_assignment(self):
+        '''
+        @returns {list} --- Each element is a list of ints.  Together,
+        they identify this principal and the tables and ports it was
+        assigned, for checkpointing (@see checkpoint).  Subclasses
+        extend this with their assignments.
+        '''
+        # listening_ip_addr may be a host name
+        return [
+            [zlib.crc32(self.listening_ip_addr) & 0xffffffff,
+             int(self.listening_port_addr)],
+            sorted(self.physical_port_set)]
+
+    def translated_shadow_entries(self):
+        '''
+        @returns {generator} --- Of (ShadowFlowEntry, list of
+        translated flow mods) tuples, for every rule in this
+        principal's shadow flow table.  Only rules modified since they
+        were translated get translated again.  Rules that no longer
+        translate are left out.
+        '''
+        for entry in self.shadow_flow_table.entries():
+            if entry.translated_bufs is None:
+                try:
+                    entry.translated_bufs = self._translate_flow_mod_add(
+                        produce_flow_mod_add(entry,entry.hard_timeout))
+                except TRANSLATION_EXCEPTIONS:
+                    continue
+            yield entry, entry.translated_bufs
+
+    def restore_rule(self,rule,now):
+        '''
+        @param {CheckpointRule} rule --- A rule of this principal's,
+        read back from a checkpoint taken under the same assignments.
+
+        @param {float} now
+
+        Puts rule back into this principal's shadow flow table and
+        sends what it was translated to to the switch, with what is
+        left of its hard timeout.
+
+        @returns {bool} --- False if rule's hard timeout ran out.
+        '''
+        hard_timeout = rule.hard_timeout
+        if hard_timeout != 0:
+            remaining = rule.install_time + hard_timeout - now
+            if remaining <= 0:
+                return False
+            for translated_buf in rule.translated_bufs:
+                set_flow_mod_hard_timeout(
+                    translated_buf,int(math.ceil(remaining)))
+        # the packet a flow mod's buffer id referred to is long gone
+        for translated_buf in rule.translated_bufs:
+            set_buffer_id(
+                translated_buf,FLOW_MOD_BUFFER_ID_OFFSET,
+                ofproto_v1_3.OFP_NO_BUFFER)
+
+        entry = ShadowFlowEntry(
+            rule.table_id,rule.priority,canonical_match(rule.match_buf,0),
+            rule.match_buf,rule.instructions_buf,rule.cookie,
+            rule.idle_timeout,rule.hard_timeout,rule.flags)
+        entry.install_time = rule.install_time
+        entry.packet_count = rule.packet_count
+        entry.byte_count = rule.byte_count
+        entry.rebase_counters()
+        self.shadow_flow_table.insert(entry,rule.translated_bufs)
+        for translated_buf in rule.translated_bufs:
+            self.send_to_switch(translated_buf)
+        return True
+
+    def _translate_flow_mod_add(self,buf):
+        '''
+        @param {bytearray} buf --- A flow mod produced by Pluribus.
+
+        @returns {list} --- @see translate_raw_flow_mod.  Never None:
+        flow mods the fast path cannot handle get parsed and
+        translated in full.
+        '''
+        translated_bufs = self.pluribus_switch.translation_cache.lookup(
+            self,buf)
+        if translated_bufs is not None:
+            return translated_bufs
+        translated_bufs = self.translate_raw_flow_mod(buf)
+        if translated_bufs is not None:
+            return translated_bufs
+        msg = PluribusFlowMod.parser(
+            self.pluribus_switch.switch_dp,ofproto_v1_3.OFP_VERSION,
+            ofproto_v1_3.OFPT_FLOW_MOD,len(buf),0,buf)
+        return [
+            self.pluribus_switch.serialize_msg(translated_msg)
+            for translated_msg in self.translate_flow_mod(msg)]
+
+    def translate_flow_mod_buffer_id(self,buf,translated_bufs):
+        '''
+        @param {buffer} buf --- Flow mod from the principal.
+
+        @param {list} translated_bufs --- What buf was translated to.
+        Left unchanged.
+
+        @returns {list} --- What to send to the switch in place of
+        translated_bufs.  If buf has a buffer id, copies of them: the
+        first gets the physical buffer id that buf's buffer id maps
+        to, the others OFP_NO_BUFFER, since the switch can only
+        release a buffered packet once.  If buf's buffer id maps to
+        none, the principal gets an OFPBRC_BUFFER_UNKNOWN error and
+        the flow mod still gets applied, just without a buffered
+        packet, as a switch would do.
+        '''
+        virtual_buffer_id = get_buffer_id(buf,FLOW_MOD_BUFFER_ID_OFFSET)
+        if virtual_buffer_id == ofproto_v1_3.OFP_NO_BUFFER:
+            return translated_bufs
+        physical_buffer_id = self.buffer_ids.release(virtual_buffer_id)
+        if physical_buffer_id is None:
+            self._send_buffer_unknown_error(buf)
+            physical_buffer_id = ofproto_v1_3.OFP_NO_BUFFER
+
+        bufs_to_send = []
+        for translated_buf in translated_bufs:
+            buf_to_send = bytearray(translated_buf)
+            set_buffer_id(
+                buf_to_send,FLOW_MOD_BUFFER_ID_OFFSET,physical_buffer_id)
+            bufs_to_send.append(buf_to_send)
+            physical_buffer_id = ofproto_v1_3.OFP_NO_BUFFER
+        return bufs_to_send
+
+    def handle_packet_out(self,buf):
+        '''
+        @param {buffer} buf --- Packet out in its wire format.
+
+        Translates the packet out's buffer id and output ports and
+        forwards it to the switch.
+        '''
+        (virtual_buffer_id, in_port, actions_len) = packet_out_fields(buf)
+        physical_buffer_id = ofproto_v1_3.OFP_NO_BUFFER
+        if virtual_buffer_id != ofproto_v1_3.OFP_NO_BUFFER:
+            physical_buffer_id = self.buffer_ids.release(virtual_buffer_id)
+            if physical_buffer_id is None:
+                self._send_buffer_unknown_error(buf)
+                return
+
+        start = time.time()
+        try:
+            packet_out_buf = translate_packet_out_wire(
+                buf,physical_buffer_id,self.packet_out_ports)
+        except TRANSLATION_EXCEPTIONS as ex:
+            self.reject(buf,ex)
+            return
+        self.metrics.translation_latency.observe(time.time() - start)
+        self.send_to_switch(packet_out_buf)
+
+    def _send_buffer_unknown_error(self,buf):
+        self.connection.datapath.send(
+            produce_error(
+                get_xid(buf),ofproto_v1_3.OFPET_BAD_REQUEST,
+                ofproto_v1_3.OFPBRC_BUFFER_UNKNOWN,buf))
+
+    def handle_flow_stats_request(self,buf):
+        '''
+        @param {buffer} buf --- Flow stats request in its wire format.
+
+        Answered from the shadow flow table, without asking the
+        switch.
+        '''
+        entries = self.shadow_flow_table.select_for_stats_request(buf)
+        for reply in produce_flow_stats_replies(
+            get_xid(buf),entries,time.time()):
+            self.connection.datapath.send(reply)
+
+    def handle_aggregate_stats_request(self,buf):
+        '''
+        @param {buffer} buf --- Aggregate stats request in its wire
+        format.
+
+        Answered from the shadow flow table, without asking the
+        switch.
+        '''
+        entries = self.shadow_flow_table.select_for_stats_request(buf)
+        self.connection.datapath.send(
+            produce_aggregate_stats_reply(get_xid(buf),entries))
+
+    def handle_barrier_request(self,buf):
+        '''
+        @param {buffer} buf --- Barrier request in its wire format.
+
+        The switch calls send_barrier_reply once everything this
+        principal sent before the barrier has been processed.
+        '''
+        self.pluribus_switch.virtualize_barrier(self,get_xid(buf))
+
+    def send_barrier_reply(self,xid):
+        '''
+        @param {int} xid --- xid of the principal's barrier request.
+        '''
+        if not self.is_connected():
+            return
+        datapath = self.connection.datapath
+        msg = datapath.ofproto_parser.OFPBarrierReply(datapath)
+        msg.xid = xid
+        datapath.send_msg(msg)
+
+    def handle_bundle_ctrl(self,buf):
+        '''
+        @param {buffer} buf --- An ONF bundle control message.
+
+        Opens, closes, commits and discards this principal's bundles.
+        Committed bundles get submitted to the switch as a single
+        bundle of translated messages (@see
+        PluribusSwitch.commit_bundle).  Replies to the commit are sent
+        from bundle_committed or bundle_failed.
+        '''
+        (bundle_id, ctrl_type, flags) = parse_bundle_ctrl(buf)
+        xid = get_xid(buf)
+
+        if ctrl_type == ONF_BCT_OPEN_REQUEST:
+            if bundle_id in self.open_bundles:
+                self._send_bundle_error(xid,ONFERR_ET_BUNDLE_EXIST,buf)
+                return
+            self.open_bundles[bundle_id] = OpenBundle(flags)
+            self._send_bundle_ctrl(xid,bundle_id,ONF_BCT_OPEN_REPLY,flags)
+
+        elif ctrl_type == ONF_BCT_CLOSE_REQUEST:
+            bundle = self.open_bundles.get(bundle_id,None)
+            if bundle is None:
+                self._send_bundle_error(xid,ONFERR_ET_BAD_ID,buf)
+            elif bundle.closed:
+                self._send_bundle_error(xid,ONFERR_ET_BUNDLE_CLOSED,buf)
+            else:
+                bundle.closed = True
+                self._send_bundle_ctrl(
+                    xid,bundle_id,ONF_BCT_CLOSE_REPLY,flags)
+
+        elif ctrl_type == ONF_BCT_COMMIT_REQUEST:
+            bundle = self.open_bundles.pop(bundle_id,None)
+            if bundle is None:
+                self._send_bundle_error(xid,ONFERR_ET_BAD_ID,buf)
+            elif bundle.failed:
+                # at least one message could not be translated.
+                # Nothing in the bundle gets applied.
+                self._send_bundle_error(xid,ONFERR_ET_FAILED,buf)
+            else:
+                # buffer ids only get used up by bundles that get
+                # committed.
+                bufs_to_send = []
+                for flow_mod_buf, translated_bufs in bundle.flow_mods:
+                    bufs_to_send.extend(
+                        self.translate_flow_mod_buffer_id(
+                            flow_mod_buf,translated_bufs))
+                self.committing_bundles[xid] = bundle.flow_mods
+                self.metrics.msgs_to_switch += len(bufs_to_send)
+                self.metrics.bytes_to_switch += sum(
+                    len(buf_to_send) for buf_to_send in bufs_to_send)
+                self.pluribus_switch.commit_bundle(
+                    self,xid,bundle_id,bundle.flags,bufs_to_send)
+
+        elif ctrl_type == ONF_BCT_DISCARD_REQUEST:
+            if self.open_bundles.pop(bundle_id,None) is None:
+                self._send_bundle_error(xid,ONFERR_ET_BAD_ID,buf)
+            else:
+                self._send_bundle_ctrl(
+                    xid,bundle_id,ONF_BCT_DISCARD_REPLY,flags)
+
+        else:
+            self._send_bundle_error(xid,ONFERR_ET_UNKNOWN,buf)
+
+    def handle_bundle_add(self,buf):
+        '''
+        @param {buffer} buf --- An ONF bundle add message.
+
+        Translates the bundled message right away and holds on to the
+        translated bytes until the bundle is committed or discarded.
+        Its buffer id, if any, only gets mapped on committing.
+        '''
+        (bundle_id, flags, inner_msg) = parse_bundle_add(buf)
+        xid = get_xid(buf)
+
+        bundle = self.open_bundles.get(bundle_id,None)
+        if bundle is None:
+            # adding to a bundle that does not exist implicitly opens
+            # it.
+            bundle = OpenBundle(flags)
+            self.open_bundles[bundle_id] = bundle
+        elif bundle.closed:
+            self._send_bundle_error(xid,ONFERR_ET_BUNDLE_CLOSED,buf)
+            return
+
+        (_, inner_msg_type, _, _) = ofproto_parser.header(inner_msg)
+        if inner_msg_type != ofproto_v1_3.OFPT_FLOW_MOD:
+            self._send_bundle_error(xid,ONFERR_ET_MSG_UNSUP,buf)
+            return
+
+        start = time.time()
+        try:
+            translated_bufs = self.translate_flow_mod_to_bufs(inner_msg)
+        except TRANSLATION_EXCEPTIONS as ex:
+            # the error goes out when the bundle gets committed
+            self.count_reject(inner_msg,ex)
+            bundle.failed = True
+            return
+        self.metrics.translation_latency.observe(time.time() - start)
+        bundle.flow_mods.append((str(inner_msg),translated_bufs))
+
+    def bundle_committed(self,bundle_id,commit_xid,flags):
+        '''
+        Called by the switch once every message in a bundle this
+        principal committed has been applied.
+        '''
+        for flow_mod_buf, translated_bufs in self.committing_bundles.pop(
+            commit_xid,[]):
+            self.shadow_flow_table.apply_flow_mod(
+                flow_mod_buf,translated_bufs)
+        self._send_bundle_ctrl(
+            commit_xid,bundle_id,ONF_BCT_COMMIT_REPLY,flags)
+
+    def bundle_failed(self,bundle_id,commit_xid,flags):
+        '''
+        Called by the switch if it rejected a bundle this principal
+        committed.
+        '''
+        self.committing_bundles.pop(commit_xid,None)
+        commit_request = produce_bundle_ctrl(
+            commit_xid,bundle_id,ONF_BCT_COMMIT_REQUEST,flags)
+        self._send_bundle_error(commit_xid,ONFERR_ET_FAILED,commit_request)
+
+    def _send_bundle_ctrl(self,xid,bundle_id,ctrl_type,flags):
+        self.connection.datapath.send(
+            produce_bundle_ctrl(xid,bundle_id,ctrl_type,flags))
+
+    def _send_bundle_error(self,xid,error_code,offending_msg):
+        self.connection.datapath.send(
+            produce_bundle_error(xid,error_code,offending_msg))
+
+    #### Translation of requests from principal to switch
+    def translate_flow_mod(self,msg):
+        '''
+        @param {extended_v3_parser.OFPFlowMod} msg
+
+        @returns {list} --- Each element is an
+        extended_v3_parser.OFPFlowMod that should be sent to the
+        switch in place of msg.
+        '''
         # should be overridden
         assert False
+
+    def translate_raw_flow_mod(self,buf):
+        '''
+        @param {buffer} buf --- Flow mod in its wire format.  Only valid
+        until this method returns.
+
+        @returns {list or None} --- None if the flow mod needs
+        structural changes and must go through translate_flow_mod
+        instead.  Otherwise, each element is a bytearray holding a
+        serialized message to send to the switch in place of buf.
+        '''
+        return None
+
+    def translate_flow_mod_to_bufs(self,buf):
+        '''
+        @param {buffer} buf --- Flow mod in its wire format.
+
+        Uses the translation cache or the fast path if possible, and
+        parses the flow mod and translates it through
+        translate_flow_mod if not.
+
+        @returns {list} --- Each element is a bytearray holding a
+        serialized message to send to the switch in place of buf.
+
+        @throws {IsolationViolationException} --- If the translated
+        messages would overlap another principal's rules.
+        '''
+        translation_cache = self.pluribus_switch.translation_cache
+        translated_bufs = translation_cache.lookup(self,buf)
+        if translated_bufs is None:
+            translated_bufs = self._translate_flow_mod_to_bufs(buf)
+            translation_cache.insert(self,buf,translated_bufs)
+        self.pluribus_switch.match_overlap_index.check_flow_mods(
+            self.id,translated_bufs)
+        return translated_bufs
+
+    def _translate_flow_mod_to_bufs(self,buf):
+        translated_bufs = self.translate_raw_flow_mod(buf)
+        if translated_bufs is not None:
+            return translated_bufs
+
+        (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
+        msg = ofproto_parser.msg(
+            self.connection.datapath,version,msg_type,msg_len,xid,buf)
+        if msg is None:
+            raise MalformedFlowModException()
+
+        translated_bufs = []
+        for translated_msg in self.translate_flow_mod(msg):
+            translated_msg.serialize()
+            translated_bufs.append(translated_msg.buf)
+        return translated_bufs
+
         
 def save_principals_to_json_file(principal_list,filename):
     '''
@@ -117,6 +816,9 @@ def save_principals_to_json_file(principal_list,filename):
         fd.write(output_str)
     
 
+def _ignore_barrier_reply():
+    pass
+
 def load_principals_from_json_file(cls,filename,pluribus_switch):
     '''
     @param {string} filename
@@ -0,0 +1,184 @@
+'''
+Opt-in sampling profiler for a running Pluribus, attributed to
+principals and message types.
+
+While off, the profiler installs nothing on the hot paths: the only
+cost is a signal handler waiting for the signal that turns it on.
+While on (for a bounded window), a SIGPROF interval timer interrupts
+the process every PROFILE_INTERVAL seconds of CPU time, and the
+interrupted stack gets recorded.  Stacks are attributed by walking up
+to the frame of the entry point that was handling a message:
+
+   * principal entry points (eg., PrincipalConnection's dispatch
+     methods) have the principal and message type in their locals.
+
+   * switch entry points (ryu event handlers) have the event, whose
+     msg is the switch's message.
+
+Everything else is attributed to 'other'.  When the window closes,
+samples get written in the collapsed format that flame graph tools
+(eg., flamegraph.pl, speedscope) read: one line per distinct stack,
+
+    principal_1;FLOW_MOD;module:function;module:function 42
+
+Since eventlet runs everything on one OS thread, the interrupted
+stack is always the greenlet doing the work.
+'''
+import os
+import signal
+import time
+
+from conf import pluribus_logger
+from metrics import MSG_TYPE_NAMES
+
+
+OTHER_CONTEXT = 'other'
+
+
+class SamplingProfiler(object):
+
+    def __init__(self,interval,window,output_dir,
+                 principal_entries,switch_entries):
+        '''
+        @param {float} interval --- Seconds of CPU time between
+        samples.
+
+        @param {float} window --- Seconds a profile runs for once
+        started, unless stopped before.
+
+        @param {str} output_dir --- Directory to write collapsed
+        stacks to.
+
+        @param {list} principal_entries --- Functions or methods that
+        handle a single message from a principal.  Their frames must
+        have self (with a principal field) and either msg_type or msg
+        locals.
+
+        @param {list} switch_entries --- Functions or methods that
+        handle a single event from the switch.  Their frames must have
+        an ev local.
+        '''
+        self.interval = interval
+        self.window = window
+        self.output_dir = output_dir
+        self.principal_entry_codes = set(
+            _func_code(entry) for entry in principal_entries)
+        self.switch_entry_codes = set(
+            _func_code(entry) for entry in switch_entries)
+
+        self.running = False
+        self.start_time = None
+        # keys are collapsed stack strings; values are number of
+        # samples with that stack.
+        self.samples = {}
+
+    def install_signal(self,signal_name):
+        '''
+        Each time the process receives signal_name (eg., 'SIGUSR2'), a
+        profile starts if none is running or the running profile
+        stops early.  Must be called from the main thread.
+        '''
+        signum = getattr(signal,signal_name)
+        signal.signal(signum,self._toggle_handler)
+        signal.siginterrupt(signum,False)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.start_time = time.time()
+        self.samples = {}
+        signal.signal(signal.SIGPROF,self._sample_handler)
+        signal.signal(signal.SIGALRM,self._window_handler)
+        # python 2's signal.signal makes them interrupt system calls:
+        # blocking reads, writes and fsyncs would fail with EINTR.
+        signal.siginterrupt(signal.SIGPROF,False)
+        signal.siginterrupt(signal.SIGALRM,False)
+        signal.setitimer(signal.ITIMER_PROF,self.interval,self.interval)
+        # the window is in wall time: closes even if the process is
+        # idle, so that no SIGPROFs arrive.
+        signal.setitimer(signal.ITIMER_REAL,self.window)
+        pluribus_logger.warning(
+            'Profiling for %.1fs, sampling every %.4fs' %
+            (self.window,self.interval))
+
+    def stop(self):
+        '''
+        @returns {str or None} --- Filename collapsed stacks got
+        written to.  None if not running.
+        '''
+        if not self.running:
+            return None
+        signal.setitimer(signal.ITIMER_PROF,0)
+        signal.setitimer(signal.ITIMER_REAL,0)
+        signal.signal(signal.SIGPROF,signal.SIG_IGN)
+        self.running = False
+
+        filename = os.path.join(
+            self.output_dir,
+            'pluribus-profile-%i.folded' % int(self.start_time))
+        with open(filename,'w') as fd:
+            fd.write(self.render_collapsed())
+        pluribus_logger.warning(
+            'Wrote %i profile samples to %s' %
+            (sum(self.samples.values()),filename))
+        return filename
+
+    def render_collapsed(self):
+        lines = [
+            '%s %i' % (stack,count)
+            for stack, count in sorted(self.samples.items())]
+        lines.append('')
+        return '\n'.join(lines)
+
+    def _toggle_handler(self,signum,frame):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _window_handler(self,signum,frame):
+        self.stop()
+
+    def _sample_handler(self,signum,frame):
+        context = [OTHER_CONTEXT]
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code in self.principal_entry_codes:
+                context = _principal_context(frame)
+            elif code in self.switch_entry_codes:
+                context = _switch_context(frame)
+            names.append(
+                '%s:%s' % (
+                    os.path.basename(code.co_filename),code.co_name))
+            frame = frame.f_back
+        names.reverse()
+        stack = ';'.join(context + names)
+        self.samples[stack] = self.samples.get(stack,0) + 1
+
+
+def _func_code(entry):
+    return getattr(entry,'im_func',entry).func_code
+
+def _msg_type_name(msg_type):
+    return MSG_TYPE_NAMES.get(msg_type,str(msg_type))
+
+def _principal_context(frame):
+    '''
+    @returns {list} --- Principal and message type labels of the
+    message frame's entry point was handling.
+    '''
+    local_vars = frame.f_locals
+    principal = local_vars['self'].principal
+    msg_type = local_vars.get('msg_type')
+    if msg_type is None:
+        msg_type = local_vars['msg'].msg_type
+    return ['principal_%i' % principal.id,_msg_type_name(msg_type)]
+
+def _switch_context(frame):
+    msg = getattr(frame.f_locals.get('ev'),'msg',None)
+    msg_type = getattr(msg,'msg_type',None)
+    if msg_type is None:
+        return ['switch']
+    return ['switch',_msg_type_name(msg_type)]
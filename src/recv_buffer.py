@@ -0,0 +1,125 @@
+import struct
+
+from ryu.ofproto import ofproto_common
+
+
+# OpenFlow's length field is 16 bits, so no single message can ever
+# be larger than this.  Receive buffers are always at least this
+# large so that a message never has to be reassembled in a second
+# buffer.
+MAX_OFP_MESSAGE_SIZE = 0xffff
+
+
+class ReceiveBuffer(object):
+    '''
+    A reusable, fixed-size receive buffer for an OpenFlow byte
+    stream.
+
+    Reads large chunks from the socket with recv_into (no per-read
+    allocation) and hands out complete messages as read-only views
+    into the buffer (no per-message copy).  Bytes are only moved when
+    a partial message sits at the end of the buffer and there is not
+    enough free space behind it to finish reading that message.
+
+    Note: views handed out by next_message are only valid until the
+    next call to fill.  Anything that needs a message's bytes after
+    that must copy them.
+    '''
+
+    def __init__(self,size):
+        '''
+        @param {int} size --- Number of bytes to allocate.  Rounded up
+        to MAX_OFP_MESSAGE_SIZE if smaller.
+        '''
+        size = max(size,MAX_OFP_MESSAGE_SIZE)
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # bytes in [read_offset,write_offset) have been received, but
+        # not yet handed out as messages.
+        self.read_offset = 0
+        self.write_offset = 0
+
+        # number of times we had to shift a partial message to the
+        # front of the buffer.
+        self.num_compactions = 0
+
+    def fill(self,sock):
+        '''
+        @param {socket} sock
+
+        Reads as many bytes as are available from sock (up to the
+        free space in the buffer).
+
+        @returns {int} --- Number of bytes read.  0 means that the
+        other side closed the connection.
+        '''
+        if self.read_offset == self.write_offset:
+            # everything has been consumed: start at the front again
+            # without having to copy anything.
+            self.read_offset = 0
+            self.write_offset = 0
+        elif self._needs_compaction():
+            self._compact()
+
+        num_read = sock.recv_into(self.view[self.write_offset:])
+        self.write_offset += num_read
+        return num_read
+
+    def next_message(self):
+        '''
+        @returns {tuple or None} --- None if a full message is not yet
+        in the buffer.  Otherwise, (version, msg_type, msg_len, xid,
+        msg_buf), where msg_buf is a read-only buffer object over the
+        message's bytes.
+        '''
+        available = self.write_offset - self.read_offset
+        if available < ofproto_common.OFP_HEADER_SIZE:
+            return None
+
+        (version, msg_type, msg_len, xid) = struct.unpack_from(
+            ofproto_common.OFP_HEADER_PACK_STR,self.buf,self.read_offset)
+
+        if msg_len < ofproto_common.OFP_HEADER_SIZE:
+            raise MalformedMessageException(
+                'Message length %i shorter than header' % msg_len)
+
+        if available < msg_len:
+            return None
+
+        # ryu's parsers wrap whatever they get with buffer(), which
+        # accepts buffer objects, but not memoryviews.  buffer objects
+        # share memory with self.buf, so this is still zero-copy.
+        msg_buf = buffer(self.buf,self.read_offset,msg_len)
+        self.read_offset += msg_len
+        return version, msg_type, msg_len, xid, msg_buf
+
+    def _needs_compaction(self):
+        '''
+        Only worth moving the pending partial message when there's no
+        room to finish reading it in place.
+        '''
+        pending = self.write_offset - self.read_offset
+        required_len = ofproto_common.OFP_HEADER_SIZE
+        if pending >= ofproto_common.OFP_HEADER_SIZE:
+            (_, _, required_len, _) = struct.unpack_from(
+                ofproto_common.OFP_HEADER_PACK_STR,self.buf,self.read_offset)
+        return self.read_offset + required_len > len(self.buf)
+
+    def _compact(self):
+        '''
+        Moves the unconsumed bytes at the end of the buffer to its
+        front.
+        '''
+        pending = self.write_offset - self.read_offset
+        # slicing copies the partial message first, so the overlapping
+        # source and destination ranges are safe.
+        self.buf[0:pending] = self.buf[self.read_offset:self.write_offset]
+        self.read_offset = 0
+        self.write_offset = pending
+        self.num_compactions += 1
+
+
+class MalformedMessageException(Exception):
+    '''
+    Peer sent bytes that cannot be framed as an OpenFlow message.
+    '''
@@ -0,0 +1,575 @@
+'''
+Pluribus's record of the rules each principal has installed, in the
+principal's own (virtual) terms.
+
+Every flow mod a principal sends is applied to its ShadowFlowTable
+as it is forwarded to the switch.  Flow stats and aggregate stats
+requests are then answered from the shadow table without a round
+trip to the switch.  Packet and byte counters come from periodic
+bulk flow stats polls of the whole switch (@see
+PluribusSwitch.send_flow_stats_poll): each shadow entry remembers the
+(physical table, priority, canonical match) of the switch rule it
+was translated to, so that a poll's results can be routed back to
+the entries in O(1) each.
+'''
+import binascii
+import struct
+import time
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from recv_buffer import MAX_OFP_MESSAGE_SIZE
+from wire_flow_mod import FLOW_MOD_MATCH_OFFSET
+from wire_flow_mod import flow_mod_fields, flow_mod_instructions_offset
+from wire_flow_mod import canonical_match
+from wire_flow_mod import instructions_outputs
+
+
+# not defined by ryu's ofproto_v1_3
+OFPFF_RESET_COUNTS = 1 << 2
+
+# offsets from the start of a flow stats or aggregate stats request
+STATS_REQUEST_BODY_OFFSET = ofproto.OFP_MULTIPART_REQUEST_SIZE
+STATS_REQUEST_MATCH_OFFSET = (
+    STATS_REQUEST_BODY_OFFSET + struct.calcsize(
+        ofproto.OFP_FLOW_STATS_REQUEST_0_PACK_STR))
+
+# offsets from the start of an ofp_flow_stats
+FLOW_STATS_MATCH_OFFSET = ofproto.OFP_FLOW_STATS_0_SIZE
+
+_MULTIPART_TYPE_OFFSET = ofproto.OFP_HEADER_SIZE
+_MULTIPART_TYPE_PACK_STR = '!H'
+_OXM_HEADER_PACK_STR = '!I'
+
+
+class ShadowFlowEntry(object):
+    '''
+    A single rule, as the principal sees it.
+    '''
+    def __init__(self,table_id,priority,match_key,match_buf,
+                 instructions_buf,cookie,idle_timeout,hard_timeout,flags):
+        '''
+        @param {int} table_id --- Virtual table id.
+
+        @param {tuple} match_key --- @see canonical_match.
+
+        @param {str} match_buf --- The match as the principal sent it,
+        including padding.
+
+        @param {str} instructions_buf --- The instructions as the
+        principal sent them.
+        '''
+        self.table_id = table_id
+        self.priority = priority
+        self.match_key = match_key
+        self.match_values = match_values_from_key(match_key)
+        self.match_buf = match_buf
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.flags = flags
+        self.set_instructions(instructions_buf)
+
+        self.install_time = time.time()
+        # last values polled from the switch, plus the base counts
+        # below
+        self.packet_count = 0
+        self.byte_count = 0
+        # counts from before the switch's rule was last reinstalled
+        # (@see rebase_counters)
+        self.base_packet_count = 0
+        self.base_byte_count = 0
+
+        # (physical table id, priority, canonical match) of the switch
+        # rule whose counters this entry reports.  None if unknown.
+        self.physical_key = None
+        # physical keys of every switch rule installed for this entry
+        # (more than one if the rule was fanned out over tables).
+        self.installed_keys = ()
+        # what this entry was translated to (not to be modified), so
+        # that checkpoints need not translate it again.  None if
+        # unknown, eg., because the entry was modified since.
+        self.translated_bufs = None
+
+    def set_instructions(self,instructions_buf):
+        self.instructions_buf = instructions_buf
+        (self.output_ports, self.output_groups) = (
+            instructions_outputs(instructions_buf,0))
+
+    def reset_counters(self):
+        self.packet_count = 0
+        self.byte_count = 0
+        self.base_packet_count = 0
+        self.base_byte_count = 0
+
+    def rebase_counters(self):
+        '''
+        Called when the switch's rule gets reinstalled, and so its
+        counters restart from 0: keeps this entry's counters
+        monotonic.
+        '''
+        self.base_packet_count = self.packet_count
+        self.base_byte_count = self.byte_count
+
+    def set_polled_counters(self,packet_count,byte_count):
+        '''
+        @param {int} packet_count --- As polled from the switch's
+        rule.
+        '''
+        self.packet_count = self.base_packet_count + packet_count
+        self.byte_count = self.base_byte_count + byte_count
+
+
+class ShadowFlowTable(object):
+    '''
+    All rules one principal has installed, indexed by virtual table
+    id and then by (priority, canonical match).
+    '''
+
+    def __init__(self,physical_index,overlap_index,principal_id):
+        '''
+        @param {dict} physical_index --- Shared by the shadow tables of
+        all principals on a switch.  Keys are physical keys (@see
+        physical_flow_mod_key); values are ShadowFlowEntry objects.
+
+        @param {MatchOverlapIndex} overlap_index --- Also shared by all
+        principals on a switch.  Kept up to date with the switch rules
+        of every entry added and removed.
+
+        @param {int} principal_id --- Owner of this table's entries.
+        '''
+        self.physical_index = physical_index
+        self.overlap_index = overlap_index
+        self.principal_id = principal_id
+        # keys are virtual table ids; values are dicts, whose keys are
+        # (priority, canonical match) tuples and values are
+        # ShadowFlowEntry objects.
+        self.tables = {}
+        self.num_entries = 0
+        # incremented on every change, so that checkpoints can tell
+        # if there is anything new to write.
+        self.num_changes = 0
+
+    def lookup(self,table_id,priority,match_key):
+        '''
+        @returns {ShadowFlowEntry or None}
+        '''
+        table = self.tables.get(table_id,None)
+        if table is None:
+            return None
+        return table.get((priority,match_key),None)
+
+    def apply_flow_mod(self,buf,translated_bufs):
+        '''
+        @param {buffer} buf --- A flow mod from the principal, in its
+        wire format, that has been translated and sent to the switch.
+
+        @param {list} translated_bufs --- What buf was translated to.
+        New entries report the counters of the rule in the first
+        element.
+        '''
+        (cookie, cookie_mask, table_id, command, idle_timeout,
+         hard_timeout, priority, buffer_id, out_port, out_group,
+         flags) = flow_mod_fields(buf)
+        match_key = canonical_match(buf,FLOW_MOD_MATCH_OFFSET)
+        self.num_changes += 1
+
+        if command == ofproto.OFPFC_ADD:
+            instructions_offset = flow_mod_instructions_offset(buf)
+            entry = ShadowFlowEntry(
+                table_id,priority,match_key,
+                str(buf[FLOW_MOD_MATCH_OFFSET:instructions_offset]),
+                str(buf[instructions_offset:]),
+                cookie,idle_timeout,hard_timeout,flags)
+            self.insert(entry,translated_bufs)
+
+        elif command == ofproto.OFPFC_MODIFY:
+            instructions_buf = str(buf[flow_mod_instructions_offset(buf):])
+            for entry in self.select(
+                table_id,match_values_from_key(match_key),cookie,cookie_mask,
+                ofproto.OFPP_ANY,ofproto.OFPG_ANY):
+                _modify(entry,instructions_buf,flags)
+
+        elif command == ofproto.OFPFC_MODIFY_STRICT:
+            entry = self.lookup(table_id,priority,match_key)
+            if ((entry is not None) and
+                _cookie_selected(entry,cookie,cookie_mask)):
+                _modify(
+                    entry,str(buf[flow_mod_instructions_offset(buf):]),flags)
+
+        elif command == ofproto.OFPFC_DELETE:
+            # select is a generator over the tables: collect before
+            # removing anything.
+            to_delete = list(
+                self.select(
+                    table_id,match_values_from_key(match_key),cookie,
+                    cookie_mask,out_port,out_group))
+            for entry in to_delete:
+                self.remove(entry)
+
+        elif command == ofproto.OFPFC_DELETE_STRICT:
+            to_delete = []
+            for table in self._tables_for(table_id):
+                entry = table.get((priority,match_key),None)
+                if ((entry is not None) and
+                    _entry_selected(
+                        entry,{},cookie,cookie_mask,out_port,out_group)):
+                    to_delete.append(entry)
+            for entry in to_delete:
+                self.remove(entry)
+
+    def insert(self,entry,translated_bufs):
+        '''
+        @param {ShadowFlowEntry} entry --- Replaces any entry with the
+        same table, priority and match.
+
+        @param {list} translated_bufs --- What entry was translated
+        to.  entry reports the counters of the rule in the first
+        element.
+        '''
+        if translated_bufs:
+            entry.installed_keys = tuple(
+                physical_flow_mod_key(translated_buf)
+                for translated_buf in translated_bufs)
+            entry.physical_key = entry.installed_keys[0]
+            entry.translated_bufs = translated_bufs
+        self._add(entry)
+
+    def forget_translations(self):
+        '''
+        Called when the principal's mappings change: what its entries
+        were translated to no longer holds.
+        '''
+        for table in self.tables.itervalues():
+            for entry in table.itervalues():
+                entry.translated_bufs = None
+
+    def select(self,table_id,match_values,cookie,cookie_mask,out_port,
+               out_group):
+        '''
+        Non-strict selection, as used by non-strict modifies and
+        deletes and by stats requests.
+
+        @param {int} table_id --- Virtual table id or OFPTT_ALL.
+
+        @param {dict} match_values --- @see match_values_from_key.  An
+        entry is selected if its match is at least as specific as
+        this.
+
+        @param {int} out_port --- OFPP_ANY or only select entries that
+        output to this port.
+
+        @param {int} out_group --- OFPG_ANY or only select entries that
+        output to this group.
+
+        @returns {generator} --- Of ShadowFlowEntry objects.
+        '''
+        for table in self._tables_for(table_id):
+            for entry in table.itervalues():
+                if _entry_selected(
+                    entry,match_values,cookie,cookie_mask,out_port,
+                    out_group):
+                    yield entry
+
+    def select_for_stats_request(self,buf):
+        '''
+        @param {buffer} buf --- A flow stats or aggregate stats
+        request; their bodies have the same layout.
+
+        @returns {list} --- Each element is a ShadowFlowEntry selected
+        by the request.
+        '''
+        (table_id, out_port, out_group, cookie, cookie_mask) = (
+            struct.unpack_from(
+                ofproto.OFP_FLOW_STATS_REQUEST_0_PACK_STR,buf,
+                STATS_REQUEST_BODY_OFFSET))
+        match_values = match_values_from_key(
+            canonical_match(buf,STATS_REQUEST_MATCH_OFFSET))
+        return list(
+            self.select(
+                table_id,match_values,cookie,cookie_mask,out_port,
+                out_group))
+
+    def entries(self):
+        '''
+        @returns {list} --- Every ShadowFlowEntry in this table.
+        '''
+        return [
+            entry for table in self.tables.itervalues()
+            for entry in table.itervalues()]
+
+    def remove(self,entry):
+        self.num_changes += 1
+        table = self.tables[entry.table_id]
+        del table[(entry.priority,entry.match_key)]
+        if not table:
+            del self.tables[entry.table_id]
+        self.num_entries -= 1
+        if ((entry.physical_key is not None) and
+            (self.physical_index.get(entry.physical_key,None) is entry)):
+            del self.physical_index[entry.physical_key]
+        for physical_key in entry.installed_keys:
+            self.overlap_index.remove(physical_key)
+
+    def remove_stale_entries(self,polled_entries,poll_time):
+        '''
+        Removes entries that the switch no longer has (eg., because
+        they timed out, or because the switch rejected them).
+
+        @param {set} polled_entries --- Entries the switch reported in
+        a poll of all its rules.
+
+        @param {float} poll_time --- When the poll was sent.  Entries
+        installed after that could not have been in its results.
+
+        @returns {int} --- Number of entries removed.
+        '''
+        stale = []
+        for table in self.tables.itervalues():
+            for entry in table.itervalues():
+                if ((entry.install_time < poll_time) and
+                    (entry.physical_key is not None) and
+                    (entry not in polled_entries)):
+                    stale.append(entry)
+        for entry in stale:
+            self.remove(entry)
+        return len(stale)
+
+    def _add(self,entry):
+        table = self.tables.setdefault(entry.table_id,{})
+        key = (entry.priority,entry.match_key)
+        replaced = table.get(key,None)
+        if replaced is not None:
+            # an identical rule gets replaced.  Unless asked to reset
+            # them, counters carry over.
+            if not (entry.flags & OFPFF_RESET_COUNTS):
+                entry.packet_count = replaced.packet_count
+                entry.byte_count = replaced.byte_count
+                entry.base_packet_count = replaced.base_packet_count
+                entry.base_byte_count = replaced.base_byte_count
+            self.remove(replaced)
+            table = self.tables.setdefault(entry.table_id,{})
+
+        table[key] = entry
+        self.num_entries += 1
+        if entry.physical_key is not None:
+            self.physical_index[entry.physical_key] = entry
+        for physical_key in entry.installed_keys:
+            self.overlap_index.insert(self.principal_id,physical_key)
+
+    def _tables_for(self,table_id):
+        '''
+        @returns {list} --- Each element is a dict of entries in
+        table_id, or of every table if table_id is OFPTT_ALL.
+        '''
+        if table_id == ofproto.OFPTT_ALL:
+            return self.tables.values()
+        table = self.tables.get(table_id,None)
+        if table is None:
+            return []
+        return [table]
+
+
+def _modify(entry,instructions_buf,flags):
+    '''
+    Modifies only replace instructions: cookies, timeouts and flags
+    stay as they were.
+    '''
+    entry.set_instructions(instructions_buf)
+    entry.translated_bufs = None
+    if flags & OFPFF_RESET_COUNTS:
+        entry.reset_counters()
+
+def _cookie_selected(entry,cookie,cookie_mask):
+    return (entry.cookie & cookie_mask) == (cookie & cookie_mask)
+
+def _entry_selected(entry,match_values,cookie,cookie_mask,out_port,
+                    out_group):
+    if not _cookie_selected(entry,cookie,cookie_mask):
+        return False
+    if ((out_port != ofproto.OFPP_ANY) and
+        (out_port not in entry.output_ports)):
+        return False
+    if ((out_group != ofproto.OFPG_ANY) and
+        (out_group not in entry.output_groups)):
+        return False
+    return match_covers(match_values,entry.match_values)
+
+def match_values_from_key(match_key):
+    '''
+    @param {tuple} match_key --- @see canonical_match.
+
+    @returns {dict} --- Keys are OXM field ids (class and field,
+    without the hasmask bit).  Values are (value, mask) tuples of
+    ints, where mask has all bits set for unmasked fields.
+    '''
+    match_values = {}
+    for oxm_tlv in match_key:
+        (oxm_header,) = struct.unpack_from(_OXM_HEADER_PACK_STR,oxm_tlv,0)
+        payload = oxm_tlv[4:]
+        if oxm_header & 0x100:
+            value_len = len(payload) / 2
+            value = _to_int(payload[:value_len])
+            mask = _to_int(payload[value_len:])
+        else:
+            value = _to_int(payload)
+            mask = (1 << (8*len(payload))) - 1
+        match_values[oxm_header >> 9] = (value & mask, mask)
+    return match_values
+
+def match_covers(match_values,entry_match_values):
+    '''
+    @returns {bool} --- True if every packet entry_match_values matches
+    is also matched by match_values (ie., the entry's match is at
+    least as specific).
+    '''
+    for field_id, (value, mask) in match_values.iteritems():
+        entry_value_and_mask = entry_match_values.get(field_id,None)
+        if entry_value_and_mask is None:
+            return False
+        (entry_value, entry_mask) = entry_value_and_mask
+        if (entry_mask & mask) != mask:
+            return False
+        if (entry_value & mask) != value:
+            return False
+    return True
+
+def _to_int(byte_str):
+    if not byte_str:
+        return 0
+    return int(binascii.hexlify(byte_str),16)
+
+def physical_flow_mod_key(buf):
+    '''
+    @param {bytearray or str} buf --- A translated flow mod, as sent
+    to the switch.
+
+    @returns {tuple} --- (physical table id, priority, canonical
+    match).
+    '''
+    (cookie, cookie_mask, table_id, command, idle_timeout,
+     hard_timeout, priority, buffer_id, out_port, out_group,
+     flags) = flow_mod_fields(buf)
+    return (table_id,priority,canonical_match(buf,FLOW_MOD_MATCH_OFFSET))
+
+def stats_request_type(buf):
+    '''
+    @param {buffer} buf --- An OFPT_MULTIPART_REQUEST.
+
+    @returns {int} --- OFPMP_* type of the request.
+    '''
+    (multipart_type,) = struct.unpack_from(
+        _MULTIPART_TYPE_PACK_STR,buf,_MULTIPART_TYPE_OFFSET)
+    return multipart_type
+
+def iter_flow_stats(buf):
+    '''
+    @param {buffer} buf --- A flow stats reply from the switch.
+
+    @returns {generator} --- Of (physical key, packet_count,
+    byte_count) tuples, one per rule in the reply.
+    '''
+    offset = ofproto.OFP_MULTIPART_REPLY_SIZE
+    msg_len = len(buf)
+    while offset + FLOW_STATS_MATCH_OFFSET + 4 <= msg_len:
+        (stats_len, table_id, duration_sec, duration_nsec, priority,
+         idle_timeout, hard_timeout, flags, cookie, packet_count,
+         byte_count) = struct.unpack_from(
+            ofproto.OFP_FLOW_STATS_0_PACK_STR,buf,offset)
+        if stats_len < FLOW_STATS_MATCH_OFFSET + 4:
+            break
+        match_key = canonical_match(buf,offset + FLOW_STATS_MATCH_OFFSET)
+        yield (table_id,priority,match_key), packet_count, byte_count
+        offset += stats_len
+
+def produce_flow_mod_add(entry,hard_timeout):
+    '''
+    @param {ShadowFlowEntry} entry
+
+    @param {int} hard_timeout --- Used in place of entry's.
+
+    @returns {bytearray} --- An OFPFC_ADD, in the principal's own
+    terms, that installs entry as it is now.
+    '''
+    buf = bytearray(ofproto.OFP_HEADER_SIZE)
+    buf += struct.pack(
+        ofproto.OFP_FLOW_MOD_PACK_STR0,
+        entry.cookie,0,entry.table_id,ofproto.OFPFC_ADD,
+        entry.idle_timeout,hard_timeout,entry.priority,
+        ofproto.OFP_NO_BUFFER,ofproto.OFPP_ANY,ofproto.OFPG_ANY,entry.flags)
+    buf += entry.match_buf
+    buf += entry.instructions_buf
+    struct.pack_into(
+        ofproto.OFP_HEADER_PACK_STR,buf,0,
+        ofproto.OFP_VERSION,ofproto.OFPT_FLOW_MOD,len(buf),0)
+    return buf
+
+def produce_flow_stats_replies(xid,entries,now):
+    '''
+    @param {list} entries --- Each element is a ShadowFlowEntry.
+
+    @param {float} now --- Time to compute durations against.
+
+    @returns {list} --- Each element is a bytearray holding one
+    flow stats reply.  Entries are split over as many replies as it
+    takes to keep each under the maximum OpenFlow message size; all
+    but the last have OFPMPF_REPLY_MORE set.
+    '''
+    replies = []
+    reply = bytearray(ofproto.OFP_MULTIPART_REPLY_SIZE)
+    for entry in entries:
+        stats_len = (
+            FLOW_STATS_MATCH_OFFSET + len(entry.match_buf) +
+            len(entry.instructions_buf))
+        if ((len(reply) + stats_len > MAX_OFP_MESSAGE_SIZE) and
+            (len(reply) > ofproto.OFP_MULTIPART_REPLY_SIZE)):
+            _finish_multipart_reply(
+                reply,xid,ofproto.OFPMP_FLOW,ofproto.OFPMPF_REPLY_MORE)
+            replies.append(reply)
+            reply = bytearray(ofproto.OFP_MULTIPART_REPLY_SIZE)
+
+        duration = max(now - entry.install_time,0.)
+        duration_sec = int(duration)
+        duration_nsec = int((duration - duration_sec)*1e9)
+        reply += struct.pack(
+            ofproto.OFP_FLOW_STATS_0_PACK_STR,
+            stats_len,entry.table_id,duration_sec,duration_nsec,
+            entry.priority,entry.idle_timeout,entry.hard_timeout,
+            entry.flags,entry.cookie,entry.packet_count,entry.byte_count)
+        reply += entry.match_buf
+        reply += entry.instructions_buf
+
+    _finish_multipart_reply(reply,xid,ofproto.OFPMP_FLOW,0)
+    replies.append(reply)
+    return replies
+
+def produce_aggregate_stats_reply(xid,entries):
+    '''
+    @param {list} entries --- Each element is a ShadowFlowEntry.
+
+    @returns {bytearray} --- An aggregate stats reply summing entries'
+    counters.
+    '''
+    packet_count = 0
+    byte_count = 0
+    for entry in entries:
+        packet_count += entry.packet_count
+        byte_count += entry.byte_count
+
+    reply = bytearray(
+        ofproto.OFP_MULTIPART_REPLY_SIZE +
+        ofproto.OFP_AGGREGATE_STATS_REPLY_SIZE)
+    struct.pack_into(
+        ofproto.OFP_AGGREGATE_STATS_REPLY_PACK_STR,reply,
+        ofproto.OFP_MULTIPART_REPLY_SIZE,
+        packet_count,byte_count,len(entries))
+    _finish_multipart_reply(reply,xid,ofproto.OFPMP_AGGREGATE,0)
+    return reply
+
+def _finish_multipart_reply(reply,xid,multipart_type,flags):
+    struct.pack_into(
+        ofproto.OFP_HEADER_PACK_STR,reply,0,
+        ofproto.OFP_VERSION,ofproto.OFPT_MULTIPART_REPLY,len(reply),xid)
+    struct.pack_into(
+        ofproto.OFP_MULTIPART_REPLY_PACK_STR,reply,ofproto.OFP_HEADER_SIZE,
+        multipart_type,flags)
@@ -0,0 +1,203 @@
+import time
+
+from ryu.lib import hub
+
+
+# Upper bounds (inclusive) of the batch-size buckets that
+# SwitchOutputQueue counts flushes into.  Last bucket catches
+# everything larger.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class SwitchOutputQueue(object):
+    '''
+    Collects serialized messages bound for the switch from all
+    principals and writes them to the switch's datapath as a single
+    buffer.
+
+    A batch is written as soon as the greenlet that queued it yields
+    and the switch connection is not busy writing an earlier batch.
+    If it is busy, the batch waits at most flush_window seconds after
+    its first message was queued.  Callers that need everything before
+    some message to be on the wire (eg., barriers) call flush
+    directly.
+
+    Only one greenlet at a time writes to the datapath: ryu wakes
+    greenlets blocked on a full send queue in no particular order, so
+    batches written from several could reach the switch out of order.
+    While one is writing, everything queued behind it waits for it.
+
+    Note: python 2 sockets have no sendmsg, so "vectored" here means
+    one join and one sendall per batch instead of one per message.
+    '''
+
+    def __init__(self,flush_window,max_batch_bytes):
+        '''
+        @param {float} flush_window --- Maximum number of seconds a
+        message may wait in a batch for the switch connection to
+        become writable.
+
+        @param {int} max_batch_bytes --- Flush immediately once this
+        many bytes are waiting.
+        '''
+        self.flush_window = flush_window
+        self.max_batch_bytes = max_batch_bytes
+        self.datapath = None
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.first_pending_time = None
+        # incremented for every flush, so that a scheduled flusher can
+        # tell if the batch it was scheduled for has already been
+        # written.
+        self.batch_generation = 0
+        self.flusher_scheduled = False
+        # set while no greenlet is writing to the datapath.
+        self.not_flushing = hub.Event()
+        self.not_flushing.set()
+        # incremented for every message queued, so that callers can
+        # tell if anything was queued since some earlier message.
+        self.num_queued = 0
+
+        #### counters
+        self.num_batches = 0
+        self.num_msgs = 0
+        self.num_bytes = 0
+        self.max_batch_msgs = 0
+        self.batch_size_counts = [0]*(len(BATCH_SIZE_BUCKETS) + 1)
+        # seconds between the first message of a batch being queued
+        # and the batch being handed to the datapath.
+        self.total_flush_latency = 0.
+        self.max_flush_latency = 0.
+
+    def set_datapath(self,datapath):
+        '''
+        @param {ryu Datapath} datapath --- Connection to the switch.
+        Anything still queued for an older connection is dropped.
+        '''
+        self.datapath = datapath
+        self.pending = []
+        self.pending_bytes = 0
+        self.batch_generation += 1
+        self.flusher_scheduled = False
+
+    def send(self,buf):
+        '''
+        @param {bytearray or str} buf --- A complete, serialized
+        OpenFlow message.
+        '''
+        if not self.pending:
+            self.first_pending_time = time.time()
+        self.num_queued += 1
+        self.pending.append(buf)
+        self.pending_bytes += len(buf)
+
+        if self.pending_bytes >= self.max_batch_bytes:
+            if self.not_flushing.is_set():
+                self.flush()
+            else:
+                # switch connection is backed up; hold off the
+                # producer until the batches ahead of this one are
+                # written.
+                self.not_flushing.wait()
+        elif not self.flusher_scheduled:
+            self.flusher_scheduled = True
+            hub.spawn(self._flush_when_writable,self.batch_generation)
+
+    def flush(self):
+        '''
+        Hand everything queued so far to the switch datapath as one
+        buffer.  If another greenlet is already writing, returns
+        right away: that greenlet writes everything queued behind its
+        batch, in order, before it returns.
+        '''
+        self.batch_generation += 1
+        self.flusher_scheduled = False
+        if not self.not_flushing.is_set():
+            return
+
+        self.not_flushing.clear()
+        try:
+            while self.pending:
+                batch = self.pending
+                batch_bytes = self.pending_bytes
+                self.pending = []
+                self.pending_bytes = 0
+                self._update_counters(len(batch),batch_bytes)
+
+                # note: send may block if the datapath's queue is
+                # full.  Any messages queued in the meantime go into
+                # the next batch.
+                if len(batch) == 1:
+                    self.datapath.send(batch[0])
+                else:
+                    self.datapath.send(bytearray().join(batch))
+        finally:
+            # flushers scheduled while writing have nothing left to do
+            self.batch_generation += 1
+            self.flusher_scheduled = False
+            self.not_flushing.set()
+
+    def get_counters(self):
+        '''
+        @returns {dict} --- Batch size and flush latency counters.
+        '''
+        mean_batch_msgs = 0.
+        mean_flush_latency = 0.
+        if self.num_batches != 0:
+            mean_batch_msgs = float(self.num_msgs) / self.num_batches
+            mean_flush_latency = self.total_flush_latency / self.num_batches
+        return {
+            'num_batches': self.num_batches,
+            'num_msgs': self.num_msgs,
+            'num_bytes': self.num_bytes,
+            'mean_batch_msgs': mean_batch_msgs,
+            'max_batch_msgs': self.max_batch_msgs,
+            'batch_size_buckets': BATCH_SIZE_BUCKETS,
+            'batch_size_counts': list(self.batch_size_counts),
+            'mean_flush_latency': mean_flush_latency,
+            'max_flush_latency': self.max_flush_latency
+            }
+
+    def _flush_when_writable(self,batch_generation):
+        '''
+        Runs in its own greenlet, which only gets scheduled once the
+        greenlet that queued the batch yields.
+        '''
+        if batch_generation != self.batch_generation:
+            # batch was already flushed
+            return
+
+        if not self.datapath_writable():
+            remaining = (
+                self.first_pending_time + self.flush_window - time.time())
+            if remaining > 0:
+                hub.sleep(remaining)
+            if batch_generation != self.batch_generation:
+                return
+
+        self.flush()
+
+    def datapath_writable(self):
+        '''
+        @returns {bool} --- True if the datapath's send loop has
+        written everything it was given and is waiting for more.
+        '''
+        send_q = self.datapath.send_q
+        return (send_q is not None) and send_q.empty()
+
+    def _update_counters(self,batch_msgs,batch_bytes):
+        flush_latency = time.time() - self.first_pending_time
+
+        self.num_batches += 1
+        self.num_msgs += batch_msgs
+        self.num_bytes += batch_bytes
+        self.max_batch_msgs = max(self.max_batch_msgs,batch_msgs)
+        self.total_flush_latency += flush_latency
+        self.max_flush_latency = max(self.max_flush_latency,flush_latency)
+
+        bucket_index = 0
+        while ((bucket_index < len(BATCH_SIZE_BUCKETS)) and
+               (batch_msgs > BATCH_SIZE_BUCKETS[bucket_index])):
+            bucket_index += 1
+        self.batch_size_counts[bucket_index] += 1
@@ -0,0 +1,165 @@
+'''
+Structured trace of what Pluribus does with each message, cheap
+enough to leave on in production.
+
+Every event is a fixed-size binary record (timestamp, principal id,
+event code and four unsigned ints), packed into a preallocated ring
+buffer: recording an event never formats a string or allocates
+anything that outlives the call.  Once the buffer is full, new
+records overwrite the oldest.  Records only get formatted when the
+buffer is dumped, eg., when the switch reports an error, or on
+demand from the metrics endpoint (@see MetricsRegistry).
+
+Hot paths record through the module-level trace function:
+
+    trace(principal.id,EVENT_TABLE_ID_REWRITTEN,old_table_id,new_table_id)
+'''
+import struct
+import time
+
+from conf import pluribus_logger, TRACE_LOG_SIZE
+
+
+# principal id of events that are not tied to any principal
+NO_PRINCIPAL_ID = 0xffff
+
+#### event codes
+# ints: xid, number of messages translated to
+EVENT_FLOW_MOD_TRANSLATED = 1
+# ints: virtual table id, physical table id
+EVENT_TABLE_ID_REWRITTEN = 2
+# ints: virtual goto table id, physical goto table id
+EVENT_GOTO_REWRITTEN = 3
+# ints: whether there is an early flow mod, whether there is a late
+# flow mod
+EVENT_EARLY_LATE_SPLIT = 4
+# ints: logical output port that could not be translated
+EVENT_LOGICAL_OUTPUT_UNHANDLED = 5
+# ints: xid, message type, index of exception in
+# TRANSLATION_EXCEPTIONS
+EVENT_MESSAGE_REJECTED = 6
+# ints: xid, error type, error code
+EVENT_SWITCH_ERROR = 7
+
+# keys are event codes; values are (name, format string for ints)
+# tuples.  Format strings consume ints from the front.
+EVENT_FORMATS = {
+    EVENT_FLOW_MOD_TRANSLATED: (
+        'flow_mod_translated','xid=%i num_translated=%i'),
+    EVENT_TABLE_ID_REWRITTEN: (
+        'table_id_rewritten','virtual=%i physical=%i'),
+    EVENT_GOTO_REWRITTEN: (
+        'goto_rewritten','virtual=%i physical=%i'),
+    EVENT_EARLY_LATE_SPLIT: (
+        'early_late_split','early=%i late=%i'),
+    EVENT_LOGICAL_OUTPUT_UNHANDLED: (
+        'logical_output_unhandled','port=%i'),
+    EVENT_MESSAGE_REJECTED: (
+        'message_rejected','xid=%i type=%i exception=%i'),
+    EVENT_SWITCH_ERROR: (
+        'switch_error','xid=%i type=0x%02x code=0x%02x'),
+    }
+
+# timestamp, principal id, event code, four ints
+RECORD_PACK_STR = '=dHHIIII'
+RECORD_SIZE = struct.calcsize(RECORD_PACK_STR)
+
+_record_struct = struct.Struct(RECORD_PACK_STR)
+
+
+class TraceLog(object):
+
+    def __init__(self,num_records):
+        '''
+        @param {int} num_records --- Number of most recent records to
+        keep.  Must be positive.
+        '''
+        self.num_records = num_records
+        self.buf = bytearray(num_records*RECORD_SIZE)
+        # offset the next record gets written at
+        self.next_offset = 0
+        # total number of records ever written
+        self.num_written = 0
+
+    def record(self,principal_id,event,a=0,b=0,c=0,d=0):
+        '''
+        @param {int} principal_id --- NO_PRINCIPAL_ID if the event is
+        not tied to a principal.
+
+        @param {int} event --- One of the EVENT_* codes.
+
+        @param {int} a,b,c,d --- Event-specific values (@see
+        EVENT_FORMATS).  Must fit in 32 unsigned bits.
+        '''
+        offset = self.next_offset
+        _record_struct.pack_into(
+            self.buf,offset,time.time(),principal_id,event,a,b,c,d)
+        offset += RECORD_SIZE
+        if offset == len(self.buf):
+            offset = 0
+        self.next_offset = offset
+        self.num_written += 1
+
+    def records(self):
+        '''
+        @returns {list} --- Each element is a (timestamp, principal
+        id, event code, a, b, c, d) tuple, oldest first.
+        '''
+        num_records = min(self.num_written,self.num_records)
+        offset = self.next_offset - num_records*RECORD_SIZE
+        if offset < 0:
+            offset += len(self.buf)
+
+        records = []
+        for i in range(0,num_records):
+            records.append(_record_struct.unpack_from(self.buf,offset))
+            offset += RECORD_SIZE
+            if offset == len(self.buf):
+                offset = 0
+        return records
+
+    def dump(self,max_records=None):
+        '''
+        @param {int or None} max_records --- Only format this many of
+        the most recent records.  None for all of them.
+
+        @returns {list} --- Each element is a string describing a
+        record, oldest first.
+        '''
+        records = self.records()
+        if max_records is not None:
+            records = records[-max_records:]
+        return [format_record(record) for record in records]
+
+    def dump_to_log(self,max_records=None):
+        '''
+        Writes the most recent records to pluribus_logger, at error
+        level.
+        '''
+        lines = self.dump(max_records)
+        pluribus_logger.error(
+            'Last %i trace records:\n' % len(lines) + '\n'.join(lines))
+
+
+def format_record(record):
+    (timestamp, principal_id, event, a, b, c, d) = record
+    (name, ints_format) = EVENT_FORMATS.get(event,('event_%i' % event,''))
+    num_ints = ints_format.count('%')
+    principal = '-'
+    if principal_id != NO_PRINCIPAL_ID:
+        principal = str(principal_id)
+    return '%.6f principal=%s %s %s' % (
+        timestamp,principal,name,ints_format % (a,b,c,d)[0:num_ints])
+
+
+def _no_trace(principal_id,event,a=0,b=0,c=0,d=0):
+    pass
+
+
+# shared by every principal and the switch.  None if tracing is
+# disabled.
+trace_log = None
+trace = _no_trace
+if TRACE_LOG_SIZE > 0:
+    trace_log = TraceLog(TRACE_LOG_SIZE)
+    trace = trace_log.record
@@ -0,0 +1,104 @@
+import collections
+
+from ryu.ofproto import ofproto_common
+
+from bundle_util import get_xid, set_xid
+
+
+class TranslationCache(object):
+    '''
+    LRU cache of principals' translated flow mods.
+
+    Controllers tend to send the same flow mods over and over (eg.,
+    re-pushing rules after every topology event).  Translation only
+    depends on the flow mod's bytes and on the principal's table and
+    port mappings, so a repeat can reuse the bytes the first copy was
+    translated to, with only the xid patched.
+
+    Keys are (principal id, principal's translation generation, flow
+    mod minus its header).  Principals bump their generation whenever
+    their mappings change (@see Principal.invalidate_translations), so
+    invalidating never has to scan the cache: stale entries just stop
+    being hit and age out.  The whole body is used as the key instead
+    of a digest of it so that a collision can never return another
+    flow mod's translation.
+    '''
+
+    def __init__(self,max_entries):
+        '''
+        @param {int} max_entries --- Least recently used entries get
+        evicted beyond this many.  0 disables the cache.
+        '''
+        self.max_entries = max_entries
+        # values are lists of strs: the translated messages, still
+        # carrying the xid of the flow mod they were translated from.
+        self.entries = collections.OrderedDict()
+
+        #### counters
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+
+    def lookup(self,principal,buf):
+        '''
+        @param {Principal} principal --- Principal that sent buf.
+
+        @param {buffer} buf --- A flow mod in its wire format.
+
+        @returns {list or None} --- None on a miss.  Otherwise, each
+        element is a new bytearray holding a translated message, with
+        buf's xid.
+        '''
+        if self.max_entries == 0:
+            return None
+
+        key = _cache_key(principal,buf)
+        translated_strs = self.entries.pop(key,None)
+        if translated_strs is None:
+            self.num_misses += 1
+            return None
+
+        # re-insert to mark as most recently used
+        self.entries[key] = translated_strs
+        self.num_hits += 1
+
+        xid = get_xid(buf)
+        translated_bufs = []
+        for translated_str in translated_strs:
+            translated_buf = bytearray(translated_str)
+            set_xid(translated_buf,xid)
+            translated_bufs.append(translated_buf)
+        return translated_bufs
+
+    def insert(self,principal,buf,translated_bufs):
+        '''
+        @param {list} translated_bufs --- What buf was translated to.
+        Copied, so callers are free to modify them afterwards.
+        '''
+        if self.max_entries == 0:
+            return
+
+        key = _cache_key(principal,buf)
+        self.entries.pop(key,None)
+        self.entries[key] = [
+            str(translated_buf) for translated_buf in translated_bufs]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.num_evictions += 1
+
+    def get_counters(self):
+        '''
+        @returns {dict} --- Hit, miss and eviction counters.
+        '''
+        return {
+            'num_entries': len(self.entries),
+            'num_hits': self.num_hits,
+            'num_misses': self.num_misses,
+            'num_evictions': self.num_evictions
+            }
+
+
+def _cache_key(principal,buf):
+    return (
+        principal.id,principal.translation_generation,
+        str(buf[ofproto_common.OFP_HEADER_SIZE:]))
@@ -0,0 +1,214 @@
+'''
+A principal's table and port mappings, compiled into a form that
+makes translating a flow mod cost only a walk over its bytes.
+
+Principals rebuild their plan whenever a mapping changes (@see
+Principal.invalidate_translations), never per message:
+
+    * table ids map through a 256-byte array indexed by virtual
+      table id (an OpenFlow table id is a single byte).
+
+    * port permissions map through a byte array indexed by port
+      number, holding whether each port is one of the principal's
+      physical ports, logical ports or neither.  Port numbers too
+      large to index (eg., reserved ports) fall back to a dict.
+
+    * instruction types dispatch through a small array of type codes
+      instead of a chain of comparisons or isinstance checks.
+'''
+import struct
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from translation_exceptions import InvalidTableWriteException
+from translation_exceptions import InvalidGotoTableException
+from translation_exceptions import InvalidOutputAction
+from translation_exceptions import MalformedFlowModException
+from wire_flow_mod import FLOW_MOD_TABLE_ID_OFFSET
+from wire_flow_mod import INSTRUCTION_GOTO_TABLE_ID_OFFSET
+from wire_flow_mod import INSTRUCTION_ACTIONS_HEADER_SIZE
+from wire_flow_mod import ACTION_OUTPUT_PORT_OFFSET
+from wire_flow_mod import flow_mod_instructions_offset
+
+
+# marks virtual table ids that have no physical table.  OFPTT_ALL can
+# never be a physical table id.
+INVALID_TABLE_ID = ofproto.OFPTT_ALL
+
+# instruction type codes
+INSTRUCTION_KIND_OTHER = 0
+INSTRUCTION_KIND_GOTO = 1
+INSTRUCTION_KIND_ACTIONS = 2
+
+# index is an instruction type; value is its type code.  Types past
+# the end are INSTRUCTION_KIND_OTHER.
+_INSTRUCTION_KINDS = bytearray(
+    max(ofproto.OFPIT_GOTO_TABLE,ofproto.OFPIT_WRITE_ACTIONS,
+        ofproto.OFPIT_APPLY_ACTIONS) + 1)
+_INSTRUCTION_KINDS[ofproto.OFPIT_GOTO_TABLE] = INSTRUCTION_KIND_GOTO
+_INSTRUCTION_KINDS[ofproto.OFPIT_WRITE_ACTIONS] = INSTRUCTION_KIND_ACTIONS
+_INSTRUCTION_KINDS[ofproto.OFPIT_APPLY_ACTIONS] = INSTRUCTION_KIND_ACTIONS
+
+# port kinds
+PORT_KIND_NONE = 0
+PORT_KIND_PHYSICAL = 1
+PORT_KIND_LOGICAL = 2
+
+# ports above this go into a dict instead of the port kind array
+MAX_INDEXED_PORT = 0xffff
+
+_TLV_HEADER_PACK_STR = '!HH'
+_UINT32_PACK_STR = '!I'
+
+
+class TranslationPlan(object):
+
+    def __init__(self,table_id_list,physical_port_set,logical_port_nums):
+        '''
+        @param {list or None} table_id_list --- Each element is an
+        integer.  Index is the virtual table id; value is the physical
+        table id.  None if tables have not been assigned yet.
+
+        @param {iterable} physical_port_set --- Physical ports that
+        output actions may address.
+
+        @param {iterable} logical_port_nums --- Logical port numbers
+        that output actions may address.
+        '''
+        self.table_map = bytearray([INVALID_TABLE_ID]*256)
+        self.num_tables = 0
+        if table_id_list is not None:
+            self.num_tables = len(table_id_list)
+            for virtual_table_id, physical_table_id in enumerate(
+                table_id_list):
+                self.table_map[virtual_table_id] = physical_table_id
+
+        (self.port_kinds, self.high_port_kinds) = _port_kind_map(
+            physical_port_set,logical_port_nums)
+
+    def is_physical_port(self,port):
+        '''
+        @param {int or None} port
+        '''
+        if port is None:
+            return False
+        if port < len(self.port_kinds):
+            return self.port_kinds[port] == PORT_KIND_PHYSICAL
+        return self.high_port_kinds.get(port,None) == PORT_KIND_PHYSICAL
+
+    def is_logical_port(self,port):
+        '''
+        @param {int or None} port
+        '''
+        if port is None:
+            return False
+        if port < len(self.port_kinds):
+            return self.port_kinds[port] == PORT_KIND_LOGICAL
+        return self.high_port_kinds.get(port,None) == PORT_KIND_LOGICAL
+
+    def translate_flow_mod_wire(self,flow_mod_buf):
+        '''
+        @param {bytearray} flow_mod_buf --- Flow mod to translate in
+        place.  Its table id and all goto table ids are rewritten
+        through the table map.
+
+        Flow mods targetting OFPTT_ALL must be handled by the caller.
+
+        @returns {bool} --- True if any output action forwards out of a
+        logical port.
+
+        @throws {InvalidTableWriteException} --- If the flow mod's table
+        is not a valid virtual table id.
+
+        @throws {InvalidGotoTableException} --- If a goto targets an
+        invalid virtual table id.
+
+        @throws {InvalidOutputAction} --- If an output action addresses a
+        port that is neither a physical nor a logical port of the
+        principal.
+
+        @throws {MalformedFlowModException} --- If an instruction or
+        action is shorter than its own header.
+        '''
+        table_map = self.table_map
+        port_kinds = self.port_kinds
+        num_indexed_ports = len(port_kinds)
+        high_port_kinds = self.high_port_kinds
+
+        physical_table_id = table_map[flow_mod_buf[FLOW_MOD_TABLE_ID_OFFSET]]
+        if physical_table_id == INVALID_TABLE_ID:
+            raise InvalidTableWriteException()
+        flow_mod_buf[FLOW_MOD_TABLE_ID_OFFSET] = physical_table_id
+
+        outputs_to_logical_port = False
+        offset = flow_mod_instructions_offset(flow_mod_buf)
+        msg_len = len(flow_mod_buf)
+        num_instruction_kinds = len(_INSTRUCTION_KINDS)
+        while offset < msg_len:
+            (inst_type, inst_len) = struct.unpack_from(
+                _TLV_HEADER_PACK_STR,flow_mod_buf,offset)
+            if inst_len < 4:
+                raise MalformedFlowModException()
+
+            inst_kind = INSTRUCTION_KIND_OTHER
+            if inst_type < num_instruction_kinds:
+                inst_kind = _INSTRUCTION_KINDS[inst_type]
+
+            if inst_kind == INSTRUCTION_KIND_GOTO:
+                goto_offset = offset + INSTRUCTION_GOTO_TABLE_ID_OFFSET
+                physical_table_id = table_map[flow_mod_buf[goto_offset]]
+                if physical_table_id == INVALID_TABLE_ID:
+                    raise InvalidGotoTableException()
+                flow_mod_buf[goto_offset] = physical_table_id
+
+            elif inst_kind == INSTRUCTION_KIND_ACTIONS:
+                action_offset = offset + INSTRUCTION_ACTIONS_HEADER_SIZE
+                inst_end = offset + inst_len
+                while action_offset < inst_end:
+                    (action_type, action_len) = struct.unpack_from(
+                        _TLV_HEADER_PACK_STR,flow_mod_buf,action_offset)
+                    if action_len < 4:
+                        raise MalformedFlowModException()
+                    if action_type == ofproto.OFPAT_OUTPUT:
+                        (output_port,) = struct.unpack_from(
+                            _UINT32_PACK_STR,flow_mod_buf,
+                            action_offset + ACTION_OUTPUT_PORT_OFFSET)
+                        if output_port < num_indexed_ports:
+                            port_kind = port_kinds[output_port]
+                        else:
+                            port_kind = high_port_kinds.get(
+                                output_port,PORT_KIND_NONE)
+                        if port_kind == PORT_KIND_LOGICAL:
+                            outputs_to_logical_port = True
+                        elif port_kind != PORT_KIND_PHYSICAL:
+                            raise InvalidOutputAction()
+                    action_offset += action_len
+
+            offset += inst_len
+
+        return outputs_to_logical_port
+
+
+def _port_kind_map(physical_port_nums,logical_port_nums):
+    '''
+    @returns {2-tuple} --- (port_kinds, high_port_kinds).  port_kinds
+    is a bytearray indexed by port number, up to the highest port no
+    larger than MAX_INDEXED_PORT; values are PORT_KIND_* constants.
+    high_port_kinds is a dict from the rest to their kinds.  A port
+    that is both physical and logical counts as logical.
+    '''
+    port_kind_pairs = (
+        [(port_num,PORT_KIND_PHYSICAL) for port_num in physical_port_nums] +
+        [(port_num,PORT_KIND_LOGICAL) for port_num in logical_port_nums])
+    indexed_ports = [
+        port_num for port_num, _ in port_kind_pairs
+        if port_num <= MAX_INDEXED_PORT]
+
+    port_kinds = bytearray(max(indexed_ports) + 1 if indexed_ports else 0)
+    high_port_kinds = {}
+    for port_num, port_kind in port_kind_pairs:
+        if port_num > MAX_INDEXED_PORT:
+            high_port_kinds[port_num] = port_kind
+        else:
+            port_kinds[port_num] = port_kind
+    return port_kinds, high_port_kinds
@@ -0,0 +1,242 @@
+'''
+Helpers that read and patch OpenFlow 1.3 flow mods directly in their
+wire format, without building ryu objects.
+
+Virtualizing a flow mod only touches a handful of fixed-size fields
+(the flow mod's table id, goto table ids and output port numbers), so
+when a message needs no structural changes, we can translate it by
+patching a copy of the received bytes and forward that copy as is
+(@see TranslationPlan.translate_flow_mod_wire).
+'''
+import struct
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+import ryu.utils
+
+from translation_exceptions import InvalidTableWriteException
+from translation_exceptions import MalformedFlowModException
+
+
+# offsets from the start of the flow mod message
+FLOW_MOD_TABLE_ID_OFFSET = 24
+FLOW_MOD_COMMAND_OFFSET = 25
+FLOW_MOD_HARD_TIMEOUT_OFFSET = 28
+FLOW_MOD_BUFFER_ID_OFFSET = 32
+FLOW_MOD_MATCH_OFFSET = ofproto.OFP_FLOW_MOD_SIZE - ofproto.OFP_MATCH_SIZE
+
+# offsets from the start of an instruction
+INSTRUCTION_GOTO_TABLE_ID_OFFSET = 4
+INSTRUCTION_ACTIONS_HEADER_SIZE = ofproto.OFP_INSTRUCTION_ACTIONS_SIZE
+
+# offsets from the start of an action
+ACTION_OUTPUT_PORT_OFFSET = 4
+ACTION_GROUP_ID_OFFSET = 4
+
+OXM_OF_IN_PORT_HEADER = ofproto.OXM_OF_IN_PORT
+
+_TLV_HEADER_PACK_STR = '!HH'
+_OXM_HEADER_PACK_STR = '!I'
+_UINT8_PACK_STR = '!B'
+_UINT16_PACK_STR = '!H'
+_UINT32_PACK_STR = '!I'
+
+
+def flow_mod_table_id(buf):
+    '''
+    @param {buffer, bytearray or str} buf --- Flow mod on the wire.
+    '''
+    (table_id,) = struct.unpack_from(
+        _UINT8_PACK_STR,buf,FLOW_MOD_TABLE_ID_OFFSET)
+    return table_id
+
+def flow_mod_fields(buf):
+    '''
+    @returns {tuple} --- (cookie, cookie_mask, table_id, command,
+    idle_timeout, hard_timeout, priority, buffer_id, out_port,
+    out_group, flags)
+    '''
+    return struct.unpack_from(
+        ofproto.OFP_FLOW_MOD_PACK_STR0,buf,ofproto.OFP_HEADER_SIZE)
+
+def set_flow_mod_hard_timeout(buf,hard_timeout):
+    '''
+    @param {bytearray} buf --- Flow mod, rewritten in place.
+    '''
+    struct.pack_into(
+        _UINT16_PACK_STR,buf,FLOW_MOD_HARD_TIMEOUT_OFFSET,hard_timeout)
+
+def flow_mod_instructions_offset(buf):
+    '''
+    @returns {int} --- Offset of the first instruction.  Matches are
+    padded to a multiple of 8 bytes on the wire.
+    '''
+    return FLOW_MOD_MATCH_OFFSET + padded_match_len(buf,FLOW_MOD_MATCH_OFFSET)
+
+def padded_match_len(buf,match_offset):
+    '''
+    @param {int} match_offset --- Offset of an ofp_match in buf.
+
+    @returns {int} --- Number of bytes the match takes up on the wire,
+    including padding.
+    '''
+    (match_type, match_len) = struct.unpack_from(
+        _TLV_HEADER_PACK_STR,buf,match_offset)
+    return ryu.utils.round_up(match_len,8)
+
+def canonical_match(buf,match_offset):
+    '''
+    @param {int} match_offset --- Offset of an ofp_match in buf.
+
+    @returns {tuple} --- Each element is a str holding one of the
+    match's OXM TLVs.  Elements are sorted, so that two matches that
+    only differ in the order of their fields have the same canonical
+    match.
+    '''
+    (match_type, match_len) = struct.unpack_from(
+        _TLV_HEADER_PACK_STR,buf,match_offset)
+    offset = match_offset + 4
+    match_end = match_offset + match_len
+    oxm_tlvs = []
+    while offset + 4 <= match_end:
+        (oxm_header,) = struct.unpack_from(_OXM_HEADER_PACK_STR,buf,offset)
+        oxm_end = offset + 4 + (oxm_header & 0xff)
+        oxm_tlvs.append(str(buf[offset:oxm_end]))
+        offset = oxm_end
+    oxm_tlvs.sort()
+    return tuple(oxm_tlvs)
+
+def instructions_outputs(buf,offset):
+    '''
+    @param {int} offset --- Offset of the first instruction in buf.
+    Instructions run until the end of buf.
+
+    @returns {2-tuple} --- (output_ports, output_groups).  Both sets
+    of ints: every port an output action in the instructions
+    forwards to and every group a group action forwards to.
+    '''
+    output_ports = set()
+    output_groups = set()
+    msg_len = len(buf)
+    while offset + 4 <= msg_len:
+        (inst_type, inst_len) = struct.unpack_from(
+            _TLV_HEADER_PACK_STR,buf,offset)
+        if inst_len < 4:
+            raise MalformedFlowModException()
+
+        if ((inst_type == ofproto.OFPIT_WRITE_ACTIONS) or
+            (inst_type == ofproto.OFPIT_APPLY_ACTIONS)):
+            action_offset = offset + INSTRUCTION_ACTIONS_HEADER_SIZE
+            inst_end = offset + inst_len
+            while action_offset < inst_end:
+                (action_type, action_len) = struct.unpack_from(
+                    _TLV_HEADER_PACK_STR,buf,action_offset)
+                if action_len < 4:
+                    raise MalformedFlowModException()
+                if action_type == ofproto.OFPAT_OUTPUT:
+                    (output_port,) = struct.unpack_from(
+                        _UINT32_PACK_STR,buf,
+                        action_offset + ACTION_OUTPUT_PORT_OFFSET)
+                    output_ports.add(output_port)
+                elif action_type == ofproto.OFPAT_GROUP:
+                    (group_id,) = struct.unpack_from(
+                        _UINT32_PACK_STR,buf,
+                        action_offset + ACTION_GROUP_ID_OFFSET)
+                    output_groups.add(group_id)
+                action_offset += action_len
+
+        offset += inst_len
+    return output_ports, output_groups
+
+def flow_mod_match_in_port(buf):
+    '''
+    @returns {int or None} --- The value of the match's in_port field.
+    None if the match does not contain an in_port field.
+    '''
+    in_port_offset = flow_mod_match_in_port_offset(buf)
+    if in_port_offset is None:
+        return None
+    (in_port,) = struct.unpack_from(_UINT32_PACK_STR,buf,in_port_offset)
+    return in_port
+
+def flow_mod_match_in_port_offset(buf):
+    '''
+    @returns {int or None} --- Offset of the value of the match's
+    in_port field.  None if the match does not contain an in_port
+    field.
+    '''
+    return match_in_port_offset(buf,FLOW_MOD_MATCH_OFFSET)
+
+def match_in_port_offset(buf,match_offset):
+    '''
+    @param {int} match_offset --- Offset of an ofp_match in buf.
+
+    @returns {int or None} --- @see flow_mod_match_in_port_offset.
+    '''
+    (match_type, match_len) = struct.unpack_from(
+        _TLV_HEADER_PACK_STR,buf,match_offset)
+    # oxm fields start after ofp_match's type and length
+    offset = match_offset + 4
+    match_end = match_offset + match_len
+    while offset + 4 <= match_end:
+        (oxm_header,) = struct.unpack_from(_OXM_HEADER_PACK_STR,buf,offset)
+        if oxm_header == OXM_OF_IN_PORT_HEADER:
+            return offset + 4
+        # lowest byte of an oxm header is the length of its payload
+        offset += 4 + (oxm_header & 0xff)
+    return None
+
+def fan_out_flow_mod_wire(buf,physical_table_ids,in_port=None):
+    '''
+    @param {buffer} buf --- Flow mod targetting OFPTT_ALL.
+
+    @param {list} physical_table_ids --- Each element is an int.
+
+    @param {int or None} in_port --- If not None, the copies' in_port
+    match field gets rewritten to this.
+
+    @returns {list} --- Each element is a bytearray: a copy of buf
+    that targets one of physical_table_ids, in order.
+
+    @throws {InvalidTableWriteException} --- If buf is not a delete.
+    OpenFlow only allows deletes to target OFPTT_ALL.
+    '''
+    (command,) = struct.unpack_from(
+        _UINT8_PACK_STR,buf,FLOW_MOD_COMMAND_OFFSET)
+    if ((command != ofproto.OFPFC_DELETE) and
+        (command != ofproto.OFPFC_DELETE_STRICT)):
+        raise InvalidTableWriteException()
+
+    template = bytearray(buf)
+    if in_port is not None:
+        struct.pack_into(
+            _UINT32_PACK_STR,template,
+            flow_mod_match_in_port_offset(template),in_port)
+
+    copies = []
+    for table_id in physical_table_ids:
+        copy = template[:]
+        copy[FLOW_MOD_TABLE_ID_OFFSET] = table_id
+        copies.append(copy)
+    return copies
+
+def produce_error(xid,error_type,error_code,offending_msg):
+    '''
+    @param {int} error_type --- One of the OFPET_* types.
+
+    @param {int} error_code --- One of the codes for error_type.
+
+    @param {buffer} offending_msg --- Message that caused the error.
+    At most its first 64 bytes are echoed back.
+
+    @returns {bytearray} --- A serialized error message.
+    '''
+    data = offending_msg[0:64]
+    buf = bytearray(ofproto.OFP_ERROR_MSG_SIZE)
+    struct.pack_into(
+        ofproto.OFP_HEADER_PACK_STR,buf,0,ofproto.OFP_VERSION,
+        ofproto.OFPT_ERROR,ofproto.OFP_ERROR_MSG_SIZE + len(data),xid)
+    struct.pack_into(
+        ofproto.OFP_ERROR_MSG_PACK_STR,buf,ofproto.OFP_HEADER_SIZE,
+        error_type,error_code)
+    buf += data
+    return buf
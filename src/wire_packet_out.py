@@ -0,0 +1,108 @@
+'''
+Helpers that read and rewrite OpenFlow 1.3 packet outs directly in
+their wire format (@see wire_flow_mod for flow mods).
+'''
+import struct
+
+from ryu.ofproto import ofproto_v1_3 as ofproto
+
+from translation_exceptions import InvalidOutputAction
+from translation_exceptions import MalformedFlowModException
+
+
+# offsets from the start of a packet out
+PACKET_OUT_BUFFER_ID_OFFSET = 8
+PACKET_OUT_ACTIONS_OFFSET = ofproto.OFP_PACKET_OUT_SIZE
+
+# offsets from the start of a packet in
+PACKET_IN_BUFFER_ID_OFFSET = 8
+
+_MSG_LEN_OFFSET = 2
+
+_TLV_HEADER_PACK_STR = '!HH'
+_UINT16_PACK_STR = '!H'
+_UINT32_PACK_STR = '!I'
+
+
+def packet_out_fields(buf):
+    '''
+    @returns {3-tuple} --- (buffer_id, in_port, actions_len)
+    '''
+    return struct.unpack_from(
+        ofproto.OFP_PACKET_OUT_PACK_STR,buf,ofproto.OFP_HEADER_SIZE)
+
+def get_buffer_id(buf,offset):
+    (buffer_id,) = struct.unpack_from(_UINT32_PACK_STR,buf,offset)
+    return buffer_id
+
+def set_buffer_id(buf,offset,buffer_id):
+    '''
+    @param {bytearray} buf --- Rewritten in place.
+    '''
+    struct.pack_into(_UINT32_PACK_STR,buf,offset,buffer_id)
+
+def translate_packet_out_wire(buf,physical_buffer_id,allowed_ports):
+    '''
+    @param {buffer} buf --- Packet out from a principal.
+
+    @param {int} physical_buffer_id --- Replaces buf's buffer id.
+
+    @param {frozenset} allowed_ports --- Ports output actions may
+    address.  Outputs to OFPP_FLOOD and OFPP_ALL get expanded into one
+    output per allowed port other than the packet out's in_port, so
+    that they never reach other principals' ports.
+
+    @returns {bytearray} --- Translated packet out.
+
+    @throws {InvalidOutputAction} --- If an output action addresses
+    any other port, other than OFPP_IN_PORT.
+
+    @throws {MalformedFlowModException} --- If an action is shorter
+    than its own header or actions overrun the message.
+    '''
+    (buffer_id, in_port, actions_len) = packet_out_fields(buf)
+    actions_end = PACKET_OUT_ACTIONS_OFFSET + actions_len
+    if actions_end > len(buf):
+        raise MalformedFlowModException()
+
+    actions = bytearray()
+    offset = PACKET_OUT_ACTIONS_OFFSET
+    while offset < actions_end:
+        (action_type, action_len) = struct.unpack_from(
+            _TLV_HEADER_PACK_STR,buf,offset)
+        if action_len < 4:
+            raise MalformedFlowModException()
+
+        if action_type == ofproto.OFPAT_OUTPUT:
+            (_, _, output_port, max_len) = struct.unpack_from(
+                ofproto.OFP_ACTION_OUTPUT_PACK_STR,buf,offset)
+            if ((output_port == ofproto.OFPP_FLOOD) or
+                (output_port == ofproto.OFPP_ALL)):
+                for flood_port in sorted(allowed_ports):
+                    if flood_port == in_port:
+                        continue
+                    actions += struct.pack(
+                        ofproto.OFP_ACTION_OUTPUT_PACK_STR,
+                        ofproto.OFPAT_OUTPUT,ofproto.OFP_ACTION_OUTPUT_SIZE,
+                        flood_port,max_len)
+                offset += action_len
+                continue
+            if ((output_port not in allowed_ports) and
+                (output_port != ofproto.OFPP_IN_PORT)):
+                raise InvalidOutputAction()
+
+        actions += buf[offset:offset + action_len]
+        offset += action_len
+
+    data = buf[actions_end:]
+    msg_len = ofproto.OFP_PACKET_OUT_SIZE + len(actions) + len(data)
+    packet_out_buf = bytearray(ofproto.OFP_PACKET_OUT_SIZE)
+    packet_out_buf[0:ofproto.OFP_HEADER_SIZE] = (
+        buf[0:ofproto.OFP_HEADER_SIZE])
+    struct.pack_into(_UINT16_PACK_STR,packet_out_buf,_MSG_LEN_OFFSET,msg_len)
+    struct.pack_into(
+        ofproto.OFP_PACKET_OUT_PACK_STR,packet_out_buf,
+        ofproto.OFP_HEADER_SIZE,physical_buffer_id,in_port,len(actions))
+    packet_out_buf += actions
+    packet_out_buf += data
+    return packet_out_buf
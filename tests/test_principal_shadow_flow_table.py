@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+'''
+Checks that flow mods that go through full translation are recorded
+in the principal's shadow flow table in its own (virtual) terms, and
+so get reinstalled correctly after the switch reconnects.
+
+Run from this directory, which holds the pluribus.conf to use:
+
+    python -m unittest discover
+'''
+import sys
+import os
+import sets
+import unittest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','src'))
+
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_protocol
+from ryu.ofproto import ofproto_v1_3
+
+from chained_table_principal import ChainedTablePrincipal
+from match_overlap_index import MatchOverlapIndex
+from translation_cache import TranslationCache
+
+
+DATAPATH = ofproto_protocol.ProtocolDesc(ofproto_v1_3.OFP_VERSION)
+
+EARLY_TABLE_IDS = [1,2]
+LATE_TABLE_IDS = [3,4]
+
+
+class StandInPluribusSwitch(object):
+    '''
+    Just enough of a PluribusSwitch for a principal to translate flow
+    mods and send them to the switch.
+    '''
+    def __init__(self):
+        self.switch_dp = DATAPATH
+        self.shadow_physical_index = {}
+        self.match_overlap_index = MatchOverlapIndex()
+        self.translation_cache = TranslationCache(100)
+        self.sent = []
+
+    def serialize_msg(self,msg_to_send):
+        if msg_to_send.xid is None:
+            msg_to_send.xid = 0
+        msg_to_send.serialize()
+        return msg_to_send.buf
+
+    def send_raw(self,buf):
+        self.sent.append(parse(buf))
+
+    def send_barrier(self,callback=None):
+        pass
+
+
+def produce_flow_mod(table_id,command,instructions=()):
+    '''
+    @returns {str} --- A flow mod that does not match on in_port.
+    '''
+    parser = DATAPATH.ofproto_parser
+    msg = parser.OFPFlowMod(
+        DATAPATH,0,0,table_id,command,0,0,10,ofproto_v1_3.OFP_NO_BUFFER,
+        ofproto_v1_3.OFPP_ANY,ofproto_v1_3.OFPG_ANY,0,
+        parser.OFPMatch(eth_type=0x800),list(instructions))
+    msg.xid = 1
+    msg.serialize()
+    return str(msg.buf)
+
+def parse(buf):
+    (version, msg_type, msg_len, xid) = ofproto_parser.header(buf)
+    return ofproto_parser.msg(
+        DATAPATH,version,msg_type,msg_len,xid,buffer(str(buf)))
+
+
+class ChainedTableShadowFlowTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.switch = StandInPluribusSwitch()
+        self.principal = ChainedTablePrincipal(
+            self.switch,sets.ImmutableSet([1,2]),'127.0.0.1',6633)
+        self.principal.add_table_ids(EARLY_TABLE_IDS,LATE_TABLE_IDS)
+
+    def handle_flow_mod(self,buf):
+        # in_port wildcards never take the wire fast path
+        self.assertFalse(self.principal.handle_raw_flow_mod(buffer(buf)))
+        self.principal.handle_flow_mod(parse(buf))
+
+    def sent_table_ids(self):
+        table_ids = [msg.table_id for msg in self.switch.sent]
+        del self.switch.sent[:]
+        return table_ids
+
+    def test_add_recorded_in_virtual_terms(self):
+        goto = DATAPATH.ofproto_parser.OFPInstructionGotoTable(1)
+        self.handle_flow_mod(
+            produce_flow_mod(0,ofproto_v1_3.OFPFC_ADD,[goto]))
+        self.assertEqual(self.sent_table_ids(),[1,3])
+
+        entries = self.principal.shadow_flow_table.entries()
+        self.assertEqual([entry.table_id for entry in entries],[0])
+
+        self.assertEqual(self.principal.reinstall_rules(),2)
+        self.assertEqual(
+            [msg.instructions[-1].table_id for msg in self.switch.sent],
+            [EARLY_TABLE_IDS[1],LATE_TABLE_IDS[1]])
+        self.assertEqual(self.sent_table_ids(),[1,3])
+
+    def test_same_flow_mod_on_other_table(self):
+        self.handle_flow_mod(produce_flow_mod(0,ofproto_v1_3.OFPFC_ADD))
+        self.assertEqual(self.sent_table_ids(),[1,3])
+        self.handle_flow_mod(produce_flow_mod(1,ofproto_v1_3.OFPFC_ADD))
+        self.assertEqual(self.sent_table_ids(),[2,4])
+        self.assertEqual(
+            sorted(
+                entry.table_id
+                for entry in self.principal.shadow_flow_table.entries()),
+            [0,1])
+
+    def test_delete_removes_shadow_entry(self):
+        self.handle_flow_mod(produce_flow_mod(0,ofproto_v1_3.OFPFC_ADD))
+        self.handle_flow_mod(produce_flow_mod(0,ofproto_v1_3.OFPFC_DELETE))
+        self.assertEqual(self.principal.shadow_flow_table.entries(),[])
+        del self.switch.sent[:]
+        self.assertEqual(self.principal.reinstall_rules(),0)
+        self.assertEqual(self.switch.sent,[])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+Checks that SwitchOutputQueue writes messages to the switch in the
+order they were queued, even when the switch connection is backed up.
+
+Run from this directory, which holds the pluribus.conf to use:
+
+    python -m unittest discover
+'''
+import sys
+import os
+import struct
+import unittest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','src'))
+
+from ryu.lib import hub
+
+from switch_output import SwitchOutputQueue
+
+
+NUM_MSGS = 3000
+# ryu Datapath's send queue size
+SEND_QUEUE_SIZE = 16
+# short enough that flushers time out while earlier ones are still
+# blocked on the full send queue
+FLUSH_WINDOW = .0001
+MAX_BATCH_BYTES = 1 << 20
+
+
+class SlowDatapath(object):
+    '''
+    Stands in for a ryu Datapath whose switch reads slower than
+    principals write.
+    '''
+    def __init__(self):
+        self.send_q = hub.Queue(SEND_QUEUE_SIZE)
+        self.received = bytearray()
+        self.thread = hub.spawn(self._send_loop)
+
+    def send(self,buf):
+        self.send_q.put(buf)
+
+    def _send_loop(self):
+        while True:
+            self.received += self.send_q.get()
+            hub.sleep(.0005)
+
+    def stop(self):
+        hub.kill(self.thread)
+
+
+class SwitchOutputQueueOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datapath = SlowDatapath()
+        self.switch_output = SwitchOutputQueue(FLUSH_WINDOW,MAX_BATCH_BYTES)
+        self.switch_output.set_datapath(self.datapath)
+
+    def tearDown(self):
+        self.datapath.stop()
+
+    def received_seq_nums(self):
+        received = str(self.datapath.received)
+        return [
+            struct.unpack_from('!I',received,offset)[0]
+            for offset in range(0,len(received),4)]
+
+    def wait_for_all(self):
+        for _ in range(1000):
+            if len(self.datapath.received) == NUM_MSGS*4:
+                return
+            hub.sleep(.01)
+
+    def test_order_under_backpressure(self):
+        for seq_num in range(NUM_MSGS):
+            self.switch_output.send(bytearray(struct.pack('!I',seq_num)))
+            if seq_num % 3 == 0:
+                hub.sleep(0)
+        self.switch_output.flush()
+        self.wait_for_all()
+        self.assertEqual(self.received_seq_nums(),range(NUM_MSGS))
+
+    def test_flush_behind_blocked_flush(self):
+        # several producers, each of which flushes (like barriers do)
+        producers = []
+        for producer_id in range(4):
+            producers.append(hub.spawn(self._produce,producer_id))
+        hub.joinall(producers)
+        self.switch_output.flush()
+        self.wait_for_all()
+
+        seq_nums = self.received_seq_nums()
+        self.assertEqual(sorted(seq_nums),range(NUM_MSGS))
+        for producer_id in range(4):
+            own = [
+                seq_num for seq_num in seq_nums if seq_num % 4 == producer_id]
+            self.assertEqual(own,sorted(own))
+
+    def _produce(self,producer_id):
+        for seq_num in range(producer_id,NUM_MSGS,4):
+            self.switch_output.send(bytearray(struct.pack('!I',seq_num)))
+            if seq_num % 5 == 0:
+                self.switch_output.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+'''
+Checks that Pluribus only reuses principals' assignments when a
+reconnected switch still has the ports they were assigned, by asking
+the reconnected switch for its ports rather than trusting the ones
+its previous connection had.
+
+Starts Pluribus in its own process, with a stand-in switch and
+stand-in principal controllers.  Run from this directory:
+
+    python -m unittest discover
+'''
+import sys
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','src'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '..','experiments','benchmarks'))
+
+from ryu.lib import hub
+
+from stand_in_switch import StandInSwitch
+from flow_mod_load_generator import StandInPrincipalController
+from port_util import num_logical_port_pairs_from_num_principals
+from switch_reconnect_time import APPS, connect_switch, wait_for_acks
+
+
+OFP_PORT = 16643
+PRINCIPAL_DICTS = [
+    {'physical_ports': [1,2],'listening_ip_addr': '127.0.0.1',
+     'listening_port_addr': 17201},
+    {'physical_ports': [3,4],'listening_ip_addr': '127.0.0.1',
+     'listening_port_addr': 17202},
+    ]
+NUM_PHYSICAL_PORTS = 4
+NUM_FLOW_MODS = 10
+# seconds Pluribus waits for missing switch ports
+PORT_STATS_DELAY_TIME = 1
+TIMEOUT = 30.
+
+
+class SwitchReconnectPortsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        principals_filename = os.path.join(self.conf_dir,'principals.json')
+        with open(principals_filename,'w') as fd:
+            json.dump(PRINCIPAL_DICTS,fd)
+        with open(os.path.join(self.conf_dir,'pluribus.conf'),'w') as fd:
+            json.dump(
+                {'LOGGING_LEVEL': 'WARNING',
+                 'PORT_STATS_DELAY_TIME': PORT_STATS_DELAY_TIME,
+                 'JSON_PRINCIPALS_TO_LOAD_FILENAME': principals_filename},
+                fd)
+        self.process = None
+        self.switches = []
+        self.output = open(os.devnull,'w')
+
+    def tearDown(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        for switch in self.switches:
+            switch.stop()
+        self.output.close()
+        shutil.rmtree(self.conf_dir)
+
+    def new_switch(self):
+        switch = StandInSwitch(
+            NUM_PHYSICAL_PORTS,
+            num_logical_port_pairs_from_num_principals(len(PRINCIPAL_DICTS)),
+            record_received=False)
+        self.switches.append(switch)
+        return switch
+
+    def reconnect(self,app,rename_port_number):
+        '''
+        Starts Pluribus, has each principal install some rules, then
+        reconnects the switch, with one of its ports renamed if
+        rename_port_number is not None.
+
+        @returns {tuple} --- (reconnected switch, controllers)
+        '''
+        controllers = []
+        for principal_id, principal_dict in enumerate(PRINCIPAL_DICTS):
+            controller = StandInPrincipalController(
+                principal_id,
+                (principal_dict['listening_ip_addr'],
+                 principal_dict['listening_port_addr']),
+                principal_dict['physical_ports'])
+            hub.spawn(controller.listen)
+            controllers.append(controller)
+
+        deadline = time.time() + TIMEOUT
+        self.process = subprocess.Popen(
+            [sys.executable,'-m','ryu.cmd.manager','--ofp-tcp-listen-port',
+             str(OFP_PORT),APPS[app]],
+            cwd=self.conf_dir,stdout=self.output,stderr=self.output)
+        switch = self.new_switch()
+        self.assertTrue(connect_switch(switch,OFP_PORT,deadline))
+        for controller in controllers:
+            self.assertTrue(
+                controller.handshake_event.wait(deadline - time.time()))
+            controller.send_flow_mods(NUM_FLOW_MODS,NUM_FLOW_MODS)
+        self.assertTrue(wait_for_acks(controllers,deadline))
+        switch.stop()
+
+        new_switch = self.new_switch()
+        if rename_port_number is not None:
+            new_switch.ports = [
+                (port_number,
+                 port_name + '-new' if port_number == rename_port_number
+                 else port_name)
+                for port_number, port_name in new_switch.ports]
+        # let Pluribus notice the old connection died first
+        hub.sleep(.5)
+        self.assertTrue(connect_switch(new_switch,OFP_PORT,deadline))
+        return new_switch, controllers
+
+    def check_refuses_renamed_port(self,app,port_number):
+        new_switch, controllers = self.reconnect(app,port_number)
+        hub.sleep(PORT_STATS_DELAY_TIME + 1)
+        # not even the rules it had before disconnecting get cleared
+        self.assertEqual(new_switch.num_flow_mods,0)
+
+    def test_logical_resyncs_same_ports(self):
+        new_switch, controllers = self.reconnect('logical',None)
+        for controller in controllers:
+            controller.send_flow_mods(1,1)
+        self.assertTrue(wait_for_acks(controllers,time.time() + TIMEOUT))
+        self.assertEqual(
+            new_switch.flow_table.num_entries,
+            len(PRINCIPAL_DICTS)*(NUM_FLOW_MODS + 1) +
+            # head table rules
+            NUM_PHYSICAL_PORTS + len(PRINCIPAL_DICTS))
+
+    def test_logical_refuses_renamed_physical_port(self):
+        self.check_refuses_renamed_port('logical',2)
+
+    def test_logical_refuses_renamed_logical_port(self):
+        self.check_refuses_renamed_port('logical',NUM_PHYSICAL_PORTS + 1)
+
+    def test_chained_refuses_renamed_physical_port(self):
+        self.check_refuses_renamed_port('chained',3)
+
+
+if __name__ == '__main__':
+    unittest.main()